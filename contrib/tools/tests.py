@@ -1,8 +1,24 @@
+import imp
+import os
+import sys
 import unittest
 
 from generate_extension import CamelCase, LowerCaseWithUnderscores
 
 
+# The hook is a script without a .py extension, so load it by path. Don't
+# leave a compiled "repository-hook-pushc" next to it.
+_dont_write_bytecode = sys.dont_write_bytecode
+sys.dont_write_bytecode = True
+
+try:
+    repository_hook_push = imp.load_source(
+        'repository_hook_push',
+        os.path.join(os.path.dirname(__file__), 'repository-hook-push'))
+finally:
+    sys.dont_write_bytecode = _dont_write_bytecode
+
+
 class NamingConventionTests(unittest.TestCase):
     def test_camel_case_test(self):
         convention = CamelCase()
@@ -40,3 +56,21 @@ class NamingConventionTests(unittest.TestCase):
         assert "space_at_start" == convention.convert(" space at start")
         assert "spaces_at_end" == convention.convert("spaces At_end    ")
         assert "idempotent_case" == convention.convert("idempotent_case")
+
+
+class RepositoryHookPushTests(unittest.TestCase):
+    def test_get_push_url(self):
+        get_push_url = repository_hook_push.get_push_url
+        assert ("http://reviews.example.com/api/repositories/1/push/" ==
+                get_push_url("http://reviews.example.com", 1))
+        assert ("http://reviews.example.com/api/repositories/1/push/" ==
+                get_push_url("http://reviews.example.com/", 1))
+        assert ("http://example.com/reviews/api/repositories/2/push/" ==
+                get_push_url("http://example.com/reviews", 2))
+
+    def test_get_push_url_with_local_site(self):
+        get_push_url = repository_hook_push.get_push_url
+        assert ("http://reviews.example.com/s/site/api/repositories/1/push/" ==
+                get_push_url("http://reviews.example.com", 1, "site"))
+        assert ("http://example.com/reviews/s/site/api/repositories/2/push/" ==
+                get_push_url("http://example.com/reviews/", 2, "site"))
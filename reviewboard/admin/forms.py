@@ -479,6 +479,11 @@ class EMailSettingsForm(SiteSettingsForm):
 
 class DiffSettingsForm(SiteSettingsForm):
     """Diff settings for Review Board."""
+    # Fields containing comma-separated lists of file patterns used to
+    # classify files in uploaded diffs.
+    PATTERN_FIELDS = ('vendored_file_patterns', 'generated_file_patterns',
+                      'minified_file_patterns')
+
     diffviewer_syntax_highlighting = forms.BooleanField(
         label=_("Show syntax highlighting"),
         required=False)
@@ -505,6 +510,31 @@ class DiffSettingsForm(SiteSettingsForm):
                     "(e.g., \"*.py, *.txt\")"),
         widget=forms.TextInput(attrs={'size': '60'}))
 
+    vendored_file_patterns = forms.CharField(
+        label=_("Vendored files"),
+        required=False,
+        help_text=_("A comma-separated list of file patterns for third-party "
+                    "code checked into the repository. These files won't be "
+                    "rendered in the diff viewer unless requested. "
+                    "(e.g., \"vendor/*, */third_party/*\")"),
+        widget=forms.TextInput(attrs={'size': '60'}))
+
+    generated_file_patterns = forms.CharField(
+        label=_("Generated files"),
+        required=False,
+        help_text=_("A comma-separated list of file patterns for generated "
+                    "files. These files won't be rendered in the diff viewer "
+                    "unless requested. (e.g., \"*.pb.go, yarn.lock\")"),
+        widget=forms.TextInput(attrs={'size': '60'}))
+
+    minified_file_patterns = forms.CharField(
+        label=_("Minified files"),
+        required=False,
+        help_text=_("A comma-separated list of file patterns for minified "
+                    "files. These files won't be rendered in the diff viewer "
+                    "unless requested. (e.g., \"*.min.js, *.min.css\")"),
+        widget=forms.TextInput(attrs={'size': '60'}))
+
     diffviewer_context_num_lines = forms.IntegerField(
         label=_("Lines of Context"),
         help_text=_("The number of unchanged lines shown above and below "
@@ -532,6 +562,15 @@ class DiffSettingsForm(SiteSettingsForm):
                     'to disable size restrictions.'),
         widget=forms.TextInput(attrs={'size': '15'}))
 
+    diffviewer_prefetch_source_files = forms.BooleanField(
+        label=_('Prefetch source files on upload'),
+        help_text=_('Fetch the original versions of the files in new diffs '
+                    'from the repository in the background when they\'re '
+                    'uploaded, so that the diff viewer doesn\'t need to wait '
+                    'for them later. Each web server process runs its own '
+                    'background thread for this.'),
+        required=False)
+
     def load(self):
         # TODO: Move this check into a dependencies module so we can catch it
         #       when the user starts up Review Board.
@@ -547,23 +586,41 @@ class DiffSettingsForm(SiteSettingsForm):
         self.fields['include_space_patterns'].initial = \
             ', '.join(self.siteconfig.get('diffviewer_include_space_patterns'))
 
+        for field_name in self.PATTERN_FIELDS:
+            self.fields[field_name].initial = ', '.join(
+                self.siteconfig.get('diffviewer_%s' % field_name))
+
     def save(self):
         self.siteconfig.set(
             'diffviewer_include_space_patterns',
             re.split(r",\s*", self.cleaned_data['include_space_patterns']))
 
+        for field_name in self.PATTERN_FIELDS:
+            self.siteconfig.set(
+                'diffviewer_%s' % field_name,
+                [pattern
+                 for pattern in re.split(r",\s*",
+                                         self.cleaned_data[field_name])
+                 if pattern])
+
         super(DiffSettingsForm, self).save()
 
     class Meta:
         title = _("Diff Viewer Settings")
-        save_blacklist = ('include_space_patterns',)
+        save_blacklist = ('include_space_patterns',
+                          'vendored_file_patterns',
+                          'generated_file_patterns',
+                          'minified_file_patterns')
         fieldsets = (
             {
                 'classes': ('wide',),
                 'fields': ('diffviewer_syntax_highlighting',
                            'diffviewer_syntax_highlighting_threshold',
                            'diffviewer_show_trailing_whitespace',
-                           'include_space_patterns'),
+                           'include_space_patterns',
+                           'vendored_file_patterns',
+                           'generated_file_patterns',
+                           'minified_file_patterns'),
             },
             {
                 'title': _("Advanced"),
@@ -574,6 +631,7 @@ class DiffSettingsForm(SiteSettingsForm):
                 ),
                 'classes': ('wide',),
                 'fields': ('diffviewer_max_diff_size',
+                           'diffviewer_prefetch_source_files',
                            'diffviewer_context_num_lines',
                            'diffviewer_paginate_by',
                            'diffviewer_paginate_orphans')
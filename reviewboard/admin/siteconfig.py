@@ -118,13 +118,25 @@ defaults.update({
     'auth_x509_username_regex':            '',
     'auth_x509_autocreate_users':          False,
     'diffviewer_context_num_lines':        5,
+    'diffviewer_generated_file_patterns':  ['*.pb.go', '*_pb2.py',
+                                            '*.pb.h', '*.pb.cc',
+                                            'package-lock.json',
+                                            '*/package-lock.json',
+                                            'yarn.lock', '*/yarn.lock'],
     'diffviewer_include_space_patterns':   [],
     'diffviewer_max_diff_size':            0,
+    'diffviewer_minified_file_patterns':   ['*.min.js', '*.min.css'],
     'diffviewer_paginate_by':              20,
     'diffviewer_paginate_orphans':         10,
+    'diffviewer_prefetch_source_files':    False,
     'diffviewer_syntax_highlighting':      True,
     'diffviewer_syntax_highlighting_threshold': 0,
     'diffviewer_show_trailing_whitespace': True,
+    'diffviewer_vendored_file_patterns':   ['vendor/*', '*/vendor/*',
+                                            'third_party/*',
+                                            '*/third_party/*',
+                                            'node_modules/*',
+                                            '*/node_modules/*'],
     'mail_send_review_mail':               False,
     'mail_send_new_user_mail':             False,
     'search_enable':                       False,
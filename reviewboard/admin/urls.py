@@ -73,6 +73,7 @@ urlpatterns = patterns(
 
     (r'^$', 'dashboard'),
     url(r'^cache/$', 'cache_stats', name='admin-server-cache'),
+    url(r'^scm-health/$', 'scm_health', name='admin-scm-health'),
     (r'^settings/', include(settings_urlpatterns)),
     (r'^widget-toggle/', 'widget_toggle'),
     (r'^widget-activity/', 'widget_activity'),
@@ -17,6 +17,9 @@ from reviewboard.admin.support import get_support_url
 from reviewboard.admin.widgets import (dynamic_activity_data,
                                        primary_widgets,
                                        secondary_widgets)
+from reviewboard.scmtools.health import (LATENCY_BUCKETS,
+                                         get_repository_health)
+from reviewboard.scmtools.models import Repository
 from reviewboard.ssh.client import SSHClient
 from reviewboard.ssh.utils import humanize_key
 
@@ -51,6 +54,27 @@ def cache_stats(request, template_name="admin/cache_stats.html"):
     }))
 
 
+@staff_member_required
+def scm_health(request, template_name="admin/scm_health.html"):
+    """
+    Displays the health of each repository. This includes the number of
+    recent calls to the repository, the error rate, latency and whether
+    the circuit breaker is open.
+    """
+    repositories = [
+        (repository, get_repository_health(repository))
+        for repository in Repository.objects.filter(visible=True)
+                                            .order_by('name')
+    ]
+
+    return render_to_response(template_name, RequestContext(request, {
+        'repositories': repositories,
+        'max_latency': LATENCY_BUCKETS[-1],
+        'title': _("Repository Health"),
+        'root_path': settings.SITE_ROOT + "admin/db/"
+    }))
+
+
 @staff_member_required
 def site_settings(request, form_class,
                   template_name="siteconfig/settings.html"):
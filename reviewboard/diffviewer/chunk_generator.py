@@ -1,13 +1,16 @@
 import fnmatch
+import hashlib
 import re
 from difflib import SequenceMatcher
 
+from django.core.cache import cache
 from django.utils.html import escape
+from django.utils.http import urlquote
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext as _, get_language
 from djblets.log import log_timed
 from djblets.siteconfig.models import SiteConfiguration
-from djblets.util.misc import cache_memoize
+from djblets.util.misc import cache_memoize, make_cache_key
 from pygments import highlight
 from pygments.lexers import get_lexer_for_filename
 from pygments.formatters import HtmlFormatter
@@ -16,6 +19,8 @@ from reviewboard.diffviewer.differ import get_differ
 from reviewboard.diffviewer.diffutils import (get_original_file,
                                               get_patched_file)
 from reviewboard.diffviewer.opcode_generator import get_diff_opcode_generator
+from reviewboard.scmtools.core import HEAD, PRE_CREATION, UNKNOWN
+from reviewboard.scmtools.singleflight import cache_memoize_single_flight
 
 
 class NoWrapperHtmlFormatter(HtmlFormatter):
@@ -75,6 +80,9 @@ class DiffChunkGenerator(object):
          grab a patched file for the interdiff version.
     """
     NEWLINES_RE = re.compile(r'\r?\n')
+    NON_ASCII_RE = re.compile(r'[\x80-\xff]')
+
+    ENCODING_CACHE_PERIOD = 60 * 60 * 24 * 30  # 30 days
 
     # The maximum size a line can be before we start shutting off styling.
     STYLED_MAX_LINE_LEN = 1000
@@ -125,6 +133,11 @@ class DiffChunkGenerator(object):
         If the file is binary or deleted, or if the file has moved with no
         additional changes, then an empty list of chunks will be returned.
 
+        An empty list is also returned for an interdiff when both diffs
+        produce the same file. Such a file has no changed chunks, so it's
+        left out of the interdiff, as it was when a single unchanged chunk
+        was returned for it.
+
         If there are chunks already computed in the cache, they will be
         returned. Otherwise, new chunks will be generated, stored in cache,
         and returned.
@@ -134,9 +147,17 @@ class DiffChunkGenerator(object):
                 self.filediff.source_revision == ''):
             return []
 
-        return cache_memoize(self.make_cache_key(),
-                             lambda: list(self._get_chunks_uncached()),
-                             large_data=True)
+        if self.interfilediff and self._get_interdiff_results_identical():
+            # Both diffs are known to produce the same file, so there are no
+            # changes to show. There's no need to fetch or patch anything.
+            return []
+
+        # Several people often open the same diff at once. Only one process
+        # will generate the chunks, and the others will wait for them.
+        return cache_memoize_single_flight(
+            self.make_cache_key(),
+            lambda: list(self._get_chunks_uncached()),
+            large_data=True)
 
     def _get_chunks_uncached(self):
         """Returns the list of chunks, bypassing the cache."""
@@ -149,29 +170,35 @@ class DiffChunkGenerator(object):
                                                self.request)
             new = get_patched_file(interdiff_orig, self.interfilediff,
                                    self.request)
+
+            old_hash = self._store_patched_file_hash(self.filediff, old)
+            new_hash = self._store_patched_file_hash(self.interfilediff, new)
+
+            if old_hash == new_hash:
+                # Both diffs result in the same file, so there's nothing
+                # to show.
+                return
+
+            old_encoding_key = self._make_encoding_cache_key(self.filediff,
+                                                             True)
+            new_encoding_key = \
+                self._make_encoding_cache_key(self.interfilediff, True)
         elif self.force_interdiff:
             # Basically, revert the change.
             old, new = new, old
+            old_encoding_key = self._make_encoding_cache_key(self.filediff,
+                                                             True)
+            new_encoding_key = self._make_encoding_cache_key(self.filediff,
+                                                             False)
+        else:
+            old_encoding_key = self._make_encoding_cache_key(self.filediff,
+                                                             False)
+            new_encoding_key = self._make_encoding_cache_key(self.filediff,
+                                                             True)
 
         encoding = self.diffset.repository.encoding or 'iso-8859-15'
-        old = self._convert_to_utf8(old, encoding)
-        new = self._convert_to_utf8(new, encoding)
-
-        # Normalize the input so that if there isn't a trailing newline, we add
-        # it.
-        if old and old[-1] != '\n':
-            old += '\n'
-
-        if new and new[-1] != '\n':
-            new += '\n'
-
-        a = self.NEWLINES_RE.split(old or '')
-        b = self.NEWLINES_RE.split(new or '')
-
-        # Remove the trailing newline, now that we've split this. This will
-        # prevent a duplicate line number at the end of the diff.
-        del a[-1]
-        del b[-1]
+        old, a = self._get_decoded_lines(old, encoding, old_encoding_key)
+        new, b = self._get_decoded_lines(new, encoding, new_encoding_key)
 
         a_num_lines = len(a)
         b_num_lines = len(b)
@@ -194,11 +221,13 @@ class DiffChunkGenerator(object):
             except:
                 pass
 
+        # The content has already had its newlines normalized by
+        # _get_decoded_lines, so there's no need for a regex split here.
         if not markup_a:
-            markup_a = self.NEWLINES_RE.split(escape(old))
+            markup_a = escape(old).split('\n')
 
         if not markup_b:
-            markup_b = self.NEWLINES_RE.split(escape(new))
+            markup_b = escape(new).split('\n')
 
         siteconfig = SiteConfiguration.objects.get_current()
         ignore_space = True
@@ -228,9 +257,14 @@ class DiffChunkGenerator(object):
                 request=self.request)
 
         line_num = 1
-        opcodes_generator = get_diff_opcode_generator(self.differ,
-                                                      self.filediff,
-                                                      self.interfilediff)
+
+        if self.interfilediff:
+            opcodes_generator = self._get_interdiff_opcodes(old_hash,
+                                                            new_hash)
+        else:
+            opcodes_generator = get_diff_opcode_generator(self.differ,
+                                                          self.filediff,
+                                                          self.interfilediff)
 
         for tag, i1, i2, j1, j2, meta in opcodes_generator:
             old_lines = markup_a[i1:i2]
@@ -268,6 +302,67 @@ class DiffChunkGenerator(object):
 
         log_timer.done()
 
+    def _make_patched_file_hash_cache_key(self, filediff):
+        """Creates a cache key for the hash of a patched file."""
+        return 'diff-patched-file-hash-%s' % filediff.pk
+
+    def _store_patched_file_hash(self, filediff, data):
+        """Computes and caches the hash of a FileDiff's patched file.
+
+        The stored hashes are used to quickly determine whether two FileDiffs
+        in an interdiff result in the same file. The hash is returned.
+        """
+        return cache_memoize(self._make_patched_file_hash_cache_key(filediff),
+                             lambda: hashlib.sha1(data).hexdigest())
+
+    def _get_interdiff_results_identical(self):
+        """Returns whether both sides of an interdiff are known to be equal.
+
+        This only consults the patched file hashes stored by previous
+        renders. If either hash is unknown, this returns False.
+        """
+        old_key = make_cache_key(
+            self._make_patched_file_hash_cache_key(self.filediff))
+        new_key = make_cache_key(
+            self._make_patched_file_hash_cache_key(self.interfilediff))
+        hashes = cache.get_many([old_key, new_key])
+
+        return (old_key in hashes and new_key in hashes and
+                hashes[old_key] == hashes[new_key])
+
+    def _get_interdiff_opcodes(self, old_hash, new_hash):
+        """Returns the opcodes for an interdiff.
+
+        The opcodes depend only on the uploaded diffs and the patched files
+        they produce, so they're cached based on the hashes of those. This
+        allows them to be reused across reviewers, regardless of language
+        or syntax highlighting settings.
+
+        The differ's interesting lines are cached along with the opcodes,
+        since they're normally computed while generating the opcodes.
+        """
+        key = 'diff-interdiff-opcodes-%s-%s-%s-%s-%s-%s-%s' % (
+            self.filediff.diff_hash_id,
+            self.interfilediff.diff_hash_id,
+            old_hash,
+            new_hash,
+            int(self.differ.ignore_space),
+            self.diffset.diffcompat,
+            urlquote(self.filename))
+
+        def _get_opcodes():
+            opcodes = list(get_diff_opcode_generator(self.differ,
+                                                     self.filediff,
+                                                     self.interfilediff))
+
+            return opcodes, self.differ.interesting_lines
+
+        opcodes, interesting_lines = cache_memoize(key, _get_opcodes,
+                                                   large_data=True)
+        self.differ.interesting_lines = interesting_lines
+
+        return opcodes
+
     def _get_enable_syntax_highlighting(self, old, new, a, b):
         """Returns whether or not we'll be enabling syntax highlighting.
 
@@ -434,25 +529,107 @@ class DiffChunkGenerator(object):
 
         return highlight(data, lexer, NoWrapperHtmlFormatter()).splitlines()
 
-    def _convert_to_utf8(self, s, enc):
+    def _make_encoding_cache_key(self, filediff, patched):
+        """Creates a cache key for the detected encoding of a file.
+
+        An unmodified file from the repository is identified by its
+        repository, path and revision, so the result can be shared by every
+        diff against that file. Anything else (patched files, or files with
+        a parent diff applied) is specific to the FileDiff.
+
+        If the file can't be identified reliably, None is returned.
+        """
+        if (not patched and
+                not filediff.parent_diff_hash_id and
+                not filediff.parent_diff64):
+            if filediff.source_revision in (HEAD, PRE_CREATION, UNKNOWN):
+                return None
+
+            return 'diff-file-encoding:%s:%s:%s' % (
+                self.diffset.repository.pk,
+                urlquote(filediff.source_file),
+                urlquote(filediff.source_revision))
+        elif filediff.pk:
+            return 'diff-file-encoding:filediff:%s:%s' % (
+                filediff.pk, patched and 'patched' or 'orig')
+        else:
+            return None
+
+    def _get_decoded_lines(self, s, enc, encoding_cache_key=None):
+        """Converts a file to UTF-8 and splits it into lines.
+
+        This returns a tuple of the converted file and its list of lines.
+        Line endings are normalized to a single newline, and a trailing
+        newline is added if it's missing, so that the lines can be split
+        with a simple string split. The trailing newline is not represented
+        in the list of lines, which prevents a duplicate line number at the
+        end of the diff.
+        """
+        s = self._convert_to_utf8(s or '', enc, encoding_cache_key)
+
+        if '\r\n' in s:
+            s = s.replace('\r\n', '\n')
+
+        if s and s[-1] != '\n':
+            s += '\n'
+
+        lines = s.split('\n')
+        del lines[-1]
+
+        return s, lines
+
+    def _convert_to_utf8(self, s, enc, encoding_cache_key=None):
         """Returns the passed string as a unicode string.
 
         If conversion to UTF-8 fails, we try the user-specified encoding, which
         defaults to ISO 8859-15.  This can be overridden by users inside the
         repository configuration, which gives users repository-level control
         over file encodings (file-level control is really, really hard).
+
+        Content that's pure ASCII is decoded as such, without trying any
+        other encodings.
+
+        If an encoding_cache_key is provided, the encoding that worked is
+        cached under it, and will be tried first the next time, as long as
+        it's still one of the candidate encodings.
         """
         if isinstance(s, unicode):
             return s.encode('utf-8')
         elif isinstance(s, basestring):
+            if not self.NON_ASCII_RE.search(s):
+                return unicode(s, 'ascii')
+
+            encodings = enc.split(',')
+
+            if encoding_cache_key:
+                encoding_cache_key = make_cache_key(encoding_cache_key)
+                cached_encoding = cache.get(encoding_cache_key)
+
+                if (cached_encoding == 'utf-8' or
+                        cached_encoding in encodings):
+                    try:
+                        u = unicode(s, cached_encoding)
+
+                        if cached_encoding == 'utf-8':
+                            return u
+                        else:
+                            return u.encode('utf-8')
+                    except (UnicodeError, LookupError):
+                        pass
+
             try:
                 # First try strict unicode (for when everything is valid utf-8)
-                return unicode(s, 'utf-8')
+                u = unicode(s, 'utf-8')
+                self._store_encoding(encoding_cache_key, 'utf-8')
+
+                return u
             except UnicodeError:
                 # Now try any candidate encodings.
-                for e in enc.split(','):
+                for e in encodings:
                     try:
                         u = unicode(s, e)
+                        self._store_encoding(encoding_cache_key, e)
+
                         return u.encode('utf-8')
                     except UnicodeError:
                         pass
@@ -468,6 +645,12 @@ class DiffChunkGenerator(object):
         else:
             raise TypeError("Value to convert is unexpected type %s", type(s))
 
+    def _store_encoding(self, encoding_cache_key, encoding):
+        """Stores the encoding detected for a file in the cache."""
+        if encoding_cache_key:
+            cache.set(encoding_cache_key, encoding,
+                      self.ENCODING_CACHE_PERIOD)
+
     def _get_line_changed_regions(self, oldline, newline):
         """Returns regions of changes between two similar lines."""
         if oldline is None or newline is None:
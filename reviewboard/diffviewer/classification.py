@@ -0,0 +1,80 @@
+import fnmatch
+import re
+
+from djblets.siteconfig.models import SiteConfiguration
+
+
+# The classifications that a file in a diff may have. Files that don't fit
+# any of these are left unclassified.
+BINARY = 'binary'
+MINIFIED = 'minified'
+GENERATED = 'generated'
+VENDORED = 'vendored'
+
+CLASSIFICATIONS = (BINARY, MINIFIED, GENERATED, VENDORED)
+
+# The classifications for which the diff viewer will defer rendering until
+# the user explicitly asks for it. Binary files are rendered differently
+# already, and so aren't included.
+DEFERRED_CLASSIFICATIONS = (MINIFIED, GENERATED, VENDORED)
+
+# The number of inserted lines at the start of a file to scan for markers
+# saying that the file is generated.
+GENERATED_MARKER_MAX_LINES = 20
+
+GENERATED_MARKER_RE = re.compile(
+    r'@generated|do not edit|code generated by|autogenerated|'
+    r'automatically generated|generated by the protocol buffer compiler',
+    re.I)
+
+# A file is considered minified if it has at least one inserted line this
+# long, and the inserted lines are this long on average.
+MINIFIED_MAX_LINE_LEN = 1000
+MINIFIED_AVERAGE_LINE_LEN = 200
+
+
+def classify_file(filename, data, binary=False):
+    """Classifies a file in a diff based on its name and content.
+
+    The filename is matched against the configurable lists of patterns for
+    vendored, generated and minified files. If nothing matches, the inserted
+    lines in the diff data are inspected for generated file markers and
+    signs of minification.
+
+    This returns one of the classifications in CLASSIFICATIONS, or None
+    if the file is a regular file.
+    """
+    if binary or '\0' in data:
+        return BINARY
+
+    siteconfig = SiteConfiguration.objects.get_current()
+    filename = filename.lstrip('/')
+
+    for classification, setting in (
+            (VENDORED, 'diffviewer_vendored_file_patterns'),
+            (GENERATED, 'diffviewer_generated_file_patterns'),
+            (MINIFIED, 'diffviewer_minified_file_patterns')):
+        for pattern in siteconfig.get(setting):
+            if pattern and fnmatch.fnmatch(filename, pattern):
+                return classification
+
+    inserted_lines = [
+        line[1:]
+        for line in data.splitlines()
+        if line.startswith('+') and not line.startswith('+++')
+    ]
+
+    if not inserted_lines:
+        return None
+
+    for line in inserted_lines[:GENERATED_MARKER_MAX_LINES]:
+        if GENERATED_MARKER_RE.search(line):
+            return GENERATED
+
+    line_lens = [len(line) for line in inserted_lines]
+
+    if (max(line_lens) >= MINIFIED_MAX_LINE_LEN and
+            sum(line_lens) / len(line_lens) >= MINIFIED_AVERAGE_LINE_LEN):
+        return MINIFIED
+
+    return None
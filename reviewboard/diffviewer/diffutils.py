@@ -1,13 +1,16 @@
 from __future__ import with_statement
+import logging
 import os
 import re
 import subprocess
 import tempfile
 
-from django.utils.translation import ugettext as _
+from django.core.cache import cache
+from django.utils.translation import ugettext as _, get_language
 from djblets.log import log_timed
 from djblets.siteconfig.models import SiteConfiguration
 from djblets.util.contextmanagers import controlled_subprocess
+from djblets.util.misc import cache_memoize, make_cache_key
 
 from reviewboard.accounts.models import Profile
 from reviewboard.admin.checks import get_can_enable_syntax_highlighting
@@ -147,6 +150,41 @@ def get_original_file(filediff, request=None):
     return data
 
 
+def prefetch_original_files(filediffs, request=None):
+    """Fetches the original files for several FileDiffs at once.
+
+    The files are fetched in bulk through Repository.get_files, which
+    places them in the cache. Later calls to get_original_file for these
+    FileDiffs won't need to go to the repository.
+
+    Errors are ignored. They'll be raised again when the file is fetched
+    individually.
+    """
+    groups = {}
+
+    for filediff in filediffs:
+        if filediff.source_revision in (PRE_CREATION, ''):
+            continue
+
+        diffset = filediff.diffset
+        key = (diffset.repository_id, diffset.base_commit_id)
+
+        if key not in groups:
+            groups[key] = (diffset.repository, [])
+
+        groups[key][1].append((filediff.source_file,
+                               filediff.source_revision))
+
+    for (repository_id, base_commit_id), (repository, files) in \
+            groups.iteritems():
+        try:
+            repository.get_files(files, base_commit_id=base_commit_id,
+                                 request=request)
+        except Exception, e:
+            logging.debug('Unable to prefetch %d files from repository '
+                          '%s: %s', len(files), repository_id, e)
+
+
 def get_patched_file(buffer, filediff, request=None):
     tool = filediff.diffset.repository.get_scmtool()
     diff = tool.normalize_patch(filediff.diff, filediff.source_file,
@@ -174,7 +212,35 @@ def get_diff_files(diffset, filediff=None, interdiffset=None, request=None):
 
     This can be used along with populate_diff_chunks to build a full list
     containing all diff chunks used for rendering a side-by-side diff.
+
+    The resulting list is cached per diffset/interdiffset pair (and filediff,
+    if provided), so repeated lookups don't have to hit the database or
+    construct SCMTools again.
     """
+    if diffset.pk is None:
+        return _get_diff_files_uncached(diffset, filediff, interdiffset,
+                                        request)
+
+    key = 'diff-files-%s-%s-%s-%s' % (
+        diffset.pk,
+        interdiffset and interdiffset.pk or 'none',
+        filediff and filediff.pk or 'all',
+        get_language())
+
+    return cache_memoize(
+        key,
+        lambda: _get_diff_files_uncached(diffset, filediff, interdiffset,
+                                         request))
+
+
+def _get_diff_files_uncached(diffset, filediff=None, interdiffset=None,
+                             request=None):
+    """Generates a list of files that will be displayed in a diff.
+
+    This does the work for get_diff_files, bypassing the cache.
+    """
+    from reviewboard.diffviewer.models import FileDiff
+
     if filediff:
         filediffs = [filediff]
 
@@ -189,7 +255,7 @@ def get_diff_files(diffset, filediff=None, interdiffset=None, request=None):
                                   (diffset.id, filediff.id),
                                   request=request)
     else:
-        filediffs = diffset.files.select_related().all()
+        filediffs = []
 
         if interdiffset:
             log_timer = log_timed("Generating diff file info for "
@@ -201,15 +267,32 @@ def get_diff_files(diffset, filediff=None, interdiffset=None, request=None):
                                   "diffset id %s" % diffset.id,
                                   request=request)
 
+    # Fetch the filediffs for both the diffset and interdiffset in one go,
+    # along with the repository and tool information needed below.
+    if filediff and interdiffset:
+        queryset = FileDiff.objects.filter(diffset=interdiffset,
+                                           source_file=filediff.source_file)
+    elif filediff:
+        queryset = None
+    elif interdiffset:
+        queryset = FileDiff.objects.filter(diffset__in=[diffset,
+                                                        interdiffset])
+    else:
+        queryset = FileDiff.objects.filter(diffset=diffset)
+
     # A map used to quickly look up the equivalent interfilediff given a
     # source file.
     interdiff_map = {}
 
-    if interdiffset:
-        for interfilediff in interdiffset.files.all():
-            if (not filediff or
-                    filediff.source_file == interfilediff.source_file):
-                interdiff_map[interfilediff.source_file] = interfilediff
+    if queryset is not None:
+        queryset = queryset.select_related('diffset__repository__tool')
+
+        for temp_filediff in queryset:
+            if not filediff and temp_filediff.diffset_id == diffset.pk:
+                filediffs.append(temp_filediff)
+
+            if interdiffset and temp_filediff.diffset_id == interdiffset.pk:
+                interdiff_map[temp_filediff.source_file] = temp_filediff
 
     # In order to support interdiffs properly, we need to display diffs
     # on every file in the union of both diffsets. Iterating over one diffset
@@ -243,6 +326,9 @@ def get_diff_files(diffset, filediff=None, interdiffset=None, request=None):
             for interdiff in interdiff_map.itervalues()
         ]
 
+    # SCMTools can be expensive to construct, so only build one for each
+    # repository involved.
+    tools = {}
     files = []
 
     for parts in filediff_parts:
@@ -253,9 +339,8 @@ def get_diff_files(diffset, filediff=None, interdiffset=None, request=None):
         if interdiffset:
             # First, find out if we want to even process this one.
             # We only process if there's a difference in files.
-
             if (filediff and interfilediff and
-                    filediff.diff == interfilediff.diff):
+                    _filediff_diffs_equal(filediff, interfilediff)):
                 continue
 
             source_revision = _("Diff Revision %s") % diffset.revision
@@ -282,7 +367,12 @@ def get_diff_files(diffset, filediff=None, interdiffset=None, request=None):
             basepath = ""
             basename = filediff.source_file
 
-        tool = filediff.diffset.repository.get_scmtool()
+        repository = filediff.diffset.repository
+
+        if repository.pk not in tools:
+            tools[repository.pk] = repository.get_scmtool()
+
+        tool = tools[repository.pk]
         depot_filename = tool.normalize_path_for_display(filediff.source_file)
         dest_filename = tool.normalize_path_for_display(filediff.dest_file)
 
@@ -297,6 +387,8 @@ def get_diff_files(diffset, filediff=None, interdiffset=None, request=None):
             'interfilediff': interfilediff,
             'force_interdiff': force_interdiff,
             'binary': filediff.binary,
+            'classification': filediff.classification,
+            'deferred': False,
             'deleted': filediff.deleted,
             'moved': filediff.moved,
             'newfile': newfile,
@@ -306,27 +398,33 @@ def get_diff_files(diffset, filediff=None, interdiffset=None, request=None):
                             not filediff.parent_diff),
         })
 
-    def cmp_file(x, y):
-        # Sort based on basepath in asc order
-        if x["basepath"] != y["basepath"]:
-            return cmp(x["basepath"], y["basepath"])
-
-        # Sort based on filename in asc order, then based on extension in desc
-        # order, to make *.h be ahead of *.c/cpp
-        x_file, x_ext = os.path.splitext(x["basename"])
-        y_file, y_ext = os.path.splitext(y["basename"])
-        if x_file != y_file:
-            return cmp(x_file, y_file)
-        else:
-            return cmp(y_ext, x_ext)
-
-    files.sort(cmp_file)
+    # Sort based on basepath in asc order, then based on filename in asc
+    # order, and then based on extension in desc order, to make *.h be ahead
+    # of *.c/cpp. Python's sort is stable, so we sort by the least
+    # significant key first.
+    files.sort(key=lambda f: os.path.splitext(f['basename'])[1],
+               reverse=True)
+    files.sort(key=lambda f: (f['basepath'],
+                              os.path.splitext(f['basename'])[0]))
 
     log_timer.done()
 
     return files
 
 
+def _filediff_diffs_equal(filediff, interfilediff):
+    """Returns whether two FileDiffs contain the same diff.
+
+    Diff contents are stored by their SHA1 hash, so we can compare the hash
+    IDs without loading either diff. Legacy FileDiffs that haven't been
+    migrated yet fall back on comparing the diff contents.
+    """
+    if filediff.diff_hash_id and interfilediff.diff_hash_id:
+        return filediff.diff_hash_id == interfilediff.diff_hash_id
+
+    return filediff.diff == interfilediff.diff
+
+
 def populate_diff_chunks(files, enable_syntax_highlighting=True,
                          request=None):
     """Populates a list of diff files with chunk data.
@@ -337,12 +435,38 @@ def populate_diff_chunks(files, enable_syntax_highlighting=True,
     """
     from reviewboard.diffviewer.chunk_generator import get_diff_chunk_generator
 
-    for diff_file in files:
-        generator = get_diff_chunk_generator(request,
-                                             diff_file['filediff'],
-                                             diff_file['interfilediff'],
-                                             diff_file['force_interdiff'],
-                                             enable_syntax_highlighting)
+    generators = [
+        get_diff_chunk_generator(request,
+                                 diff_file['filediff'],
+                                 diff_file['interfilediff'],
+                                 diff_file['force_interdiff'],
+                                 enable_syntax_highlighting)
+        for diff_file in files
+    ]
+
+    if len(generators) > 1:
+        # Fetch the original files for any chunks that need to be generated
+        # in one go, rather than one file at a time.
+        cache_keys = [
+            make_cache_key(generator.make_cache_key())
+            for generator in generators
+        ]
+        cached_keys = cache.get_many(cache_keys)
+        filediffs = []
+
+        for generator, cache_key in zip(generators, cache_keys):
+            if (cache_key not in cached_keys and
+                    not generator.filediff.binary and
+                    not generator.filediff.deleted):
+                filediffs.append(generator.filediff)
+
+                if generator.interfilediff:
+                    filediffs.append(generator.interfilediff)
+
+        if filediffs:
+            prefetch_original_files(filediffs, request)
+
+    for diff_file, generator in zip(files, generators):
         chunks = generator.get_chunks()
 
         diff_file.update({
@@ -7,4 +7,7 @@ SEQUENCE = [
     'diffsethistory_diff_updated',
     'filediffdata_line_counts',
     'diffset_base_commit_id',
+    'filediffdata_extra_data',
+    'diffset_counts',
+    'filediff_classification',
 ]
@@ -0,0 +1,10 @@
+from django.db import models
+from django_evolution.mutations import AddField
+
+
+MUTATIONS = [
+    AddField('DiffSet', 'file_count', models.IntegerField, null=True),
+    AddField('DiffSet', 'binary_file_count', models.IntegerField, null=True),
+    AddField('DiffSet', 'insert_count', models.IntegerField, null=True),
+    AddField('DiffSet', 'delete_count', models.IntegerField, null=True),
+]
@@ -0,0 +1,8 @@
+from django.db import models
+from django_evolution.mutations import AddField
+
+
+MUTATIONS = [
+    AddField('FileDiff', 'classification', models.CharField, max_length=16,
+             null=True),
+]
@@ -0,0 +1,7 @@
+from django_evolution.mutations import AddField
+from djblets.util.fields import JSONField
+
+
+MUTATIONS = [
+    AddField('FileDiffData', 'extra_data', JSONField, null=True)
+]
@@ -0,0 +1,90 @@
+import optparse
+import sys
+from multiprocessing import Pool
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+
+from reviewboard.diffviewer.models import DiffSet
+
+
+def _recalculate_counts(pks):
+    """Recalculates the counts on a batch of DiffSets.
+
+    This is run in a worker process, and returns the number of DiffSets
+    that were processed.
+    """
+    count = 0
+
+    for diffset in DiffSet.objects.filter(pk__in=pks):
+        diffset.recalculate_counts()
+        count += 1
+
+    return count
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option('--batch-size', type='int', dest='batch_size',
+                             default=100,
+                             help='The number of diffsets to process in '
+                                  'each batch'),
+        optparse.make_option('--processes', type='int', dest='processes',
+                             default=1,
+                             help='The number of worker processes to use'),
+        optparse.make_option('--recalculate', action='store_true',
+                             dest='recalculate', default=False,
+                             help='Recalculate the counts for all diffsets, '
+                                  'not just those missing them'),
+    )
+    help = ("Stores the file and line counts on all diffsets that don't "
+            "have them yet.\n\n"
+            "This can be safely interrupted and run again, and will pick up "
+            "where it left off.")
+
+    def handle_noargs(self, **options):
+        batch_size = options['batch_size']
+        processes = options['processes']
+
+        if batch_size < 1 or processes < 1:
+            sys.stderr.write('--batch-size and --processes must be at '
+                             'least 1.\n')
+            sys.exit(1)
+
+        queryset = DiffSet.objects.all()
+
+        if not options['recalculate']:
+            queryset = queryset.filter(file_count__isnull=True)
+
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+        total = len(pks)
+
+        if total == 0:
+            self.stdout.write('All diffsets are up to date.\n')
+            return
+
+        batches = [
+            pks[i:i + batch_size]
+            for i in xrange(0, total, batch_size)
+        ]
+
+        if processes == 1:
+            results = (_recalculate_counts(batch) for batch in batches)
+        else:
+            # The database connection can't be shared with the worker
+            # processes, so close it before forking. Each process will
+            # open its own.
+            connection.close()
+            pool = Pool(processes)
+            results = pool.imap_unordered(_recalculate_counts, batches)
+
+        done = 0
+
+        for count in results:
+            done += count
+            self.stdout.write('Processed %d/%d diffsets (%d%%)\n'
+                              % (done, total, done * 100 / total))
+
+        if processes > 1:
+            pool.close()
+            pool.join()
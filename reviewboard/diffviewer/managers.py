@@ -6,6 +6,7 @@ from django.utils.translation import ugettext as _
 from djblets.siteconfig.models import SiteConfiguration
 from djblets.util.fields import Base64DecodedValue
 
+from reviewboard.diffviewer.classification import classify_file
 from reviewboard.diffviewer.differ import DEFAULT_DIFF_COMPAT_VERSION
 from reviewboard.diffviewer.errors import DiffTooBigError, EmptyDiffError
 from reviewboard.scmtools.core import PRE_CREATION, UNKNOWN, FileNotFoundError
@@ -92,6 +93,7 @@ class DiffSetManager(models.Manager):
         """
         from reviewboard.diffviewer.models import FileDiff
 
+        siteconfig = SiteConfiguration.objects.get_current()
         tool = repository.get_scmtool()
 
         files = list(self._process_files(
@@ -141,11 +143,17 @@ class DiffSetManager(models.Manager):
             history=diffset_history,
             repository=repository,
             diffcompat=DEFAULT_DIFF_COMPAT_VERSION,
-            base_commit_id=base_commit_id)
+            base_commit_id=base_commit_id,
+            file_count=len(files),
+            binary_file_count=len([f for f in files if f.binary]),
+            insert_count=sum([f.insert_count for f in files]),
+            delete_count=sum([f.delete_count for f in files]))
 
         if save:
             diffset.save()
 
+        filediffs = []
+
         for f in files:
             if f.origFile in parent_files:
                 parent_file = parent_files[f.origFile]
@@ -176,12 +184,24 @@ class DiffSetManager(models.Manager):
                                 diff=f.data,
                                 parent_diff=parent_content,
                                 binary=f.binary,
-                                status=status)
+                                status=status,
+                                classification=classify_file(dest_file,
+                                                             f.data,
+                                                             f.binary))
             filediff.set_line_counts(f.insert_count, f.delete_count)
 
             if save:
                 filediff.save()
 
+            if not f.binary:
+                filediffs.append(filediff)
+
+        if (save and filediffs and
+                siteconfig.get('diffviewer_prefetch_source_files')):
+            from reviewboard.diffviewer.prefetch import queue_prefetch
+
+            queue_prefetch(filediffs)
+
         return diffset
 
     def _process_files(self, parser, basedir, repository, base_commit_id,
@@ -4,9 +4,13 @@ import logging
 from django.db import models
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
-from djblets.util.fields import Base64Field
+from djblets.util.fields import Base64Field, JSONField
 
+from reviewboard.diffviewer.classification import (BINARY, GENERATED,
+                                                   MINIFIED, VENDORED,
+                                                   DEFERRED_CLASSIFICATIONS)
 from reviewboard.diffviewer.managers import FileDiffDataManager, DiffSetManager
+from reviewboard.diffviewer.processors import get_chunk_ranges
 from reviewboard.scmtools.core import PRE_CREATION
 from reviewboard.scmtools.models import Repository
 
@@ -26,6 +30,8 @@ class FileDiffData(models.Model):
     insert_count = models.IntegerField(null=True, blank=True)
     delete_count = models.IntegerField(null=True, blank=True)
 
+    extra_data = JSONField(null=True)
+
     def recalculate_line_counts(self, tool):
         """Recalculates the insert_count and delete_count values.
 
@@ -47,6 +53,22 @@ class FileDiffData(models.Model):
             self.delete_count = file_info.delete_count
             self.save()
 
+    def get_chunk_ranges(self):
+        """Returns the ranges of lines covered by each chunk in the diff.
+
+        These are used when filtering interdiffs, and are computed when the
+        diff is first stored. Older diffs will have them computed and saved
+        on first access.
+        """
+        if 'chunk_ranges' not in self.extra_data:
+            logging.debug('Calculating chunk ranges on FileDiffData %s'
+                          % self.pk)
+
+            self.extra_data['chunk_ranges'] = get_chunk_ranges(self.binary)
+            self.save()
+
+        return self.extra_data['chunk_ranges']
+
 
 class FileDiff(models.Model):
     """
@@ -65,6 +87,13 @@ class FileDiff(models.Model):
         (DELETED, _('Deleted')),
     )
 
+    CLASSIFICATIONS = (
+        (BINARY, _('Binary')),
+        (MINIFIED, _('Minified')),
+        (GENERATED, _('Generated')),
+        (VENDORED, _('Vendored')),
+    )
+
     diffset = models.ForeignKey('DiffSet',
                                 related_name='files',
                                 verbose_name=_("diff set"))
@@ -83,6 +112,9 @@ class FileDiff(models.Model):
     parent_diff_hash = models.ForeignKey('FileDiffData', null=True, blank=True,
                                          related_name='parent_filediff_set')
     status = models.CharField(_("status"), max_length=1, choices=STATUSES)
+    classification = models.CharField(_("classification"), max_length=16,
+                                      choices=CLASSIFICATIONS, blank=True,
+                                      null=True)
 
     @property
     def source_file_display(self):
@@ -106,6 +138,16 @@ class FileDiff(models.Model):
     def is_new(self):
         return self.source_revision == PRE_CREATION
 
+    @property
+    def is_deferred(self):
+        """Returns whether rendering of this file should be deferred.
+
+        Minified, generated and vendored files are expensive to diff and
+        rarely interesting to review, so the diff viewer won't render them
+        unless asked to.
+        """
+        return self.classification in DEFERRED_CLASSIFICATIONS
+
     def _get_diff(self):
         if not self.diff_hash:
             self._migrate_diff_data()
@@ -120,6 +162,11 @@ class FileDiff(models.Model):
             binary_hash=hashkey, defaults={'binary': diff})
         self.diff64 = ""
 
+        if is_new:
+            # Store the chunk ranges up-front, so that interdiffs don't need
+            # to parse them out of the diff when rendering.
+            self.diff_hash.get_chunk_ranges()
+
     diff = property(_get_diff, _set_diff)
 
     def _get_parent_diff(self):
@@ -162,6 +209,13 @@ class FileDiff(models.Model):
 
         return self.diff_hash.delete_count
 
+    @property
+    def chunk_ranges(self):
+        if not self.diff_hash:
+            self._migrate_diff_data()
+
+        return self.diff_hash.get_chunk_ranges()
+
     def set_line_counts(self, insert_count, delete_count):
         """Sets the insert/delete line count on the FileDiff."""
         if not self.diff_hash:
@@ -260,8 +314,69 @@ class DiffSet(models.Model):
         _('commit ID'), max_length=64, blank=True, null=True, db_index=True,
         help_text=_('The ID/revision this change is built upon.'))
 
+    # These are null by default so that we can tell which older diffsets
+    # still need to have them calculated.
+    file_count = models.IntegerField(_('file count'), null=True, blank=True)
+    binary_file_count = models.IntegerField(_('binary file count'),
+                                            null=True, blank=True)
+    insert_count = models.IntegerField(_('insert count'), null=True,
+                                       blank=True)
+    delete_count = models.IntegerField(_('delete count'), null=True,
+                                       blank=True)
+
     objects = DiffSetManager()
 
+    def get_counts(self):
+        """Returns the file and line counts for the diffset.
+
+        This returns a dictionary containing ``file_count``,
+        ``binary_file_count``, ``insert_count`` and ``delete_count``.
+
+        These are stored when the diffset is created. Older diffsets will
+        have them calculated from their FileDiffs and saved first.
+        """
+        if None in (self.file_count, self.binary_file_count,
+                    self.insert_count, self.delete_count):
+            self.recalculate_counts()
+
+        return {
+            'file_count': self.file_count,
+            'binary_file_count': self.binary_file_count,
+            'insert_count': self.insert_count,
+            'delete_count': self.delete_count,
+        }
+
+    def recalculate_counts(self):
+        """Recalculates the file and line counts from the FileDiffs.
+
+        This will calculate the line counts on any FileDiffs that don't
+        have them yet, and then save the totals on the diffset.
+        """
+        logging.debug('Recalculating file and line counts on DiffSet %s'
+                      % self.pk)
+
+        self.file_count = 0
+        self.binary_file_count = 0
+        self.insert_count = 0
+        self.delete_count = 0
+
+        for filediff in self.files.select_related('diff_hash'):
+            self.file_count += 1
+
+            if filediff.binary:
+                self.binary_file_count += 1
+
+            self.insert_count += filediff.insert_count or 0
+            self.delete_count += filediff.delete_count or 0
+
+        # We don't want to go through save() here, as that would update
+        # the timestamp on the DiffSetHistory.
+        DiffSet.objects.filter(pk=self.pk).update(
+            file_count=self.file_count,
+            binary_file_count=self.binary_file_count,
+            insert_count=self.insert_count,
+            delete_count=self.delete_count)
+
     def save(self, **kwargs):
         """
         Saves this diffset.
@@ -1,7 +1,7 @@
 import re
 
-from reviewboard.diffviewer.processors import (filter_interdiff_opcodes,
-                                               merge_adjacent_chunks)
+from reviewboard.diffviewer.processors import (
+    filter_interdiff_opcodes_by_ranges, merge_adjacent_chunks)
 
 
 class DiffOpcodeGenerator(object):
@@ -37,8 +37,10 @@ class DiffOpcodeGenerator(object):
         if self.interfilediff:
             # Filter out any lines unrelated to these changes from the
             # interdiff. This will get rid of any merge information.
-            opcodes = filter_interdiff_opcodes(opcodes, self.filediff.diff,
-                                               self.interfilediff.diff)
+            opcodes = filter_interdiff_opcodes_by_ranges(
+                opcodes,
+                self.filediff.chunk_ranges,
+                self.interfilediff.chunk_ranges)
 
             # From the filtered content, we may have ended up with consecutive
             # "equal" chunks, so merge them.
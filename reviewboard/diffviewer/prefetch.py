@@ -0,0 +1,81 @@
+from __future__ import with_statement
+
+import logging
+import threading
+from Queue import Empty, Full, Queue
+
+from django.db import connection
+
+from reviewboard.diffviewer.diffutils import prefetch_original_files
+from reviewboard.scmtools.health import untracked_calls
+
+
+# The maximum number of uploaded diffsets waiting to be prefetched. Beyond
+# this, new diffsets aren't prefetched, and their files will be fetched
+# when first viewed instead.
+MAX_QUEUED_DIFFSETS = 100
+
+_queue = Queue(MAX_QUEUED_DIFFSETS)
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def queue_prefetch(filediffs):
+    """Queues the original files for new FileDiffs to be prefetched.
+
+    The files are fetched by a background thread into the file cache, so
+    that the diff viewer doesn't need to wait for the repository when the
+    diff is first viewed. The FileDiffs should be from a single diffset.
+
+    Each web server process that receives uploads starts its own thread,
+    which runs until the process exits. Files still waiting to be fetched
+    when the process exits are dropped, and are fetched when the diff is
+    viewed instead.
+
+    Calls made to repositories by the thread aren't recorded in their
+    health, so prefetching can't open a repository's circuit breaker.
+    """
+    _start_worker()
+
+    try:
+        _queue.put_nowait(list(filediffs))
+    except Full:
+        logging.warning('Too many diffsets are waiting to be prefetched. '
+                        'Skipping prefetch of %d files.', len(filediffs))
+
+
+def _start_worker():
+    global _worker
+
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run_worker,
+                                       name='Source file prefetcher')
+            _worker.daemon = True
+            _worker.start()
+
+
+def _run_worker():
+    while True:
+        batches = [_queue.get()]
+
+        # Take everything else that's waiting too, so that files from the
+        # same repository are fetched together.
+        while True:
+            try:
+                batches.append(_queue.get_nowait())
+            except Empty:
+                break
+
+        try:
+            with untracked_calls():
+                prefetch_original_files(sum(batches, []))
+        except Exception, e:
+            logging.exception('Unexpected error prefetching source files: '
+                              '%s', e)
+        finally:
+            # Don't hold a database connection open while idle.
+            connection.close()
+
+            for batch in batches:
+                _queue.task_done()
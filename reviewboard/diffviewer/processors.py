@@ -14,6 +14,31 @@ CHUNK_RANGE_RE = re.compile(
 CHUNK_RANGE_ASSUMED_CONTEXT_LEN = 3
 
 
+def get_chunk_ranges(diff):
+    """Returns the ranges of lines covered by each chunk in a diff.
+
+    Each range is a (start, end) pair of 0-based line numbers in the
+    modified file, adjusted for the assumed amount of context. This is used
+    to filter the opcodes of an interdiff.
+    """
+    ranges = []
+
+    for m in CHUNK_RANGE_RE.finditer(diff):
+        new_start = int(m.group('new_start'))
+        new_len = int(m.group('new_len') or 1) or 1
+
+        if new_len >= 0:
+            new_end = new_start + new_len
+
+            # We reduce by 1 because the chunk ranges in diffs start at 1.
+            ranges.append((
+                new_start - 1 + CHUNK_RANGE_ASSUMED_CONTEXT_LEN,
+                new_end - 1 + CHUNK_RANGE_ASSUMED_CONTEXT_LEN
+            ))
+
+    return ranges
+
+
 def filter_interdiff_opcodes(opcodes, filediff_data, interfilediff_data):
     """Filters the opcodes for an interdiff to remove unnecessary lines.
 
@@ -25,27 +50,19 @@ def filter_interdiff_opcodes(opcodes, filediff_data, interfilediff_data):
     possible. It will only output non-"equal" opcodes if it falls into the
     ranges of lines dictated in the uploaded diff files.
     """
-    def _find_range_info(diff):
-        ranges = []
-
-        for m in CHUNK_RANGE_RE.finditer(diff):
-            new_start = int(m.group('new_start'))
-            new_len = int(m.group('new_len')) or 1
+    return filter_interdiff_opcodes_by_ranges(
+        opcodes,
+        get_chunk_ranges(filediff_data),
+        get_chunk_ranges(interfilediff_data))
 
-            if new_len >= 0:
-                new_end = new_start + new_len
 
-                # We reduce by 1 because the chunk ranges in diffs start at 1.
-                ranges.append((
-                    new_start - 1 + CHUNK_RANGE_ASSUMED_CONTEXT_LEN,
-                    new_end - 1 + CHUNK_RANGE_ASSUMED_CONTEXT_LEN
-                ))
-
-        return ranges
-
-    orig_ranges = _find_range_info(filediff_data)
-    new_ranges = _find_range_info(interfilediff_data)
+def filter_interdiff_opcodes_by_ranges(opcodes, orig_ranges, new_ranges):
+    """Filters the opcodes for an interdiff using precomputed chunk ranges.
 
+    This works like filter_interdiff_opcodes, but takes the chunk ranges
+    (as returned by get_chunk_ranges) for each diff instead of the diffs
+    themselves, so that they don't need to be parsed again.
+    """
     orig_range_i = 0
     new_range_i = 0
 
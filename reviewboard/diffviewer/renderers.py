@@ -108,6 +108,9 @@ class DiffRenderer(object):
         if self.chunk_index is not None:
             key += '-chunk-%s' % self.chunk_index
 
+        if self.diff_file.get('deferred'):
+            key += '-deferred'
+
         if self.collapse_all:
             key += '-collapsed'
 
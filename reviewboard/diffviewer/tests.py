@@ -1,15 +1,20 @@
 import os
 import unittest
 
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.http import HttpResponse
 from djblets.siteconfig.models import SiteConfiguration
-from djblets.util.misc import cache_memoize
+from djblets.util.misc import cache_memoize, make_cache_key
 from kgb import SpyAgency
 
 import reviewboard.diffviewer.diffutils as diffutils
 import reviewboard.diffviewer.parser as diffparser
+import reviewboard.diffviewer.prefetch as prefetch
 from reviewboard.diffviewer.chunk_generator import DiffChunkGenerator
+from reviewboard.diffviewer.classification import (BINARY, GENERATED,
+                                                   MINIFIED, VENDORED,
+                                                   classify_file)
 from reviewboard.diffviewer.errors import UserVisibleError
 from reviewboard.diffviewer.forms import UploadDiffForm
 from reviewboard.diffviewer.models import DiffSet, FileDiff
@@ -17,6 +22,7 @@ from reviewboard.diffviewer.myersdiff import MyersDiffer
 from reviewboard.diffviewer.opcode_generator import get_diff_opcode_generator
 from reviewboard.diffviewer.renderers import DiffRenderer
 from reviewboard.diffviewer.processors import (filter_interdiff_opcodes,
+                                               get_chunk_ranges,
                                                merge_adjacent_chunks)
 from reviewboard.diffviewer.templatetags.difftags import highlightregion
 from reviewboard.scmtools.models import Repository, Tool
@@ -566,6 +572,120 @@ class DbTests(TestCase):
 
         self.assertEquals(filediff1.diff_hash, filediff2.diff_hash)
 
+    def test_diff_chunk_ranges(self):
+        """Testing that chunk ranges are stored along with new diffs"""
+        repository = self.create_repository()
+        diffset = DiffSet.objects.create(name='test',
+                                         revision=1,
+                                         repository=repository)
+        filediff = FileDiff(diff='@@ -22,7 +22,7 @@\n',
+                            diffset=diffset)
+        filediff.save()
+
+        filediff = FileDiff.objects.get(pk=filediff.pk)
+        self.assertEqual(filediff.diff_hash.extra_data['chunk_ranges'],
+                         [[24, 31]])
+        self.assertEqual(filediff.chunk_ranges, [[24, 31]])
+
+    def test_diffset_get_counts(self):
+        """Testing DiffSet.get_counts calculating missing counts"""
+        repository = self.create_repository(tool_name='Test')
+        diffset = DiffSet.objects.create(name='test',
+                                         revision=1,
+                                         repository=repository)
+        FileDiff.objects.create(
+            diff=('diff --git a/README b/README\n'
+                  'index d6613f5..5b50866 100644\n'
+                  '--- README\n'
+                  '+++ README\n'
+                  '@@ -1,1 +1,2 @@\n'
+                  '-a\n'
+                  '+b\n'
+                  '+c\n'),
+            diffset=diffset)
+
+        filediff = FileDiff(diff='', binary=True, diffset=diffset)
+        filediff.set_line_counts(0, 0)
+        filediff.save()
+
+        diffset = DiffSet.objects.get(pk=diffset.pk)
+        self.assertEqual(diffset.file_count, None)
+        self.assertEqual(diffset.get_counts(), {
+            'file_count': 2,
+            'binary_file_count': 1,
+            'insert_count': 2,
+            'delete_count': 1,
+        })
+
+        diffset = DiffSet.objects.get(pk=diffset.pk)
+        self.assertEqual(diffset.file_count, 2)
+        self.assertEqual(diffset.insert_count, 2)
+
+
+class ClassificationTests(TestCase):
+    """Unit tests for file classification."""
+    def test_classify_binary(self):
+        """Testing classify_file with binary files"""
+        self.assertEqual(classify_file('/foo.png', '', binary=True), BINARY)
+        self.assertEqual(classify_file('/foo.dat', '+\0\1\n'), BINARY)
+
+    def test_classify_by_pattern(self):
+        """Testing classify_file with configured file patterns"""
+        self.assertEqual(classify_file('/src/vendor/lib.py', '+a\n'),
+                         VENDORED)
+        self.assertEqual(classify_file('/vendor/lib.py', '+a\n'), VENDORED)
+        self.assertEqual(classify_file('/proto/foo_pb2.py', '+a\n'),
+                         GENERATED)
+        self.assertEqual(classify_file('/static/app.min.js', '+a\n'),
+                         MINIFIED)
+        self.assertEqual(classify_file('/src/app.js', '+a\n'), None)
+
+    def test_classify_by_custom_pattern(self):
+        """Testing classify_file with custom file patterns"""
+        siteconfig = SiteConfiguration.objects.get_current()
+        old_patterns = siteconfig.get('diffviewer_generated_file_patterns')
+        siteconfig.set('diffviewer_generated_file_patterns', ['*.gen.c'])
+        siteconfig.save()
+
+        try:
+            self.assertEqual(classify_file('/src/foo.gen.c', '+a\n'),
+                             GENERATED)
+            self.assertEqual(classify_file('/proto/foo_pb2.py', '+a\n'),
+                             None)
+        finally:
+            siteconfig.set('diffviewer_generated_file_patterns',
+                           old_patterns)
+            siteconfig.save()
+
+    def test_classify_generated_by_content(self):
+        """Testing classify_file with generated file markers"""
+        data = (
+            '--- foo.c\n'
+            '+++ foo.c\n'
+            '@@ -0,0 +1,2 @@\n'
+            '+/* This file is automatically generated. DO NOT EDIT. */\n'
+            '+int x;\n'
+        )
+        self.assertEqual(classify_file('/foo.c', data), GENERATED)
+
+    def test_classify_minified_by_content(self):
+        """Testing classify_file with minified content"""
+        data = (
+            '--- foo.js\n'
+            '+++ foo.js\n'
+            '@@ -0,0 +1,1 @@\n'
+            '+%s\n' % ('var a=1;' * 200)
+        )
+        self.assertEqual(classify_file('/foo.js', data), MINIFIED)
+
+        data = (
+            '--- foo.js\n'
+            '+++ foo.js\n'
+            '@@ -0,0 +1,1 @@\n'
+            '+var a = 1;\n'
+        )
+        self.assertEqual(classify_file('/foo.js', data), None)
+
 
 class DiffSetManagerTests(SpyAgency, TestCase):
     """Unit tests for DiffSetManager."""
@@ -592,6 +712,88 @@ class DiffSetManagerTests(SpyAgency, TestCase):
             repository, 'diff', diff, None, None, None, '/', None)
 
         self.assertEqual(diffset.files.count(), 1)
+        self.assertEqual(diffset.file_count, 1)
+        self.assertEqual(diffset.binary_file_count, 0)
+        self.assertEqual(diffset.insert_count, 1)
+        self.assertEqual(diffset.delete_count, 1)
+
+    def test_creating_with_classified_files(self):
+        """Test creating a DiffSet classifies the files"""
+        diff = (
+            'diff --git a/vendor/README b/vendor/README\n'
+            'index d6613f5..5b50866 100644\n'
+            '--- vendor/README\n'
+            '+++ vendor/README\n'
+            '@ -1,1 +1,1 @@\n'
+            '-blah..\n'
+            '+blah blah\n'
+            'diff --git a/README b/README\n'
+            'index d6613f5..5b50866 100644\n'
+            '--- README\n'
+            '+++ README\n'
+            '@ -1,1 +1,1 @@\n'
+            '-blah..\n'
+            '+blah blah\n'
+        )
+
+        repository = self.create_repository(tool_name='Test')
+
+        self.spy_on(repository.get_file_exists,
+                    call_fake=lambda *args, **kwargs: True)
+
+        diffset = DiffSet.objects.create_from_data(
+            repository, 'diff', diff, None, None, None, '/', None)
+
+        files = dict([
+            (filediff.source_file, filediff)
+            for filediff in diffset.files.all()
+        ])
+        self.assertEqual(files['/vendor/README'].classification, VENDORED)
+        self.assertTrue(files['/vendor/README'].is_deferred)
+        self.assertEqual(files['/README'].classification, None)
+        self.assertFalse(files['/README'].is_deferred)
+
+    def test_creating_with_prefetch(self):
+        """Test creating a DiffSet prefetches source files when enabled"""
+        diff = (
+            'diff --git a/README b/README\n'
+            'index d6613f5..5b50866 100644\n'
+            '--- README\n'
+            '+++ README\n'
+            '@ -1,1 +1,1 @@\n'
+            '-blah..\n'
+            '+blah blah\n'
+            'diff --git a/NEWS b/NEWS\n'
+            'new file mode 100644\n'
+            'index 0000000..5b50866\n'
+            '--- /dev/null\n'
+            '+++ NEWS\n'
+            '@ -0,0 +1,1 @@\n'
+            '+blah blah\n'
+        )
+
+        siteconfig = SiteConfiguration.objects.get_current()
+        siteconfig.set('diffviewer_prefetch_source_files', True)
+        siteconfig.save()
+
+        repository = self.create_repository(tool_name='Test')
+
+        self.spy_on(repository.get_file_exists,
+                    call_fake=lambda *args, **kwargs: True)
+        self.spy_on(repository.get_files,
+                    call_fake=lambda *args, **kwargs: ['blah..\n'])
+
+        try:
+            DiffSet.objects.create_from_data(
+                repository, 'diff', diff, None, None, None, '/', None)
+            prefetch._queue.join()
+        finally:
+            siteconfig.set('diffviewer_prefetch_source_files', False)
+            siteconfig.save()
+
+        self.assertEqual(len(repository.get_files.spy.calls), 1)
+        self.assertEqual(repository.get_files.spy.calls[0].args[0],
+                         [('/README', 'd6613f5')])
 
 
 class UploadDiffFormTests(SpyAgency, TestCase):
@@ -826,6 +1028,25 @@ class ProcessorsTests(TestCase):
             ('equal', 190, 232, 197, 239),
         ])
 
+    def test_get_chunk_ranges(self):
+        """Testing get_chunk_ranges"""
+        diff = (
+            '@@ -22,7 +22,7 @@\n'
+            '@@ -50 +50 @@\n'
+        )
+
+        self.assertEqual(get_chunk_ranges(diff), [(24, 31), (52, 53)])
+
+    def test_get_chunk_ranges_with_single_lines(self):
+        """Testing get_chunk_ranges with single-line hunks"""
+        diff = (
+            '@@ -1 +1 @@\n'
+            '@@ -10,2 +10 @@\n'
+            '@@ -20 +19,0 @@\n'
+        )
+
+        self.assertEqual(get_chunk_ranges(diff), [(3, 4), (12, 13), (21, 22)])
+
     def test_merge_adjacent_chunks(self):
         """Testing merge_adjacent_chunks"""
         opcodes = [
@@ -849,8 +1070,51 @@ class ProcessorsTests(TestCase):
         ])
 
 
+class DiffUtilsTests(TestCase):
+    """Unit tests for diffutils."""
+    fixtures = ['test_scmtools']
+
+    def test_get_diff_files_sorting(self):
+        """Testing get_diff_files sorts header files before implementation"""
+        repository = self.create_repository(tool_name='Test')
+        diffset = self.create_diffset(repository=repository)
+        self.create_filediff(diffset, source_file='/src/foo.c',
+                             dest_file='/src/foo.c', diff='a')
+        self.create_filediff(diffset, source_file='/foo.c',
+                             dest_file='/foo.c', diff='b')
+        self.create_filediff(diffset, source_file='/src/foo.h',
+                             dest_file='/src/foo.h', diff='c')
+
+        files = diffutils.get_diff_files(diffset)
+
+        self.assertEqual([f['depot_filename'] for f in files],
+                         ['/foo.c', '/src/foo.h', '/src/foo.c'])
+
+    def test_get_diff_files_interdiff_same_hash(self):
+        """Testing get_diff_files skips interdiff files with identical diffs"""
+        repository = self.create_repository(tool_name='Test')
+        diffset = self.create_diffset(repository=repository)
+        interdiffset = self.create_diffset(repository=repository, revision=2)
+
+        self.create_filediff(diffset, source_file='/same', diff='same')
+        filediff = self.create_filediff(diffset, source_file='/changed',
+                                        diff='old')
+        self.create_filediff(interdiffset, source_file='/same', diff='same')
+        interfilediff = self.create_filediff(interdiffset,
+                                             source_file='/changed',
+                                             diff='new')
+
+        files = diffutils.get_diff_files(diffset, interdiffset=interdiffset)
+
+        self.assertEqual(len(files), 1)
+        self.assertEqual(files[0]['filediff'].pk, filediff.pk)
+        self.assertEqual(files[0]['interfilediff'].pk, interfilediff.pk)
+
+
 class DiffChunkGeneratorTests(TestCase):
     """Unit tests for DiffChunkGenerator."""
+    fixtures = ['test_scmtools']
+
     def test_get_line_changed_regions(self):
         """Testing DiffChunkGenerator._get_line_changed_regions"""
         def deep_equal(A, B):
@@ -884,6 +1148,126 @@ class DiffChunkGeneratorTests(TestCase):
         regions = generator._get_line_changed_regions(old, new)
         deep_equal(regions, (None, None))
 
+    def test_convert_to_utf8_ascii(self):
+        """Testing DiffChunkGenerator._convert_to_utf8 with ASCII content"""
+        generator = self._create_generator()
+        data = 'This is plain ASCII.\n'
+
+        result = generator._convert_to_utf8(data, 'iso-8859-15')
+        self.assertTrue(isinstance(result, unicode))
+        self.assertEqual(result, u'This is plain ASCII.\n')
+
+    def test_convert_to_utf8_caches_encoding(self):
+        """Testing DiffChunkGenerator._convert_to_utf8 caches the detected
+        encoding
+        """
+        generator = self._create_generator()
+
+        self.assertEqual(
+            generator._convert_to_utf8('caf\xe9', 'iso-8859-15', 'test-key'),
+            'caf\xc3\xa9')
+        self.assertEqual(cache.get(make_cache_key('test-key')), 'iso-8859-15')
+
+        self.assertEqual(
+            generator._convert_to_utf8('caf\xc3\xa9', 'iso-8859-15',
+                                       'test-key-2'),
+            u'caf\xe9')
+        self.assertEqual(cache.get(make_cache_key('test-key-2')), 'utf-8')
+
+    def test_convert_to_utf8_ignores_old_cached_encoding(self):
+        """Testing DiffChunkGenerator._convert_to_utf8 ignores a cached
+        encoding that's no longer a candidate
+        """
+        generator = self._create_generator()
+        cache.set(make_cache_key('test-key'), 'koi8-r')
+
+        self.assertEqual(
+            generator._convert_to_utf8('caf\xe9', 'iso-8859-15', 'test-key'),
+            'caf\xc3\xa9')
+        self.assertEqual(cache.get(make_cache_key('test-key')), 'iso-8859-15')
+
+    def test_get_decoded_lines(self):
+        """Testing DiffChunkGenerator._get_decoded_lines"""
+        generator = self._create_generator()
+
+        self.assertEqual(generator._get_decoded_lines('', 'iso-8859-15'),
+                         ('', []))
+        self.assertEqual(
+            generator._get_decoded_lines('a\r\nb\nc', 'iso-8859-15'),
+            ('a\nb\nc\n', ['a', 'b', 'c']))
+
+    def test_get_chunks_interdiff_identical_results(self):
+        """Testing DiffChunkGenerator.get_chunks with interdiffs resulting in
+        the same file
+        """
+        filediff, interfilediff = self._create_identical_interdiff()
+
+        generator = DiffChunkGenerator(None, filediff, interfilediff, True)
+        self.assertEqual(generator.get_chunks(), [])
+        self.assertTrue(generator._get_interdiff_results_identical())
+
+    def test_populate_diff_chunks_interdiff_identical_results(self):
+        """Testing populate_diff_chunks with interdiffs resulting in the same
+        file
+        """
+        filediff, interfilediff = self._create_identical_interdiff()
+        files = [{
+            'filediff': filediff,
+            'interfilediff': interfilediff,
+            'force_interdiff': True,
+        }]
+
+        diffutils.populate_diff_chunks(files)
+
+        # With no changed chunks, the file isn't shown in the interdiff.
+        self.assertEqual(files[0]['chunks'], [])
+        self.assertEqual(files[0]['changed_chunk_indexes'], [])
+        self.assertEqual(files[0]['num_changes'], 0)
+
+    def _create_identical_interdiff(self):
+        repository = self.create_repository(tool_name='Test')
+        diffset = self.create_diffset(repository=repository)
+        interdiffset = self.create_diffset(repository=repository, revision=2)
+
+        filediff = self.create_filediff(
+            diffset,
+            source_file='/newfile',
+            dest_file='/newfile',
+            source_revision='PRE-CREATION',
+            diff=(
+                'diff --git a/newfile b/newfile\n'
+                'new file mode 100644\n'
+                'index 0000000..ac30bd4\n'
+                '--- /dev/null\n'
+                '+++ b/newfile\n'
+                '@@ -0,0 +1 @@\n'
+                '+This is a new file!\n'
+            ))
+        interfilediff = self.create_filediff(
+            interdiffset,
+            source_file='/newfile',
+            dest_file='/newfile',
+            source_revision='PRE-CREATION',
+            diff=(
+                'diff --git a/newfile b/newfile\n'
+                'new file mode 100644\n'
+                'index 0000000..ac30bd4\n'
+                '--- /dev/null\n'
+                '+++ b/newfile\n'
+                '@@ -0,0 +1,1 @@\n'
+                '+This is a new file!\n'
+            ))
+        self.assertNotEqual(filediff.diff_hash_id, interfilediff.diff_hash_id)
+
+        return filediff, interfilediff
+
+    def _create_generator(self):
+        repository = self.create_repository(tool_name='Test')
+        diffset = self.create_diffset(repository=repository)
+        filediff = self.create_filediff(diffset)
+
+        return DiffChunkGenerator(None, filediff)
+
 
 class DiffRendererTests(SpyAgency, TestCase):
     """Unit tests for DiffRenderer."""
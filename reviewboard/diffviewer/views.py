@@ -215,6 +215,9 @@ class DiffFragmentView(View):
     The caller may also pass ``?lines-of-context=`` as a query parameter to
     the URL to indicate how many lines of context should be provided around
     the chunk.
+
+    Minified, generated and vendored files won't have their diffs computed
+    unless ``?render-anyway=1`` is passed, or a specific chunk is requested.
     """
     template_name = 'diffviewer/diff_file_fragment.html'
     error_template_name = 'diffviewer/diff_fragment_error.html'
@@ -321,6 +324,8 @@ class DiffFragmentView(View):
         else:
             collapseall = get_collapse_diff(self.request)
 
+        self.render_anyway = (chunkindex is not None or
+                              self.request.GET.get('render-anyway') == '1')
         self.diff_file = self._get_requested_diff_file()
 
         if not self.diff_file:
@@ -361,8 +366,21 @@ class DiffFragmentView(View):
                                request=self.request)
 
         if get_chunks:
-            populate_diff_chunks(files, self.highlighting,
-                                 request=self.request)
+            if (files and not self.render_anyway and
+                    files[0]['filediff'].is_deferred):
+                # Computing the diff for this file is expensive and not very
+                # useful, so leave it up to the user to ask for it.
+                files[0].update({
+                    'deferred': True,
+                    'chunks': [],
+                    'num_chunks': 0,
+                    'changed_chunk_indexes': [],
+                    'num_changes': 0,
+                    'whitespace_only': False,
+                })
+            else:
+                populate_diff_chunks(files, self.highlighting,
+                                     request=self.request)
 
         if files:
             assert len(files) == 1
@@ -162,6 +162,9 @@ class GitHub(HostingService):
 
     RAW_MIMETYPE = 'application/vnd.github.v3.raw'
 
+    # The default number of items per page in the GitHub API.
+    commits_page_size = 30
+
     def get_api_url(self, hosting_url):
         """Returns the API URL for GitHub.
 
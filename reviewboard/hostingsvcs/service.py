@@ -32,6 +32,11 @@ class HostingService(object):
     supports_ssh_key_association = False
     self_hosted = False
 
+    # The number of commits returned by get_commits, when more are
+    # available. If this is set, repositories can list commits from their
+    # commit index instead of calling get_commits.
+    commits_page_size = None
+
     # These values are defaults that can be overridden in repository_plans
     # above.
     needs_authorization = False
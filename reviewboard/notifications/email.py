@@ -290,7 +290,9 @@ def mail_review_request(review_request, changedesc=None, on_close=False):
     else:
         extra_recipients = None
 
-    extra_context = {}
+    extra_context = {
+        'diffset': review_request.get_latest_diffset(),
+    }
 
     if on_close:
         changedesc = review_request.changedescs.filter(public=True).latest()
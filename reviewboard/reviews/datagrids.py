@@ -466,6 +466,44 @@ class DiffUpdatedSinceColumn(DateTimeSinceColumn):
             return ""
 
 
+class DiffSizeColumn(Column):
+    """Shows the number of lines inserted and deleted in the latest diff.
+
+    This uses the counts stored on the diffset, so no diffs need to be
+    loaded or parsed to render it.
+    """
+    LATEST_DIFFSET_SQL = """
+        SELECT diffviewer_diffset.%s
+          FROM diffviewer_diffset
+          WHERE diffviewer_diffset.history_id =
+                reviews_reviewrequest.diffset_history_id
+          ORDER BY diffviewer_diffset.revision DESC
+          LIMIT 1
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(DiffSizeColumn, self).__init__(
+            _("Diff Size"), link=False, shrink=True, sortable=False,
+            css_class="diff-size", *args, **kwargs)
+
+    def augment_queryset(self, queryset):
+        return queryset.extra(select={
+            'diffset_insert_count': self.LATEST_DIFFSET_SQL % 'insert_count',
+            'diffset_delete_count': self.LATEST_DIFFSET_SQL % 'delete_count',
+        })
+
+    def render_data(self, review_request):
+        insert_count = review_request.diffset_insert_count
+        delete_count = review_request.diffset_delete_count
+
+        if insert_count is None or delete_count is None:
+            return ""
+
+        return ('<span class="insert-count">+%d</span> '
+                '<span class="delete-count">-%d</span>'
+                % (insert_count, delete_count))
+
+
 class BugsColumn(Column):
     """Shows the list of bugs specified on a review request.
 
@@ -543,6 +581,7 @@ class ReviewRequestDataGrid(DataGrid):
         css_class=lambda r: ageid(r.diffset_history.last_diff_updated))
 
     review_count = ReviewCountColumn()
+    diff_size = DiffSizeColumn()
 
     target_groups = GroupsColumn()
     target_people = PeopleColumn()
@@ -353,6 +353,8 @@ class ViewTests(TestCase):
     fixtures = ['test_users', 'test_scmtools', 'test_site']
 
     def setUp(self):
+        super(ViewTests, self).setUp()
+
         self.siteconfig = SiteConfiguration.objects.get_current()
         self.siteconfig.set("auth_require_sitewide_login", False)
         self.siteconfig.save()
@@ -1,9 +1,14 @@
+from __future__ import with_statement
+
 import calendar
 from datetime import datetime, timedelta
 import re
+import threading
 import time
 import urlparse
 
+from django.utils.datastructures import SortedDict
+
 try:
     from bzrlib import bzrdir, revisionspec
     from bzrlib.errors import BzrError, NotBranchError
@@ -84,6 +89,68 @@ if has_bzrlib:
                             'RBRemoteSSHTransport')
 
 
+# Opened branches and revision trees are kept for the life of the process,
+# so that fetching many files from the same revision (as for a diff) only
+# opens the branch and builds the revision's tree once. Branches are keyed
+# by repository, so that repositories sharing a location don't share
+# branches. The least recently used are discarded beyond these limits.
+MAX_BRANCHES = 20
+MAX_REVISION_TREES = 50
+
+# How long the revision a revspec (such as a date, or last:1) refers to is
+# kept. New commits can change it, so it can't be kept for long. revid:
+# revspecs always refer to the same revision, and are kept like trees.
+REVSPEC_CACHE_TIME = 60
+
+_branches = SortedDict()
+_revision_trees = SortedDict()
+_revision_ids = SortedDict()
+_cache_lock = threading.Lock()
+
+
+def _get_cached(cache, key):
+    """Returns an item from an LRU cache, or None."""
+    with _cache_lock:
+        value = cache.pop(key, None)
+
+        if value is not None:
+            cache[key] = value
+
+        return value
+
+
+def _set_cached(cache, key, value, max_size):
+    """Stores an item in an LRU cache."""
+    with _cache_lock:
+        cache.pop(key, None)
+        cache[key] = value
+
+        while len(cache) > max_size:
+            del cache[iter(cache).next()]
+
+
+def _evict_branch(branch):
+    """Removes a branch, and its revision trees, from the caches.
+
+    This returns whether the branch was cached.
+    """
+    with _cache_lock:
+        branch_keys = [
+            key
+            for key, entry in _branches.iteritems()
+            if entry[0] is branch
+        ]
+
+        for key in branch_keys:
+            del _branches[key]
+
+        for cache in (_revision_trees, _revision_ids):
+            for key in [key for key in cache if key[0] is branch]:
+                del cache[key]
+
+        return bool(branch_keys)
+
+
 class BZRTool(SCMTool):
     """An interface to the Bazaar SCM (http://bazaar-vcs.org/)"""
     name = "Bazaar"
@@ -110,24 +177,26 @@ class BZRTool(SCMTool):
         revspec = self._revspec_from_revision(revision)
         filepath = self._get_full_path(path)
 
-        branch = None
         try:
-            try:
-                branch, relpath = bzrdir.BzrDir.open_containing_tree_or_branch(filepath)[1:]
-                branch.lock_read()
-                revtree = revisionspec.RevisionSpec.from_string(revspec).as_tree(branch)
-                fileid = revtree.path2id(relpath)
-                if fileid:
-                    contents = revtree.get_file_text(fileid)
-                else:
-                    contents = ""
-            except BzrError, e:
-                raise SCMError(e)
-        finally:
-            if branch:
-                branch.unlock()
+            branch, branch_lock, relpath = self._get_branch(filepath)
 
-        return contents
+            try:
+                return self._get_file_text(branch, branch_lock, relpath,
+                                           revspec)
+            except BzrError:
+                # A cached branch may no longer be usable (for instance, if
+                # its connection was dropped or the branch was moved).
+                # Forget it and its trees, and try once more with a newly
+                # opened branch.
+                if not _evict_branch(branch):
+                    raise
+
+                branch, branch_lock, relpath = self._get_branch(filepath)
+
+                return self._get_file_text(branch, branch_lock, relpath,
+                                           revspec)
+        except BzrError, e:
+            raise SCMError(e)
 
     def parse_diff_revision(self, file_str, revision_str, *args, **kwargs):
         if revision_str == BZRTool.PRE_CREATION_TIMESTAMP:
@@ -161,6 +230,96 @@ class BZRTool(SCMTool):
 
         return final_path
 
+    def _get_branch(self, filepath):
+        """Returns the branch containing a file, and the file's path in it.
+
+        Opened branches are cached. bzrlib objects aren't thread-safe, so
+        the branch is returned along with a lock that must be held while
+        using it or its revision trees.
+        """
+        location, query = filepath.partition('?')[::2]
+        repository_pk = self.repository.pk
+
+        with _cache_lock:
+            for key in _branches:
+                base_repository_pk, base, base_query = key
+
+                if (base_repository_pk == repository_pk and
+                        base_query == query and
+                        location.startswith(base)):
+                    break
+            else:
+                key = None
+
+        # bzrlib unescapes the paths it returns, so leave paths that may
+        # contain escapes for it to work out.
+        if key and '%' not in location:
+            entry = _get_cached(_branches, key)
+
+            if entry:
+                return entry + (location[len(key[1]):],)
+
+        branch, relpath = \
+            bzrdir.BzrDir.open_containing_tree_or_branch(filepath)[1:]
+        entry = (branch, threading.Lock())
+
+        # The branch can only be found again from a file's path if we can
+        # tell where the branch ends in this one.
+        if relpath and location.endswith('/' + relpath):
+            _set_cached(_branches,
+                        (repository_pk, location[:-len(relpath)], query),
+                        entry, MAX_BRANCHES)
+
+        return entry + (relpath,)
+
+    def _get_file_text(self, branch, branch_lock, relpath, revspec):
+        """Returns the contents of a file in a revision of a branch.
+
+        An empty string is returned if the file doesn't exist in that
+        revision.
+        """
+        with branch_lock:
+            branch.lock_read()
+
+            try:
+                revtree = self._get_revision_tree(branch, revspec)
+                fileid = revtree.path2id(relpath)
+
+                if fileid:
+                    return revtree.get_file_text(fileid)
+                else:
+                    return ""
+            finally:
+                branch.unlock()
+
+    def _get_revision_tree(self, branch, revspec):
+        """Returns the tree for a revision of a branch.
+
+        The branch must be locked. Revision trees, and the revisions that
+        revspecs refer to, are cached.
+        """
+        key = (branch, revspec)
+        cached = _get_cached(_revision_ids, key)
+
+        if (cached is not None and
+                (revspec.startswith('revid:') or
+                 time.time() - cached[1] < REVSPEC_CACHE_TIME)):
+            revision_id = cached[0]
+        else:
+            revision_id = revisionspec.RevisionSpec.from_string(revspec) \
+                .as_revision_id(branch)
+            _set_cached(_revision_ids, key, (revision_id, time.time()),
+                        MAX_REVISION_TREES)
+
+        key = (branch, revision_id)
+        revtree = _get_cached(_revision_trees, key)
+
+        if revtree is None:
+            revtree = branch.repository.revision_tree(revision_id)
+            _set_cached(_revision_trees, key, revtree, MAX_REVISION_TREES)
+
+        return revtree
+
     def _revspec_from_revision(self, revision):
         """Returns a revspec based on the revision found in the diff.
 
@@ -1,7 +1,17 @@
+from __future__ import with_statement
+
+import atexit
+import io
+import logging
 import os
 import re
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
+
+from django.utils.datastructures import SortedDict
 
 from reviewboard.diffviewer.parser import DiffParser
 from reviewboard.scmtools.core import SCMTool, HEAD, PRE_CREATION
@@ -30,6 +40,204 @@ else:
     _popen_shell = False
 
 
+class ClearToolProcess(object):
+    """A long-running interactive cleartool(1) process.
+
+    Commands are written to the process's standard input, one per line,
+    and their output is read back. This saves starting a new cleartool,
+    which is slow, for each command.
+
+    cleartool is run with -status, which makes it print a line with the
+    command's exit status after each command. That line marks the end of
+    the command's output.
+
+    Error messages are written to a temporary file, so that they aren't
+    mixed into the output. cleartool can't block writing to a file, as it
+    could with a pipe that isn't being read. The file is emptied after each
+    command's messages are read, so that it doesn't grow for the life of
+    the process.
+    """
+    STATUS_RE = re.compile(r'Command \d+ returned status (\d+)\s*$')
+
+    def __init__(self, cwd):
+        fd, self._errors_path = tempfile.mkstemp(
+            prefix='reviewboard-cleartool.')
+        os.close(fd)
+
+        self._errors = io.open(self._errors_path, 'r+b')
+        errors_out = open(self._errors_path, 'ab')
+
+        try:
+            self.p = self._popen(cwd, errors_out)
+        finally:
+            errors_out.close()
+
+    def run(self, args):
+        """Runs a cleartool command.
+
+        This returns a tuple of the command's exit status, its output, and
+        any error messages it printed.
+
+        If the process has died or returns something unexpected, an IOError
+        will be raised, and the process should not be used again.
+        """
+        self.p.stdin.write('%s\n' % ' '.join([
+            self._quote(arg)
+            for arg in args
+        ]))
+        self.p.stdin.flush()
+
+        output = []
+
+        while True:
+            line = self.p.stdout.readline()
+
+            if not line:
+                raise IOError('cleartool exited unexpectedly: %s%s'
+                              % (''.join(output), self._read_errors()))
+
+            # Output that doesn't end in a newline (such as from
+            # describe -fmt) is followed by the status on the same line.
+            m = self.STATUS_RE.search(line)
+
+            if m:
+                output.append(line[:m.start()])
+                return (int(m.group(1)), ''.join(output),
+                        self._read_errors())
+
+            output.append(line)
+
+    def close(self):
+        """Shuts down the process."""
+        try:
+            self.p.stdin.write('quit\n')
+            self.p.stdin.close()
+            self.p.wait()
+        except (IOError, OSError):
+            pass
+
+        self._errors.close()
+
+        try:
+            os.unlink(self._errors_path)
+        except OSError:
+            pass
+
+    def _read_errors(self):
+        """Returns the error messages printed since the last command.
+
+        cleartool opens the file for appending, so once it's emptied,
+        later messages are written from the start again.
+        """
+        errors = self._errors.read()
+
+        if errors:
+            self._errors.seek(0)
+            self._errors.truncate()
+
+        return errors
+
+    def _popen(self, cwd, stderr):
+        return subprocess.Popen(
+            ['cleartool', '-status'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            cwd=cwd,
+            shell=_popen_shell)
+
+    def _quote(self, arg):
+        if '"' in arg:
+            return "'%s'" % arg
+        else:
+            return '"%s"' % arg
+
+
+class ClearToolSession(object):
+    """A cleartool process shared by all users of a view.
+
+    Commands are run one at a time. If the process dies, it's restarted
+    and the command is retried once.
+    """
+    process_class = ClearToolProcess
+
+    def __init__(self, cwd):
+        self.cwd = cwd
+        self._process = None
+        self._lock = threading.Lock()
+
+    def run(self, args):
+        """Runs a cleartool command, returning its output.
+
+        If the command fails, an SCMError is raised with its error messages,
+        or its output if there were none.
+        """
+        with self._lock:
+            for retry in (False, True):
+                if self._process is None:
+                    self._process = self.process_class(self.cwd)
+
+                try:
+                    status, output, errors = self._process.run(args)
+                    break
+                except (IOError, OSError), e:
+                    self._process.close()
+                    self._process = None
+
+                    if retry:
+                        raise SCMError(str(e))
+
+                    logging.warning('cleartool for %s failed. Restarting '
+                                    'it: %s', self.cwd, e)
+
+        if status != 0:
+            raise SCMError(errors or output)
+
+        return output
+
+    def close(self):
+        """Shuts down the cleartool process, if running."""
+        with self._lock:
+            if self._process is not None:
+                self._process.close()
+                self._process = None
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_cleartool_session(cwd):
+    """Returns the shared cleartool session for a directory."""
+    with _sessions_lock:
+        try:
+            return _sessions[cwd]
+        except KeyError:
+            session = ClearToolSession(cwd)
+            _sessions[cwd] = session
+
+            return session
+
+
+def _shutdown_sessions():
+    for session in _sessions.values():
+        session.close()
+
+
+atexit.register(_shutdown_sessions)
+
+
+# Results of cleartool queries that don't change, cached for the life of
+# the process. The object kinds of up to MAX_OBJECT_KINDS recently used
+# elements are kept.
+MAX_OBJECT_KINDS = 10000
+
+_vobs_tags = {}
+_vobs_uuids = {}
+_object_kinds = SortedDict()
+_cache_lock = threading.Lock()
+
+
 class ClearCaseTool(SCMTool):
     name = 'ClearCase'
     uses_atomic_revisions = False
@@ -149,19 +357,8 @@ class ClearCaseTool(SCMTool):
         }
 
     def _get_view_type(self, repopath):
-        cmdline = ["cleartool", "lsview", "-full", "-properties", "-cview"]
-        p = subprocess.Popen(
-            cmdline,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=repopath,
-            shell=_popen_shell)
-
-        (res, error) = p.communicate()
-        failure = p.poll()
-
-        if failure:
-            raise SCMError(error)
+        res = get_cleartool_session(repopath).run(
+            ["lsview", "-full", "-properties", "-cview"])
 
         for line in res.splitlines(True):
             splitted = line.split(' ')
@@ -174,59 +371,60 @@ class ClearCaseTool(SCMTool):
         return self.VIEW_UNKNOWN
 
     def _get_vobs_tag(self, repopath):
-        cmdline = ["cleartool", "describe", "-short", "vob:."]
-        p = subprocess.Popen(
-            cmdline,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=self.repopath,
-            shell=_popen_shell)
+        with _cache_lock:
+            if repopath in _vobs_tags:
+                return _vobs_tags[repopath]
 
-        (res, error) = p.communicate()
-        failure = p.poll()
+        res = get_cleartool_session(self.repopath).run(
+            ["describe", "-short", "vob:."])
+        vobstag = res.rstrip()
 
-        if failure:
-            raise SCMError(error)
+        with _cache_lock:
+            _vobs_tags[repopath] = vobstag
 
-        return res.rstrip()
+        return vobstag
 
     def _get_vobs_uuid(self, vobstag):
-        cmdline = ["cleartool", "lsvob", "-long", vobstag]
-        p = subprocess.Popen(
-            cmdline,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=self.repopath,
-            shell=_popen_shell)
-
-        (res, error) = p.communicate()
-        failure = p.poll()
+        with _cache_lock:
+            if vobstag in _vobs_uuids:
+                return _vobs_uuids[vobstag]
 
-        if failure:
-            raise SCMError(error)
+        res = get_cleartool_session(self.repopath).run(
+            ["lsvob", "-long", vobstag])
 
         for line in res.splitlines(True):
             if line.startswith('Vob family uuid:'):
-                return line.split(' ')[-1].rstrip()
+                uuid = line.split(' ')[-1].rstrip()
+
+                with _cache_lock:
+                    _vobs_uuids[vobstag] = uuid
+
+                return uuid
 
         raise SCMError("Can't find familly uuid for vob: %s" % vobstag)
 
     def _get_object_kind(self, extended_path):
-        cmdline = ["cleartool", "desc", "-fmt", "%m", extended_path]
-        p = subprocess.Popen(
-            cmdline,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=self.repopath,
-            shell=_popen_shell)
+        key = (self.repopath, extended_path)
+
+        with _cache_lock:
+            if key in _object_kinds:
+                _object_kinds[key] = _object_kinds.pop(key)
+                return _object_kinds[key]
+
+        res = get_cleartool_session(self.repopath).run(
+            ["desc", "-fmt", "%m", extended_path])
+        okind = res.strip()
 
-        (res, error) = p.communicate()
-        failure = p.poll()
+        # Elements never change kind, but other objects (such as
+        # view-private files) may become elements later.
+        if okind.endswith(' element'):
+            with _cache_lock:
+                _object_kinds[key] = okind
 
-        if failure:
-            raise SCMError(error)
+                while len(_object_kinds) > MAX_OBJECT_KINDS:
+                    del _object_kinds[iter(_object_kinds).next()]
 
-        return res.strip()
+        return okind
 
     def get_file(self, extended_path, revision=HEAD):
         """Return content of file or list content of directory"""
@@ -330,19 +528,8 @@ class ClearCaseDiffParser(DiffParser):
         return linenum
 
     def _oid2filename(self, oid):
-        cmdline = ["cleartool", "describe", "-fmt", "%En@@%Vn", "oid:%s" % oid]
-        p = subprocess.Popen(
-            cmdline,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=self.repopath,
-            shell=_popen_shell)
-
-        (res, error) = p.communicate()
-        failure = p.poll()
-
-        if failure:
-            raise SCMError(error)
+        res = get_cleartool_session(self.repopath).run(
+            ["describe", "-fmt", "%En@@%Vn", "oid:%s" % oid])
 
         drive = os.path.splitdrive(self.repopath)[0]
         if drive:
@@ -373,29 +560,21 @@ class ClearCaseSnapshotViewClient(object):
         self.path = path
 
     def cat_file(self, extended_path, revision):
-        import tempfile
-        # Use tempfile to generate temporary filename
-        temp = tempfile.NamedTemporaryFile()
-        # Remove the file, so cleartool can write to it
-        temp.close()
-
-        cmdline = ["cleartool", "get", "-to", temp.name, extended_path]
-        p = subprocess.Popen(
-            cmdline,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=_popen_shell)
-
-        (res, error) = p.communicate()
-        failure = p.poll()
-
-        if failure:
-            raise FileNotFoundError(extended_path, revision)
+        # cleartool needs to write the file somewhere, so give it a
+        # filename in a new temporary directory.
+        tempdir = tempfile.mkdtemp(prefix='reviewboard-clearcase.')
+        temp_name = os.path.join(tempdir, 'file')
 
         try:
-            fp = open(temp.name, 'r')
-            data = fp.read()
-            fp.close()
-            return data
-        except:
-            raise FileNotFoundError(extended_path, revision)
+            try:
+                get_cleartool_session(self.path).run(
+                    ["get", "-to", temp_name, extended_path])
+
+                fp = open(temp_name, 'r')
+                data = fp.read()
+                fp.close()
+                return data
+            except (SCMError, IOError):
+                raise FileNotFoundError(extended_path, revision)
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
@@ -0,0 +1,202 @@
+from __future__ import with_statement
+
+import logging
+import subprocess
+import threading
+import time
+
+from reviewboard.scmtools.core import SCMTool
+from reviewboard.scmtools.errors import SCMError
+
+
+class CoProcess(object):
+    """A long-running helper process that's fed requests over time.
+
+    Many command line tools have a batch or interactive mode, where they
+    read requests from their standard input and write the results to their
+    standard output. Keeping one of these running saves starting a new
+    process for every request.
+
+    Subclasses implement the requests themselves, using write_line and
+    the process's stdout. They should raise IOError if the process dies or
+    returns something unexpected, after which it won't be used again.
+    """
+    # A command written to the process to ask it to exit, if any, before
+    # its standard input is closed.
+    QUIT_COMMAND = None
+
+    # The number of seconds a request may take before the process is
+    # killed. Reads from the killed process then fail with an IOError.
+    REQUEST_TIMEOUT = 60
+
+    def __init__(self, command, local_site_name=None, cwd=None):
+        self.command = command
+        self.last_used = time.time()
+        self.p = SCMTool.popen(command,
+                               local_site_name=local_site_name,
+                               stdin=subprocess.PIPE,
+                               cwd=cwd)
+
+    def is_alive(self):
+        """Returns whether the process is still running."""
+        return self.p.poll() is None
+
+    def write_line(self, line):
+        """Writes a line to the process's standard input."""
+        self.p.stdin.write('%s\n' % line)
+        self.p.stdin.flush()
+        self.last_used = time.time()
+
+    def kill(self):
+        """Kills the process, without waiting for it to finish a request."""
+        try:
+            self.p.kill()
+        except OSError:
+            pass
+
+    def close(self):
+        """Shuts down the process."""
+        try:
+            if self.QUIT_COMMAND:
+                self.write_line(self.QUIT_COMMAND)
+
+            self.p.stdin.close()
+            self.p.wait()
+        except (IOError, OSError):
+            pass
+
+
+class CoProcessPool(object):
+    """A pool of co-processes started in the same way.
+
+    Processes are handed out one request at a time, so that a process is
+    never used by two threads at once. Idle processes are shut down after
+    IDLE_TIMEOUT seconds, and processes that die or misbehave are replaced.
+
+    Subclasses set process_class, and the arguments given to the pool are
+    used to start each process.
+    """
+    IDLE_TIMEOUT = 60
+    MAX_IDLE_PROCESSES = 4
+
+    process_class = None
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def run_many(self, requests, handler):
+        """Handles several requests using one process from the pool.
+
+        handler is called with the process and each request in turn, and
+        a list of the results is returned, in the same order as requests.
+        A process that takes longer than its REQUEST_TIMEOUT to handle a
+        request is killed. If the process fails, it's replaced and the
+        remaining requests are retried once on a new process before raising
+        an SCMError. If the handler raises any other exception, the process may be in the middle
+        of a request, so it's shut down before the exception is raised.
+        """
+        results = []
+        retried = False
+        process = self._acquire()
+
+        try:
+            while len(results) < len(requests):
+                timer = threading.Timer(process.REQUEST_TIMEOUT,
+                                        process.kill)
+                timer.start()
+
+                try:
+                    try:
+                        results.append(handler(process,
+                                               requests[len(results)]))
+                    finally:
+                        timer.cancel()
+                except (IOError, OSError, ValueError), e:
+                    command = process.command
+                    process.close()
+                    process = None
+
+                    if retried:
+                        raise SCMError(str(e))
+
+                    logging.warning('%s failed. Restarting it: %s',
+                                    ' '.join(command), e)
+                    retried = True
+                    process = self._acquire()
+
+            self._release(process)
+            process = None
+        finally:
+            if process:
+                process.close()
+
+        return results
+
+    def close_idle(self, max_idle_time=0):
+        """Shuts down processes that have been idle for too long."""
+        cutoff = time.time() - max_idle_time
+
+        with self._lock:
+            expired = [
+                process
+                for process in self._idle
+                if process.last_used <= cutoff or not process.is_alive()
+            ]
+            self._idle = [
+                process
+                for process in self._idle
+                if process not in expired
+            ]
+
+        for process in expired:
+            process.close()
+
+    def _acquire(self):
+        self.close_idle(self.IDLE_TIMEOUT)
+
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+
+        return self.process_class(*self.args, **self.kwargs)
+
+    def _release(self, process):
+        with self._lock:
+            if len(self._idle) < self.MAX_IDLE_PROCESSES:
+                self._idle.append(process)
+                process = None
+
+        if process:
+            process.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_coprocess_pool(pool_class, *args, **kwargs):
+    """Returns the shared pool of processes of a given kind.
+
+    Pools are shared between all callers asking for the same pool class
+    and arguments. This will also shut down any idle processes in other
+    pools.
+    """
+    key = (pool_class, args, tuple(sorted(kwargs.items())))
+
+    with _pools_lock:
+        pools = _pools.values()
+
+        try:
+            pool = _pools[key]
+        except KeyError:
+            pool = pool_class(*args, **kwargs)
+            _pools[key] = pool
+
+    for other_pool in pools:
+        if other_pool is not pool:
+            other_pool.close_idle(other_pool.IDLE_TIMEOUT)
+
+    return pool
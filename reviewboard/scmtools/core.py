@@ -3,17 +3,43 @@ import logging
 import os
 import subprocess
 import sys
-import urllib2
 import urlparse
+from multiprocessing.pool import ThreadPool
+
+try:
+    # subprocess32 starts processes without running any Python code in the
+    # child, and closes only the file descriptors that are actually open,
+    # rather than trying every possible one. This makes starting processes
+    # much cheaper when the file descriptor limit is high.
+    import subprocess32 as spawn_subprocess
+except ImportError:
+    spawn_subprocess = subprocess
+
+from django.db import connection
 
 import reviewboard.diffviewer.parser as diffparser
 from reviewboard.scmtools.errors import (AuthenticationError,
                                          FileNotFoundError,
                                          SCMError)
+from reviewboard.scmtools.httppool import http_request
 from reviewboard.ssh import utils as sshutils
 from reviewboard.ssh.errors import SSHAuthenticationError
 
 
+# The environments for applications launched by SCMTool.popen, keyed by
+# Local Site name. These are cleared by clear_popen_envs.
+_popen_envs = {}
+
+
+def clear_popen_envs():
+    """Clears the cached environments for applications launched by popen.
+
+    This must be called after changing os.environ or sys.path, so that
+    the changes are seen by applications launched afterward.
+    """
+    _popen_envs.clear()
+
+
 class ChangeSet:
     def __init__(self):
         self.changenum = None
@@ -101,6 +127,38 @@ UNKNOWN = Revision('UNKNOWN')
 PRE_CREATION = Revision("PRE-CREATION")
 
 
+def get_files_concurrently(get_file, files, max_threads):
+    """Fetches several files using a pool of threads.
+
+    get_file is called with the path and revision of each file in files,
+    using up to max_threads threads. The results are returned in a list,
+    in the same order as files. If any call fails, its exception will be
+    raised.
+    """
+    def get_file_in_thread(file_info):
+        try:
+            return get_file(*file_info)
+        finally:
+            # Each thread has its own database connection, which would
+            # otherwise be left open after the pool is gone.
+            connection.close()
+
+    num_threads = min(len(files), max_threads)
+
+    if num_threads <= 1:
+        return [
+            get_file(path, revision)
+            for path, revision in files
+        ]
+
+    pool = ThreadPool(num_threads)
+
+    try:
+        return pool.map(get_file_in_thread, files)
+    finally:
+        pool.close()
+
+
 class SCMTool(object):
     name = None
     uses_atomic_revisions = False
@@ -123,12 +181,37 @@ class SCMTool(object):
         'modules': [],
     }
 
+    # The maximum number of threads get_files will use to fetch files
+    # concurrently. Tools whose clients are safe to share between threads
+    # can raise this.
+    get_files_max_threads = 1
+
+    # The number of commits returned by get_commits, when more are
+    # available. If this is set, repositories can list commits from their
+    # commit index instead of calling get_commits.
+    commits_page_size = None
+
     def __init__(self, repository):
         self.repository = repository
 
     def get_file(self, path, revision=None):
         raise NotImplementedError
 
+    def get_files(self, files):
+        """Returns the contents of several files.
+
+        files is a list of (path, revision) tuples. The contents of each
+        file are returned in a list, in the same order. If any file can't
+        be fetched, the error for it will be raised.
+
+        Tools that can fetch several files more efficiently than with
+        individual calls to get_file should override this. By default,
+        the files are fetched using a pool of up to get_files_max_threads
+        threads.
+        """
+        return get_files_concurrently(self.get_file, files,
+                                      self.get_files_max_threads)
+
     def file_exists(self, path, revision=HEAD):
         try:
             self.get_file(path, revision)
@@ -136,6 +219,30 @@ class SCMTool(object):
         except FileNotFoundError:
             return False
 
+    def get_mirrored_files(self, files):
+        """Returns the contents of files from a local mirror, if available.
+
+        files is a list of (path, revision) tuples. This returns a list in
+        the same order, with the contents of each file found in the mirror,
+        or None for each file that must be fetched from the repository.
+
+        Tools that can keep local mirrors of remote repositories should
+        override this. By default, there's no mirror.
+        """
+        return [None] * len(files)
+
+    def check_file_exists(self, path, revision=HEAD):
+        """Checks whether a file exists, returning any contents fetched.
+
+        This returns a tuple of (exists, data). Tools that can only tell
+        whether a file exists by downloading it in full should return its
+        contents as data, so that they can be cached. Otherwise, data is
+        None.
+
+        By default, this calls file_exists.
+        """
+        return self.file_exists(path, revision), None
+
     def parse_diff_revision(self, file_str, revision_str, moved=False):
         raise NotImplementedError
 
@@ -204,25 +311,50 @@ class SCMTool(object):
         return patch
 
     @classmethod
-    def popen(cls, command, local_site_name=None):
+    def popen(cls, command, local_site_name=None, stdin=None, cwd=None):
         """Launches an application, capturing output.
 
         This wraps subprocess.Popen to provide some common parameters and
         to pass environment variables that may be needed by rbssh, if
         indirectly invoked.
+
+        If stdin is subprocess.PIPE, the caller can write to the process's
+        standard input. This is used for long-running processes that are
+        fed requests over time.
+
+        If cwd is provided, the application is run in that directory,
+        rather than in the current directory.
         """
-        env = os.environ.copy()
+        return spawn_subprocess.Popen(command,
+                                      env=cls._get_popen_env(local_site_name),
+                                      stdin=stdin,
+                                      cwd=cwd,
+                                      stderr=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      close_fds=(os.name != 'nt'))
+
+    @classmethod
+    def _get_popen_env(cls, local_site_name):
+        """Returns the environment for applications launched by popen.
+
+        Building this means copying the whole environment and joining all
+        of sys.path, so it's built once per Local Site and reused until
+        clear_popen_envs is called. The result must not be modified.
+        """
+        try:
+            return _popen_envs[local_site_name]
+        except KeyError:
+            pass
+
+        env = dict(getattr(os.environ, 'data', os.environ))
 
         if local_site_name:
             env['RB_LOCAL_SITE'] = local_site_name
 
         env['PYTHONPATH'] = ':'.join(sys.path)
+        _popen_envs[local_site_name] = env
 
-        return subprocess.Popen(command,
-                                env=env,
-                                stderr=subprocess.PIPE,
-                                stdout=subprocess.PIPE,
-                                close_fds=(os.name != 'nt'))
+        return env
 
     @classmethod
     def check_repository(cls, path, username=None, password=None,
@@ -300,26 +432,74 @@ class SCMClient(object):
         self.password = password
 
     def get_file_http(self, url, path, revision):
+        """Fetches a file over HTTP.
+
+        Connections to the server are kept open and reused between calls.
+        """
         logging.info('Fetching file from %s' % url)
 
+        status, response_headers, data = self._http_request(url)
+
+        if status == 404:
+            logging.error('404')
+            raise FileNotFoundError(path, revision)
+        elif status >= 400:
+            msg = "HTTP error code %d when fetching file from %s" % \
+                  (status, url)
+            logging.error(msg)
+            raise SCMError(msg)
+
+        return data
+
+    def check_file_exists_http(self, url, path, revision):
+        """Checks whether a file exists over HTTP, without downloading it.
+
+        This makes a HEAD request for the file. If the server doesn't
+        support HEAD, only the first byte of the file is requested instead.
+        Servers that ignore the Range header will send the whole file.
+
+        This returns a tuple of (exists, data), where data is the file's
+        contents if the whole file was sent, or None otherwise.
+        """
+        logging.info('Checking for file at %s' % url)
+
+        status = self._http_request(url, 'HEAD')[0]
+        data = None
+
+        if status in (405, 501):
+            status, response_headers, body = \
+                self._http_request(url, headers={'Range': 'bytes=0-0'})
+
+            if status == 200:
+                data = body
+            elif status == 416:
+                # The range can't be satisfied because the file is empty.
+                status = 200
+
+        if status == 404:
+            return False, None
+        elif status >= 400:
+            msg = "HTTP error code %d when checking for file at %s" % \
+                  (status, url)
+            logging.error(msg)
+            raise SCMError(msg)
+
+        return True, data
+
+    def _http_request(self, url, method='GET', headers=None):
+        """Performs an HTTP request, authenticating if needed.
+
+        This returns a tuple of (status, headers, body).
+        """
+        headers = dict(headers or {})
+
+        if self.username:
+            auth_string = base64.b64encode('%s:%s' % (self.username,
+                                                      self.password))
+            headers['Authorization'] = 'Basic %s' % auth_string
+
         try:
-            request = urllib2.Request(url)
-
-            if self.username:
-                auth_string = base64.b64encode('%s:%s' % (self.username,
-                                                          self.password))
-                request.add_header('Authorization', 'Basic %s' % auth_string)
-
-            return urllib2.urlopen(request).read()
-        except urllib2.HTTPError, e:
-            if e.code == 404:
-                logging.error('404')
-                raise FileNotFoundError(path, revision)
-            else:
-                msg = "HTTP error code %d when fetching file from %s: %s" % \
-                      (e.code, url, e)
-                logging.error(msg)
-                raise SCMError(msg)
+            return http_request(url, method, headers)
         except Exception, e:
             msg = "Unexpected error fetching file from %s: %s" % (url, e)
             logging.error(msg)
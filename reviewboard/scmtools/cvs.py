@@ -1,5 +1,8 @@
+from __future__ import with_statement
+
 import os
 import re
+import shutil
 import tempfile
 import urlparse
 
@@ -53,6 +56,13 @@ class CVSTool(SCMTool):
 
         return self.client.cat_file(path, revision)
 
+    def get_files(self, files):
+        for path, revision in files:
+            if not path:
+                raise FileNotFoundError(path, revision)
+
+        return self.client.cat_files(files)
+
     def parse_diff_revision(self, file_str, revision_str, *args, **kwargs):
         if revision_str == "PRE-CREATION":
             return file_str, PRE_CREATION
@@ -209,27 +219,95 @@ class CVSDiffParser(DiffParser):
 
 
 class CVSClient(object):
+    # Messages from cvs saying that a file doesn't exist, rather than that
+    # something else went wrong.
+    NOT_FOUND_MESSAGES = (
+        'cannot find module',
+        'could not read RCS file',
+        'is no longer in the repository',
+    )
+
     def __init__(self, cvsroot, path, local_site_name):
-        self.tempdir = ""
-        self.currentdir = os.getcwd()
         self.cvsroot = cvsroot
         self.path = path
         self.local_site_name = local_site_name
 
+        # Maps filenames to the path (in or out of the Attic) that they
+        # were last found at, so that that path can be tried first.
+        self._found_paths = {}
+
         if not is_exe_in_path('cvs'):
             # This is technically not the right kind of error, but it's the
             # pattern we use with all the other tools.
             raise ImportError
 
-    def cleanup(self):
-        if self.currentdir != os.getcwd():
-            # Restore current working directory
-            os.chdir(self.currentdir)
-            # Remove temporary directory
-            if self.tempdir != "":
-                os.rmdir(self.tempdir)
-
     def cat_file(self, filename, revision):
+        return self.cat_files([(filename, revision)])[0]
+
+    def cat_files(self, files):
+        """Returns the contents of several files.
+
+        files is a list of (filename, revision) tuples. The contents of
+        each file are returned in a list, in the same order. If any file
+        can't be found, FileNotFoundError is raised.
+
+        All the files at a given revision are checked out with a single
+        cvs command. Files that aren't found are then looked for in (or
+        out of) the Attic, again with one command per revision.
+        """
+        keys = []
+        candidates = []
+
+        for filename, revision in files:
+            paths = self._get_candidate_paths(filename)
+
+            if [path for path in paths if not self._is_safe_path(path)]:
+                raise FileNotFoundError(
+                    filename, revision,
+                    detail='The path is not within the repository')
+
+            keys.append(paths[0])
+
+            if self._found_paths.get(paths[0]) == paths[-1]:
+                # The file was last found in the Attic, so look there first.
+                paths.reverse()
+
+            candidates.append(paths)
+
+        results = [None] * len(files)
+
+        for attempt in (0, 1):
+            indexes_by_revision = {}
+
+            for i, (filename, revision) in enumerate(files):
+                if results[i] is None and attempt < len(candidates[i]):
+                    indexes_by_revision.setdefault(str(revision), []).append(i)
+
+            for revision, indexes in indexes_by_revision.iteritems():
+                filenames = [candidates[i][attempt] for i in indexes]
+                contents = self._checkout_files(filenames, revision)
+
+                for i, filename, data in zip(indexes, filenames, contents):
+                    if data is not None:
+                        results[i] = data
+                        self._found_paths[keys[i]] = filename
+
+        for (filename, revision), paths, data in zip(files, candidates,
+                                                     results):
+            if data is None:
+                raise FileNotFoundError(paths[-1], revision)
+
+        return results
+
+    def _get_candidate_paths(self, filename):
+        """Returns the paths that a file may be found at.
+
+        Depending on whether a file has been removed, its RCS file is either
+        in the directory or in an "Attic" subdirectory, and the path in a
+        diff may point to either one. This returns the path outside of the
+        Attic, normalized for cvs, followed by the path in the Attic, if
+        there is one.
+        """
         # We strip the repo off of the fully qualified path as CVS does
         # not like to be given absolute paths.
         repos_path = self.path.split(":")[-1]
@@ -264,61 +342,90 @@ class CVSClient(object):
         else:
             # There isn't any path information, so we can't provide an
             # Attic path that makes any kind of sense.
-            filenameAttic = None
+            return [filename]
 
-        try:
-            return self._cat_specific_file(filename, revision)
-        except FileNotFoundError:
-            if filenameAttic:
-                return self._cat_specific_file(filenameAttic, revision)
-            else:
-                raise
+        return [filename, filenameAttic]
 
-    def _cat_specific_file(self, filename, revision):
-        # Somehow CVS sometimes seems to write .cvsignore files to current
-        # working directory even though we force stdout with -p.
-        self.tempdir = tempfile.mkdtemp()
-        os.chdir(self.tempdir)
+    def _is_safe_path(self, path):
+        """Returns whether a path can be checked out.
 
-        p = SCMTool.popen(['cvs', '-f', '-d', self.cvsroot, 'checkout',
-                           '-r', str(revision), '-p', filename],
-                          self.local_site_name)
-        contents = p.stdout.read()
-        errmsg = p.stderr.read()
-        failure = p.wait()
+        Paths that are absolute, or that go up out of the repository with
+        "..", would be read from outside of the checkout directory. Paths
+        starting with "-" would be taken as options by cvs.
+        """
+        return (bool(path) and
+                not path.startswith(('/', '\\', '-')) and
+                not re.match(r'^[A-Za-z]:', path) and
+                '..' not in re.split(r'[/\\]', path))
+
+    def _checkout_files(self, filenames, revision):
+        """Checks out several files at a revision with one cvs command.
+
+        The files are checked out into a new temporary directory, which cvs
+        is run in, so that nothing is written to the current directory and
+        several checkouts can run at once. The directory is removed
+        afterward.
+
+        This returns the contents of each file in a list, in the same order
+        as filenames. Files that weren't found are returned as None.
+        """
+        tempdir = tempfile.mkdtemp(prefix='reviewboard-cvs.')
+
+        try:
+            p = SCMTool.popen(['cvs', '-f', '-d', self.cvsroot, 'checkout',
+                               '-r', revision] + filenames,
+                              self.local_site_name,
+                              cwd=tempdir)
+            errmsg = p.communicate()[1]
+            failure = p.returncode
+
+            results = [
+                self._read_checked_out_file(tempdir, filename)
+                for filename in filenames
+            ]
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
 
         # Unfortunately, CVS is not consistent about exiting non-zero on
-        # errors.  If the file is not found at all, then CVS will print an
+        # errors. If a file is not found at all, then CVS will print an
         # error message on stderr, but it doesn't set an exit code with
-        # pservers.  If the file is found but an invalid revision is requested,
-        # then cvs exits zero and nothing is printed at all. (!)
-        #
-        # But, when it is successful, cvs will print a header on stderr like
-        # so:
+        # pservers. If the file is found but an invalid revision is
+        # requested, then cvs exits zero and nothing is printed at all. (!)
         #
-        # ===================================================================
-        # Checking out foobar
-        # RCS: /path/to/repo/foobar,v
-        # VERS: 1.1
-        # ***************
-
-        # So, if nothing is in errmsg, or errmsg has a specific recognized
-        # message, call it FileNotFound.
-        if not errmsg or \
-           errmsg.startswith('cvs checkout: cannot find module') or \
-           errmsg.startswith('cvs checkout: could not read RCS file'):
-            self.cleanup()
-            raise FileNotFoundError(filename, revision)
-
-        # Otherwise, if there's an exit code, or errmsg doesn't look like
-        # successful header, then call it a generic SCMError.
+        # So we go by which files were actually checked out. If nothing
+        # was, and cvs failed for some reason other than the files not
+        # existing, then call it a generic SCMError.
         #
         # If the .cvspass file doesn't exist, CVS will return an error message
         # stating this. This is safe to ignore.
-        if (failure and not errmsg.startswith('==========')) and \
-           not ".cvspass does not exist - creating new file" in errmsg:
-            self.cleanup()
+        if (failure and
+                not [data for data in results if data is not None] and
+                not [message for message in self.NOT_FOUND_MESSAGES
+                     if message in errmsg] and
+                not ".cvspass does not exist - creating new file" in errmsg):
             raise SCMError(errmsg)
 
-        self.cleanup()
-        return contents
+        return results
+
+    def _read_checked_out_file(self, tempdir, filename):
+        """Returns the contents of a checked out file, or None if missing.
+
+        Files checked out by their path in the Attic may be written outside
+        of it, so both locations are checked. Files that resolve to outside
+        of tempdir are never read.
+        """
+        paths = [filename]
+        root = os.path.join(os.path.realpath(tempdir), '')
+
+        for attic_dir in ('/Attic/', '\\Attic\\'):
+            if attic_dir in filename:
+                paths.append(attic_dir[0].join(filename.rsplit(attic_dir, 1)))
+
+        for path in paths:
+            path = os.path.realpath(os.path.join(tempdir, path))
+
+            if path.startswith(root) and os.path.isfile(path):
+                with open(path, 'rb') as fp:
+                    return fp.read()
+
+        return None
@@ -76,6 +76,20 @@ class RepositoryNotFoundError(SCMError):
                                   'specified path.'))
 
 
+class RepositoryUnavailableError(SCMError):
+    """An error indicating that a repository is temporarily unavailable.
+
+    This is raised without contacting the repository, when recent requests
+    to it have been failing or too slow.
+    """
+    def __init__(self, repository_name):
+        SCMError.__init__(self, _('The repository "%s" is temporarily '
+                                  'unavailable, because it has been failing '
+                                  'or responding too slowly. Please try '
+                                  'again in a minute.') % repository_name)
+        self.repository_name = repository_name
+
+
 class AuthenticationError(SSHAuthenticationError, SCMError):
     """An error representing a failed authentication for a repository.
 
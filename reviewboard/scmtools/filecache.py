@@ -0,0 +1,262 @@
+from __future__ import with_statement
+
+import errno
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+
+class DiskFileCache(object):
+    """A local, on-disk cache for files fetched from repositories.
+
+    This serves as a second tier under the main cache. Files that have
+    been evicted from memcached can be read back from disk instead of
+    being fetched from the repository again.
+
+    File contents are stored by the SHA1 of their contents under
+    ``blobs/``, so that identical files are only stored once. Each cache
+    key is mapped to a blob through a small file under ``refs/``
+    containing the blob's SHA1.
+
+    All writes are atomic (written to a temporary file and then renamed),
+    so readers never see partial files. When the cache grows past
+    max_size, the least recently used files are removed. Reading a file
+    updates its modification time for this purpose.
+
+    Each process works out the size of the cache in a background thread
+    after its first write, rather than making that write scan the whole
+    cache. Until then, the process doesn't evict anything.
+    """
+    # When evicting files, we remove enough to bring the cache down to
+    # this fraction of the maximum size, so that we don't need to scan
+    # the cache again on the next write.
+    EVICT_TO_RATIO = 0.9
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.refs_dir = os.path.join(cache_dir, 'refs')
+        self.blobs_dir = os.path.join(cache_dir, 'blobs')
+        self._size = None
+        self._size_thread = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the data stored for a key, or None if not cached."""
+        ref_path = self._get_ref_path(key)
+
+        try:
+            with open(ref_path, 'r') as fp:
+                blob_path = self._get_blob_path(fp.read().strip())
+
+            with open(blob_path, 'rb') as fp:
+                size = os.fstat(fp.fileno()).st_size
+
+                if size == 0:
+                    data = ''
+                else:
+                    m = mmap.mmap(fp.fileno(), size, access=mmap.ACCESS_READ)
+
+                    try:
+                        data = m[:]
+                    finally:
+                        m.close()
+        except (IOError, OSError), e:
+            if e.errno != errno.ENOENT:
+                logging.warning('Unable to read %s from the file cache: %s',
+                                key, e)
+
+            return None
+
+        self._touch(ref_path)
+        self._touch(blob_path)
+
+        return data
+
+    def has_key(self, key):
+        """Returns whether data is stored for a key."""
+        try:
+            with open(self._get_ref_path(key), 'r') as fp:
+                return os.path.exists(self._get_blob_path(fp.read().strip()))
+        except (IOError, OSError):
+            return False
+
+    def set(self, key, data):
+        """Stores data for a key.
+
+        Unicode data is stored encoded as UTF-8. Errors writing to the
+        cache are logged and otherwise ignored.
+        """
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+
+        if len(data) > self.max_size:
+            return
+
+        try:
+            blob_hash = hashlib.sha1(data).hexdigest()
+            blob_path = self._get_blob_path(blob_hash)
+            added_size = len(blob_hash)
+
+            if os.path.exists(blob_path):
+                self._touch(blob_path)
+            else:
+                self._write_file(blob_path, data)
+                added_size += len(data)
+
+            self._write_file(self._get_ref_path(key), blob_hash)
+        except Exception, e:
+            logging.warning('Unable to write %s to the file cache: %s',
+                            key, e)
+            return
+
+        self._add_size(added_size)
+
+    def clear(self):
+        """Removes everything from the cache."""
+        for path, mtime, size in self._get_entries():
+            self._remove(path)
+
+        with self._lock:
+            self._size = 0
+
+    def _get_ref_path(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+
+        key_hash = hashlib.sha1(key).hexdigest()
+
+        return os.path.join(self.refs_dir, key_hash[:2], key_hash)
+
+    def _get_blob_path(self, blob_hash):
+        return os.path.join(self.blobs_dir, blob_hash[:2], blob_hash)
+
+    def _write_file(self, path, data):
+        dirname = os.path.dirname(path)
+
+        try:
+            os.makedirs(dirname)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+
+            os.rename(tmp_path, path)
+        except:
+            self._remove(tmp_path)
+            raise
+
+    def _touch(self, path):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def _get_entries(self):
+        """Returns the path, modification time and size of each file."""
+        entries = []
+
+        for root_dir in (self.refs_dir, self.blobs_dir):
+            for dirpath, dirnames, filenames in os.walk(root_dir):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+
+                    entries.append((path, st.st_mtime, st.st_size))
+
+        return entries
+
+    def _add_size(self, size):
+        start_thread = False
+        needs_evict = False
+
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+                needs_evict = self._size > self.max_size
+            elif self._size_thread is None:
+                # The size includes this write once it's worked out.
+                self._size_thread = threading.Thread(target=self._evict)
+                self._size_thread.daemon = True
+                start_thread = True
+
+        if start_thread:
+            self._size_thread.start()
+        elif needs_evict:
+            self._evict()
+
+    def _evict(self):
+        """Removes the least recently used files to make room.
+
+        Other processes may be writing to the cache at the same time, so
+        this always works from the files actually on disk.
+        """
+        entries = self._get_entries()
+        total_size = sum([size for path, mtime, size in entries])
+
+        if total_size > self.max_size:
+            target_size = self.max_size * self.EVICT_TO_RATIO
+            start = time.time()
+            num_removed = 0
+
+            entries.sort(key=lambda entry: entry[1])
+
+            for path, mtime, size in entries:
+                if total_size <= target_size:
+                    break
+
+                self._remove(path)
+                total_size -= size
+                num_removed += 1
+
+            logging.debug('Removed %d files from the file cache in %.2fs',
+                          num_removed, time.time() - start)
+
+        with self._lock:
+            self._size = total_size
+
+
+_file_caches = {}
+
+
+def get_file_cache():
+    """Returns the on-disk file cache, if enabled.
+
+    The cache is enabled by setting REPOSITORY_FILE_CACHE_DIR in
+    settings_local.py. Its size is capped to REPOSITORY_FILE_CACHE_MAX_SIZE
+    bytes.
+    """
+    cache_dir = getattr(settings, 'REPOSITORY_FILE_CACHE_DIR', None)
+
+    if not cache_dir:
+        return None
+
+    max_size = getattr(settings, 'REPOSITORY_FILE_CACHE_MAX_SIZE',
+                       1024 * 1024 * 1024)
+    key = (cache_dir, max_size)
+
+    if key not in _file_caches:
+        _file_caches[key] = DiskFileCache(cache_dir, max_size)
+
+    return _file_caches[key]
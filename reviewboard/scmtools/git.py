@@ -1,6 +1,8 @@
 import logging
 import os
 import re
+import shutil
+import tempfile
 import urlparse
 
 # Python 2.5+ provides urllib2.quote, whereas Python 2.4 only
@@ -10,10 +12,13 @@ try:
 except ImportError:
     from urllib import quote as urllib_quote
 
+from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from djblets.util.filesystem import is_exe_in_path
 
 from reviewboard.diffviewer.parser import DiffParser, DiffParserError, File
+from reviewboard.scmtools.coprocess import (CoProcess, CoProcessPool,
+                                            get_coprocess_pool)
 from reviewboard.scmtools.core import SCMClient, SCMTool, HEAD, PRE_CREATION
 from reviewboard.scmtools.errors import (FileNotFoundError,
                                          InvalidRevisionFormatError,
@@ -24,6 +29,7 @@ from reviewboard.ssh import utils as sshutils
 
 GIT_DIFF_EMPTY_CHANGESET_SIZE = 3
 GIT_DIFF_PREFIX = re.compile('^[ab]/')
+SHA1_RE = re.compile('^[0-9a-f]{7,40}$')
 
 
 # Register these URI schemes so we can handle them properly.
@@ -61,6 +67,10 @@ class GitTool(SCMTool):
         'executables': ['git']
     }
 
+    # Files from raw file URLs are fetched over HTTP, which is safe to do
+    # from several threads at once.
+    get_files_max_threads = 4
+
     def __init__(self, repository):
         super(GitTool, self).__init__(repository)
 
@@ -79,6 +89,23 @@ class GitTool(SCMTool):
 
         return self.client.get_file(path, revision)
 
+    def get_files(self, files):
+        if self.client.raw_file_url:
+            return super(GitTool, self).get_files(files)
+
+        results = [''] * len(files)
+        indexes = [
+            i
+            for i, (path, revision) in enumerate(files)
+            if revision != PRE_CREATION
+        ]
+
+        for i, data in zip(indexes,
+                           self.client.get_files([files[i] for i in indexes])):
+            results[i] = data
+
+        return results
+
     def file_exists(self, path, revision=HEAD):
         if revision == PRE_CREATION:
             return False
@@ -88,6 +115,82 @@ class GitTool(SCMTool):
         except (FileNotFoundError, InvalidRevisionFormatError):
             return False
 
+    def check_file_exists(self, path, revision=HEAD):
+        if revision == PRE_CREATION or not self.client.raw_file_url:
+            return super(GitTool, self).check_file_exists(path, revision)
+
+        return self.client.check_file_exists(path, revision)
+
+    def get_mirrored_files(self, files):
+        """Returns the contents of files from the repository's mirror.
+
+        Only remote repositories are mirrored, and only files requested by
+        their blob SHA1 can be read from the mirror. See sync_mirror.
+        """
+        results = [None] * len(files)
+        mirror_dir = self._get_mirror_dir()
+
+        if not mirror_dir or not os.path.isdir(mirror_dir):
+            return results
+
+        indexes = [
+            i
+            for i, (path, revision) in enumerate(files)
+            if SHA1_RE.match(str(revision))
+        ]
+
+        if indexes:
+            pool = get_cat_file_pool(mirror_dir, '--batch',
+                                     self.client.local_site_name)
+            lookups = pool.lookup_many([str(files[i][1]) for i in indexes])
+
+            for i, (object_type, contents) in zip(indexes, lookups):
+                if object_type == 'blob':
+                    results[i] = contents
+
+        return results
+
+    def sync_mirror(self):
+        """Creates or updates the local mirror of a remote repository.
+
+        The mirror is a bare repository in GIT_MIRROR_DIR, holding the
+        repository's branches and tags. A new mirror is fetched into a
+        temporary directory and moved into place once complete, so that
+        a partial mirror is never read from.
+        """
+        mirror_dir = self._get_mirror_dir()
+
+        if not mirror_dir:
+            raise SCMError(_('GIT_MIRROR_DIR must be set, and the repository '
+                             'must be a saved, remote repository, in order '
+                             'to mirror it.'))
+
+        if os.path.isdir(mirror_dir):
+            self.client.fetch_into(mirror_dir)
+        else:
+            mirror_root = os.path.dirname(mirror_dir)
+
+            if not os.path.isdir(mirror_root):
+                os.makedirs(mirror_root)
+
+            temp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=mirror_root)
+
+            try:
+                self.client.fetch_into(temp_dir, init=True)
+                os.rename(temp_dir, mirror_dir)
+            except:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                raise
+
+    def _get_mirror_dir(self):
+        mirror_root = getattr(settings, 'GIT_MIRROR_DIR', None)
+
+        if (not mirror_root or self.repository.pk is None or
+                self.client.git_dir):
+            return None
+
+        return os.path.join(mirror_root, '%s.git' % self.repository.pk)
+
     def parse_diff_revision(self, file_str, revision_str, moved=False,
                             *args, **kwargs):
         revision = revision_str
@@ -328,6 +431,96 @@ class GitDiffParser(DiffParser):
                 setattr(file_info, attr, '')
 
 
+class GitCatFileProcess(CoProcess):
+    """A long-running git-cat-file(1) process.
+
+    This runs ``git cat-file --batch`` or ``git cat-file --batch-check``,
+    writing object names to its standard input and reading the results
+    back, so that many objects can be looked up without starting a new
+    process for each one.
+    """
+    def __init__(self, git_dir, batch_option, local_site_name=None):
+        super(GitCatFileProcess, self).__init__(
+            ['git', '--git-dir=%s' % git_dir, 'cat-file', batch_option],
+            local_site_name=local_site_name)
+        self.git_dir = git_dir
+        self.batch_option = batch_option
+
+    def lookup(self, object_name):
+        """Looks up an object.
+
+        This returns a tuple of the object type and, when running with
+        ``--batch``, its contents. The type will be None if the object
+        does not exist.
+
+        If the process has died or returns something unexpected, an
+        IOError will be raised, and the process should not be used again.
+        """
+        self.write_line(object_name)
+
+        header = self.p.stdout.readline()
+
+        if not header.endswith('\n'):
+            raise IOError('git cat-file exited unexpectedly: %s'
+                          % self.p.stderr.read())
+
+        if header in ('%s missing\n' % object_name,
+                      '%s ambiguous\n' % object_name):
+            return None, None
+
+        try:
+            sha1, object_type, size = header.split()
+            size = int(size)
+        except ValueError:
+            raise IOError('Unexpected output from git cat-file: %r'
+                          % header)
+
+        if self.batch_option == '--batch':
+            contents = self.p.stdout.read(size)
+
+            if len(contents) != size or self.p.stdout.read(1) != '\n':
+                raise IOError('Truncated output from git cat-file')
+        else:
+            contents = None
+
+        return object_type, contents
+
+
+class GitCatFilePool(CoProcessPool):
+    """A pool of git-cat-file(1) processes for a repository.
+
+    See CoProcessPool for how processes are shared and replaced.
+    """
+    process_class = GitCatFileProcess
+
+    def lookup(self, object_name):
+        """Looks up an object using a process from the pool.
+
+        See GitCatFileProcess.lookup for the return value. If the process
+        fails, the lookup will be retried once on a new process before
+        raising an SCMError.
+        """
+        return self.lookup_many([object_name])[0]
+
+    def lookup_many(self, object_names):
+        """Looks up several objects using one process from the pool.
+
+        This returns a list of results, in the same order as object_names.
+        See GitCatFileProcess.lookup for the format of each result.
+        """
+        return self.run_many(object_names,
+                             lambda process, name: process.lookup(name))
+
+
+def get_cat_file_pool(git_dir, batch_option, local_site_name=None):
+    """Returns the shared pool of git-cat-file(1) processes for a repository.
+
+    This will also shut down any idle processes in other pools.
+    """
+    return get_coprocess_pool(GitCatFilePool, git_dir, batch_option,
+                              local_site_name)
+
+
 class GitClient(SCMClient):
     FULL_SHA1_LENGTH = 40
 
@@ -382,6 +575,18 @@ class GitClient(SCMClient):
 
         return True
 
+    def fetch_into(self, git_dir, init=False):
+        """Fetches the repository's branches and tags into a bare repository.
+
+        If init is True, the bare repository will be created first.
+        """
+        if init:
+            self._run_git_checked(['init', '--bare', git_dir])
+
+        self._run_git_checked(['--git-dir=%s' % git_dir, 'fetch', '--prune',
+                               '--tags', self.path,
+                               '+refs/heads/*:refs/heads/*'])
+
     def get_file(self, path, revision):
         if self.raw_file_url:
             self.validate_sha1_format(path, revision)
@@ -389,23 +594,86 @@ class GitClient(SCMClient):
             return self.get_file_http(self._build_raw_url(path, revision),
                                       path, revision)
         else:
-            return self._cat_file(path, revision, "blob")
+            commit = self._resolve_head(revision, path)
+
+            if '\n' in commit:
+                return self._cat_file(path, revision, "blob")
+
+            object_type, contents = \
+                self._get_cat_file_pool('--batch').lookup(commit)
+
+            if object_type is None:
+                raise FileNotFoundError(path, revision)
+            elif object_type != 'blob':
+                raise SCMError(_('%s is a %s, not a file')
+                               % (commit, object_type))
+
+            return contents
+
+    def get_files(self, files):
+        """Returns the contents of several files from a local repository.
+
+        files is a list of (path, revision) tuples. All the files will be
+        read through a single git-cat-file(1) process.
+        """
+        assert not self.raw_file_url
+
+        commits = [
+            self._resolve_head(revision, path)
+            for path, revision in files
+        ]
+
+        if [commit for commit in commits if '\n' in commit]:
+            return [
+                self.get_file(path, revision)
+                for path, revision in files
+            ]
+
+        results = []
+        lookups = self._get_cat_file_pool('--batch').lookup_many(commits)
+
+        for (path, revision), commit, (object_type, contents) in zip(
+                files, commits, lookups):
+            if object_type is None:
+                raise FileNotFoundError(path, revision)
+            elif object_type != 'blob':
+                raise SCMError(_('%s is a %s, not a file')
+                               % (commit, object_type))
+
+            results.append(contents)
+
+        return results
 
     def get_file_exists(self, path, revision):
+        return self.check_file_exists(path, revision)[0]
+
+    def check_file_exists(self, path, revision):
+        """Checks whether a file exists, returning any contents fetched.
+
+        This returns a tuple of (exists, data). With a raw file URL, only
+        the file's headers are normally requested. If the server sends the
+        whole file anyway, its contents are returned as data. Otherwise,
+        data is None.
+        """
         if self.raw_file_url:
             try:
-                # We want to make sure we can access the file successfully,
-                # without any HTTP errors. A successful access means the file
-                # exists. The contents themselves are meaningless, so ignore
-                # them. If we do successfully get the file without triggering
-                # any sort of exception, then the file exists.
-                self.get_file(path, revision)
-                return True
+                self.validate_sha1_format(path, revision)
+
+                return self.check_file_exists_http(
+                    self._build_raw_url(path, revision), path, revision)
             except Exception:
-                return False
+                return False, None
         else:
-            contents = self._cat_file(path, revision, "-t")
-            return contents and contents.strip() == "blob"
+            commit = self._resolve_head(revision, path)
+
+            if '\n' in commit:
+                contents = self._cat_file(path, revision, "-t")
+                return contents and contents.strip() == "blob", None
+
+            object_type = \
+                self._get_cat_file_pool('--batch-check').lookup(commit)[0]
+
+            return object_type == 'blob', None
 
     def validate_sha1_format(self, path, sha1):
         """Validates that a SHA1 is of the right length for this repository."""
@@ -417,6 +685,19 @@ class GitClient(SCMClient):
         return SCMTool.popen(['git'] + args,
                              local_site_name=self.local_site_name)
 
+    def _run_git_checked(self, args):
+        """Runs a git command, raising an SCMError if it fails."""
+        p = self._run_git(args)
+        errmsg = p.communicate()[1]
+
+        if p.returncode:
+            raise SCMError(errmsg)
+
+    def _get_cat_file_pool(self, batch_option):
+        """Returns the pool of git-cat-file(1) processes to use."""
+        return get_cat_file_pool(self.git_dir, batch_option,
+                                 self.local_site_name)
+
     def _build_raw_url(self, path, revision):
         url = self.raw_file_url
         url = url.replace("<revision>", revision)
@@ -444,7 +725,7 @@ class GitClient(SCMClient):
 
         if failure:
             if errmsg.startswith("fatal: Not a valid object name"):
-                raise FileNotFoundError(commit)
+                raise FileNotFoundError(path, revision)
             else:
                 raise SCMError(errmsg)
 
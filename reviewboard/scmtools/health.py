@@ -0,0 +1,297 @@
+from __future__ import with_statement
+
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from djblets.util.misc import make_cache_key
+
+from reviewboard.scmtools.errors import (FileNotFoundError,
+                                         RepositoryUnavailableError)
+from reviewboard.scmtools.signals import (check_file_exists_failed,
+                                          checked_file_exists,
+                                          checking_file_exists,
+                                          fetch_file_failed,
+                                          fetched_file,
+                                          fetching_file)
+
+
+# Calls to repositories are counted in windows of WINDOW_SIZE seconds.
+# The counts for the last HISTORY_WINDOWS windows are kept.
+WINDOW_SIZE = 60
+HISTORY_WINDOWS = 15
+
+# The upper bounds, in seconds, of the buckets in the latency histogram.
+# The last bucket holds everything slower.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# The circuit breaker for a repository opens when, over the current and
+# previous windows, at least MIN_CALLS calls have been made and either
+# ERROR_RATE_BUDGET of them failed, or SLOW_RATE_BUDGET of them took
+# longer than SLOW_CALL_TIME seconds. While open, calls to the repository
+# fail immediately. It closes again after OPEN_TIME seconds.
+MIN_CALLS = 10
+ERROR_RATE_BUDGET = 0.5
+SLOW_CALL_TIME = 10
+SLOW_RATE_BUDGET = 0.5
+OPEN_TIME = 60
+
+
+def record_call(repository, duration, failed):
+    """Records a call made to a repository.
+
+    If the call failed or was slow, this checks whether the repository
+    is now over its error or latency budget, and opens the circuit
+    breaker if so.
+    """
+    if repository.pk is None or not are_calls_tracked():
+        return
+
+    window = _get_window()
+    counters = ['calls', 'latency-%d' % _get_latency_bucket(duration)]
+    slow = duration >= SLOW_CALL_TIME
+
+    if failed:
+        counters.append('errors')
+
+    if slow:
+        counters.append('slow')
+
+    for counter in counters:
+        _incr(_make_counter_key(repository.pk, window, counter))
+
+    if failed or slow:
+        _update_circuit(repository, window)
+
+
+@contextmanager
+def record_batch_call(repository):
+    """Records the code run in the block as a single call to a repository.
+
+    This is used when several files are fetched with one call. The signals
+    sent for each of the files within the block aren't recorded
+    separately, so that a slow or failed batch counts only once toward
+    the repository's budgets.
+    """
+    start = time.time()
+    _pending_calls.in_batch = True
+
+    try:
+        yield
+    except Exception, e:
+        _pending_calls.in_batch = False
+        record_call(repository, time.time() - start,
+                    not isinstance(e, FileNotFoundError))
+        raise
+    else:
+        _pending_calls.in_batch = False
+        record_call(repository, time.time() - start, False)
+
+
+def are_calls_tracked():
+    """Returns whether calls made in this thread are being recorded."""
+    return not getattr(_pending_calls, 'untracked', False)
+
+
+@contextmanager
+def untracked_calls(untracked=True):
+    """Stops calls made in this thread in the block from being recorded.
+
+    This is used for background work, such as prefetching files, which
+    shouldn't be able to make a repository unavailable to users. Calls in
+    the block still fail immediately while the circuit breaker is open.
+    """
+    old_untracked = getattr(_pending_calls, 'untracked', False)
+    _pending_calls.untracked = untracked
+
+    try:
+        yield
+    finally:
+        _pending_calls.untracked = old_untracked
+
+
+def check_circuit(repository):
+    """Checks that the circuit breaker for a repository is closed.
+
+    If it's open, RepositoryUnavailableError is raised.
+    """
+    if (repository.pk is not None and
+            cache.get(_make_circuit_key(repository.pk))):
+        raise RepositoryUnavailableError(repository.name)
+
+
+def get_repository_health(repository):
+    """Returns the health of a repository over the last HISTORY_WINDOWS.
+
+    This returns a dictionary with the number of calls, errors and slow
+    calls, the error rate (as a percentage), the latency histogram, the
+    approximate median and 95th percentile latencies (as the upper bound
+    of the bucket they fall in, or None if there were no calls), and
+    whether the circuit breaker is open.
+    """
+    window = _get_window()
+    windows = range(window - HISTORY_WINDOWS + 1, window + 1)
+    counters = ['calls', 'errors', 'slow'] + [
+        'latency-%d' % i
+        for i in xrange(len(LATENCY_BUCKETS) + 1)
+    ]
+
+    keys = dict([
+        ((window, counter), _make_counter_key(repository.pk, window, counter))
+        for window in windows
+        for counter in counters
+    ])
+    values = cache.get_many(keys.values())
+    totals = dict([
+        (counter, sum([values.get(keys[(window, counter)], 0)
+                       for window in windows]))
+        for counter in counters
+    ])
+
+    histogram = [
+        (bound, totals['latency-%d' % i])
+        for i, bound in enumerate(LATENCY_BUCKETS + (None,))
+    ]
+
+    if totals['calls']:
+        error_rate = 100.0 * totals['errors'] / totals['calls']
+    else:
+        error_rate = 0
+
+    return {
+        'calls': totals['calls'],
+        'errors': totals['errors'],
+        'slow': totals['slow'],
+        'error_rate': error_rate,
+        'latency_histogram': histogram,
+        'median_latency': _get_percentile(histogram, 0.5),
+        'p95_latency': _get_percentile(histogram, 0.95),
+        'circuit_open': bool(cache.get(_make_circuit_key(repository.pk))),
+    }
+
+
+def _update_circuit(repository, window):
+    """Opens the circuit breaker if a repository is over budget."""
+    keys = {}
+
+    for counter in ('calls', 'errors', 'slow'):
+        keys[counter] = [
+            _make_counter_key(repository.pk, window - i, counter)
+            for i in (0, 1)
+        ]
+
+    values = cache.get_many(sum(keys.values(), []))
+    totals = dict([
+        (counter, sum([values.get(key, 0) for key in counter_keys]))
+        for counter, counter_keys in keys.iteritems()
+    ])
+
+    if (totals['calls'] >= MIN_CALLS and
+            (totals['errors'] >= totals['calls'] * ERROR_RATE_BUDGET or
+             totals['slow'] >= totals['calls'] * SLOW_RATE_BUDGET)):
+        cache.set(_make_circuit_key(repository.pk), True, OPEN_TIME)
+
+
+def _get_percentile(histogram, fraction):
+    total = sum([count for bound, count in histogram])
+
+    if not total:
+        return None
+
+    seen = 0
+
+    for bound, count in histogram:
+        seen += count
+
+        if seen >= total * fraction:
+            return bound
+
+
+def _get_window():
+    return int(time.time() / WINDOW_SIZE)
+
+
+def _get_latency_bucket(duration):
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if duration < bound:
+            return i
+
+    return len(LATENCY_BUCKETS)
+
+
+def _incr(key):
+    timeout = WINDOW_SIZE * (HISTORY_WINDOWS + 1)
+    cache.add(key, 0, timeout)
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The counter expired between being added and incremented.
+        cache.add(key, 1, timeout)
+
+
+def _make_counter_key(repository_id, window, counter):
+    return make_cache_key('scm-health:%s:%s:%s'
+                          % (repository_id, window, counter))
+
+
+def _make_circuit_key(repository_id):
+    return make_cache_key('scm-health:%s:circuit-open' % repository_id)
+
+
+# The start times of calls in progress in this thread, keyed by the kind
+# of call, the repository, the path and the revision, along with whether
+# a batch call is in progress and whether calls are being recorded.
+_pending_calls = threading.local()
+
+
+def _get_pending_calls():
+    try:
+        return _pending_calls.starts
+    except AttributeError:
+        _pending_calls.starts = {}
+
+        return _pending_calls.starts
+
+
+def _on_call_started(kind, sender, path, revision, **kwargs):
+    if getattr(_pending_calls, 'in_batch', False):
+        return
+
+    _get_pending_calls()[(kind, sender.pk, path, revision)] = time.time()
+
+
+def _on_call_finished(kind, sender, path, revision, error=None, **kwargs):
+    start = _get_pending_calls().pop((kind, sender.pk, path, revision), None)
+
+    if start is not None:
+        # A file that doesn't exist is still a successful call as far as
+        # the repository's health is concerned.
+        record_call(sender, time.time() - start,
+                    error is not None and
+                    not isinstance(error, FileNotFoundError))
+
+
+def _on_fetching_file(**kwargs):
+    _on_call_started('fetch', **kwargs)
+
+
+def _on_fetched_file(**kwargs):
+    _on_call_finished('fetch', **kwargs)
+
+
+def _on_checking_file_exists(**kwargs):
+    _on_call_started('exists', **kwargs)
+
+
+def _on_checked_file_exists(**kwargs):
+    _on_call_finished('exists', **kwargs)
+
+
+fetching_file.connect(_on_fetching_file)
+fetched_file.connect(_on_fetched_file)
+fetch_file_failed.connect(_on_fetched_file)
+checking_file_exists.connect(_on_checking_file_exists)
+checked_file_exists.connect(_on_checked_file_exists)
+check_file_exists_failed.connect(_on_checked_file_exists)
@@ -1,11 +1,18 @@
+from __future__ import with_statement
+
 import logging
 import re
+import threading
+import time
 
 try:
     from urllib2 import quote as urllib_quote
 except ImportError:
     from urllib import quote as urllib_quote
 
+from django.core.cache import cache
+from django.utils.datastructures import SortedDict
+from djblets.util.misc import make_cache_key
 from pkg_resources import parse_version
 
 from reviewboard.diffviewer.parser import DiffParser, DiffParserError
@@ -22,6 +29,10 @@ class HgTool(SCMTool):
         'modules': ['mercurial'],
     }
 
+    # Files from hgweb are fetched over HTTP, which is safe to do from
+    # several threads at once.
+    get_files_max_threads = 4
+
     def __init__(self, repository):
         SCMTool.__init__(self, repository)
         if repository.path.startswith('http'):
@@ -36,6 +47,15 @@ class HgTool(SCMTool):
     def get_file(self, path, revision=HEAD):
         return self.client.cat_file(path, str(revision))
 
+    def get_files(self, files):
+        if isinstance(self.client, HgClient):
+            return self.client.cat_files([
+                (path, str(revision))
+                for path, revision in files
+            ])
+        else:
+            return super(HgTool, self).get_files(files)
+
     def parse_diff_revision(self, file_str, revision_str, *args, **kwargs):
         revision = revision_str
         if file_str == "/dev/null":
@@ -188,6 +208,12 @@ class HgDiffParser(DiffParser):
 class HgWebClient(SCMClient):
     FULL_FILE_URL = '%(url)s/%(rawpath)s/%(revision)s/%(quoted_path)s'
 
+    # The URL layouts that hgweb servers may use for raw files.
+    RAW_PATHS = ['raw-file', 'raw', 'hg-history']
+
+    # How long to remember which URL layout works for a repository.
+    RAW_PATH_CACHE_PERIOD = 60 * 60 * 24  # 1 day
+
     def __init__(self, path, username, password):
         super(HgWebClient, self).__init__(path, username=username,
                                           password=password)
@@ -201,7 +227,17 @@ class HgWebClient(SCMClient):
         elif rev == PRE_CREATION:
             rev = ""
 
-        for rawpath in ["raw-file", "raw", "hg-history"]:
+        # Try the URL layout that worked last time first. If the file
+        # isn't found there, it won't be found using the others either.
+        cache_key = make_cache_key('hgweb-raw-path:%s' % self.path)
+        known_rawpath = cache.get(cache_key)
+        rawpaths = list(self.RAW_PATHS)
+
+        if known_rawpath in rawpaths:
+            rawpaths.remove(known_rawpath)
+            rawpaths.insert(0, known_rawpath)
+
+        for rawpath in rawpaths:
             try:
                 base_url = self.path.rstrip('/')
 
@@ -215,76 +251,213 @@ class HgWebClient(SCMClient):
                     'quoted_path': urllib_quote(path.lstrip('/')),
                 }
 
-                return self.get_file_http(url, path, rev)
+                data = self.get_file_http(url, path, rev)
+            except FileNotFoundError:
+                if rawpath == known_rawpath:
+                    raise
+
+                continue
             except Exception:
                 # It failed. Error was logged and we may try again.
-                pass
+                continue
+
+            if rawpath != known_rawpath:
+                cache.set(cache_key, rawpath, self.RAW_PATH_CACHE_PERIOD)
+
+            return data
 
         raise FileNotFoundError(path, rev)
 
 
-class HgClient(object):
+class HgRepositoryHandle(object):
+    """A long-lived handle to a local Mercurial repository.
+
+    Opening a repository is expensive, so a handle is shared by all
+    HgClients in the process for the same repository. Recently used
+    changectxs are kept, up to MAX_CHANGECTXS, so that looking up several
+    files at the same revision only resolves the changeset and manifest
+    once.
+
+    Mercurial repository objects aren't safe to use from several threads
+    at once, so all access goes through the handle's lock.
+    """
+    MAX_CHANGECTXS = 32
+
+    # Only changesets named by their hash are cached, since they can't
+    # change. Names like 'tip' or branch names can point to new changesets
+    # at any time.
+    CACHEABLE_REV_RE = re.compile(r'^[0-9a-f]{12,40}$')
+
+    # The minimum number of seconds between opening the repository again
+    # after failed lookups.
+    REOPEN_INTERVAL = 30
+
     def __init__(self, repoPath, local_site):
-        from mercurial import hg, ui, error
-
-        # We've encountered problems getting the Mercurial version number.
-        # Originally, we imported 'version' from mercurial.__version__,
-        # which would sometimes return None.
-        #
-        # We are now trying to go through their version() function, if
-        # available. That is likely the most reliable.
+        self.repoPath = repoPath
+        self.local_site = local_site
+        self.repo = _open_repository(repoPath, local_site)
+        self.lock = threading.Lock()
+        self._changectxs = SortedDict()
+        self._last_reopen = 0
+
+    def get_changectx(self, rev):
+        """Returns the changectx for a revision.
+
+        This must be called with the lock held. If the revision isn't found
+        or the connection to a remote repository was lost, the repository
+        is opened again and the lookup is retried, since the revision may
+        have been committed since the repository was opened. This is done
+        at most once every REOPEN_INTERVAL seconds, so that lookups of
+        revisions that don't exist don't keep opening the repository.
+        """
+        from mercurial import error
+
         try:
-            from mercurial.util import version
-            hg_version = version()
-        except ImportError:
-            # If version() wasn't available, we'll try to import __version__
-            # ourselves, and then get 'version' from that.
+            changectx = self._changectxs.pop(rev)
+        except KeyError:
             try:
-                from mercurial import __version__
-                hg_version = __version__.version
-            except ImportError:
-                # If that failed, we'll hard-code an empty string. This will
-                # trigger the "<= 1.2" case below.
-                hg_version = ''
-
-        # If something gave us None, convert it to an empty string so
-        # parse_version can accept it.
-        if hg_version is None:
+                changectx = self.repo.changectx(rev)
+            except (getattr(error, 'RepoLookupError', error.RepoError),
+                    IOError), e:
+                if time.time() - self._last_reopen < self.REOPEN_INTERVAL:
+                    raise
+
+                logging.debug('Looking up %s in Mercurial repository %s '
+                              'failed. Opening it again: %s',
+                              rev, self.repoPath, e)
+                self.reopen()
+                changectx = self.repo.changectx(rev)
+
+            if not self.CACHEABLE_REV_RE.match(rev):
+                return changectx
+
+        self._changectxs[rev] = changectx
+
+        while len(self._changectxs) > self.MAX_CHANGECTXS:
+            del self._changectxs[iter(self._changectxs).next()]
+
+        return changectx
+
+    def reopen(self):
+        """Discards the open repository and opens it again.
+
+        This must be called with the lock held.
+        """
+        self._changectxs.clear()
+        self._last_reopen = time.time()
+        self.repo = _open_repository(self.repoPath, self.local_site)
+
+
+def _open_repository(repoPath, local_site):
+    from mercurial import hg, ui, error
+
+    # We've encountered problems getting the Mercurial version number.
+    # Originally, we imported 'version' from mercurial.__version__,
+    # which would sometimes return None.
+    #
+    # We are now trying to go through their version() function, if
+    # available. That is likely the most reliable.
+    try:
+        from mercurial.util import version
+        hg_version = version()
+    except ImportError:
+        # If version() wasn't available, we'll try to import __version__
+        # ourselves, and then get 'version' from that.
+        try:
+            from mercurial import __version__
+            hg_version = __version__.version
+        except ImportError:
+            # If that failed, we'll hard-code an empty string. This will
+            # trigger the "<= 1.2" case below.
             hg_version = ''
 
-        if parse_version(hg_version) <= parse_version("1.2"):
-            hg_ui = ui.ui(interactive=False)
-        else:
-            hg_ui = ui.ui()
-            hg_ui.setconfig('ui', 'interactive', 'off')
+    # If something gave us None, convert it to an empty string so
+    # parse_version can accept it.
+    if hg_version is None:
+        hg_version = ''
 
-        # Check whether ssh is configured for mercurial. Assume that any
-        # configured ssh is set up correctly for this repository.
-        hg_ssh = hg_ui.config('ui', 'ssh')
+    if parse_version(hg_version) <= parse_version("1.2"):
+        hg_ui = ui.ui(interactive=False)
+    else:
+        hg_ui = ui.ui()
+        hg_ui.setconfig('ui', 'interactive', 'off')
 
-        if not hg_ssh:
-            logging.debug('Using rbssh for mercurial')
-            hg_ui.setconfig('ui', 'ssh', 'rbssh --rb-local-site=%s'
-                            % local_site)
-        else:
-            logging.debug('Found configured ssh for mercurial: %s' % hg_ssh)
+    # Check whether ssh is configured for mercurial. Assume that any
+    # configured ssh is set up correctly for this repository.
+    hg_ssh = hg_ui.config('ui', 'ssh')
 
-        try:
-            self.repo = hg.repository(hg_ui, path=repoPath)
-        except error.RepoError, e:
-            logging.error('Error connecting to Mercurial repository %s: %s'
-                          % (repoPath, e))
-            raise RepositoryNotFoundError
+    if not hg_ssh:
+        logging.debug('Using rbssh for mercurial')
+        hg_ui.setconfig('ui', 'ssh', 'rbssh --rb-local-site=%s'
+                        % local_site)
+    else:
+        logging.debug('Found configured ssh for mercurial: %s' % hg_ssh)
 
-    def cat_file(self, path, rev="tip"):
-        if rev == HEAD:
-            rev = "tip"
-        elif rev == PRE_CREATION:
-            rev = ""
+    try:
+        return hg.repository(hg_ui, path=repoPath)
+    except error.RepoError, e:
+        logging.error('Error connecting to Mercurial repository %s: %s'
+                      % (repoPath, e))
+        raise RepositoryNotFoundError
 
-        try:
-            return self.repo.changectx(rev).filectx(path).data()
-        except Exception, e:
-            # LookupError moves from repo to revlog in hg v0.9.4, so we
-            # catch the more general Exception to avoid the dependency.
-            raise FileNotFoundError(path, rev, detail=str(e))
+
+_repository_handles = {}
+_repository_handles_lock = threading.Lock()
+
+
+def get_repository_handle(repoPath, local_site):
+    """Returns the shared handle for a local Mercurial repository.
+
+    The repository is opened the first time it's requested.
+    """
+    key = (repoPath, '%s' % local_site)
+
+    with _repository_handles_lock:
+        handle = _repository_handles.get(key)
+
+    if handle is None:
+        handle = HgRepositoryHandle(repoPath, local_site)
+
+        with _repository_handles_lock:
+            handle = _repository_handles.setdefault(key, handle)
+
+    return handle
+
+
+class HgClient(object):
+    def __init__(self, repoPath, local_site):
+        self.handle = get_repository_handle(repoPath, local_site)
+
+    @property
+    def repo(self):
+        return self.handle.repo
+
+    def cat_file(self, path, rev="tip"):
+        return self.cat_files([(path, rev)])[0]
+
+    def cat_files(self, files):
+        """Returns the contents of several files.
+
+        files is a list of (path, revision) tuples. Files at the same
+        revision share a single changectx, which may also be kept for
+        later calls.
+        """
+        results = []
+
+        with self.handle.lock:
+            for path, rev in files:
+                if rev == HEAD:
+                    rev = "tip"
+                elif rev == PRE_CREATION:
+                    rev = ""
+
+                try:
+                    changectx = self.handle.get_changectx(rev)
+                    results.append(changectx.filectx(path).data())
+                except Exception, e:
+                    # LookupError moves from repo to revlog in hg v0.9.4, so
+                    # we catch the more general Exception to avoid the
+                    # dependency.
+                    raise FileNotFoundError(path, rev, detail=str(e))
+
+        return results
@@ -0,0 +1,198 @@
+from __future__ import with_statement
+
+import httplib
+import socket
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+
+
+# The maximum number of redirects to follow for a request.
+MAX_REDIRECTS = 5
+
+REDIRECT_CODES = (301, 302, 303, 307)
+
+
+class HTTPConnectionPool(object):
+    """A pool of keep-alive HTTP connections to a single host.
+
+    Connections are reused between requests, saving a new TCP connection
+    and TLS handshake for each file fetched from the same server. At most
+    MAX_CONNECTIONS requests are made to the host at once. Further
+    requests wait for a connection to become free.
+
+    Idle connections are closed after IDLE_TIMEOUT seconds. If a request
+    on a reused connection fails (usually because the server closed it),
+    the request is retried once on a new connection.
+    """
+    IDLE_TIMEOUT = 60
+    MAX_CONNECTIONS = 4
+    TIMEOUT = 60
+
+    def __init__(self, scheme, host, port=None):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self._idle = []
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(self.MAX_CONNECTIONS)
+
+    def request(self, method, path, headers=None):
+        """Performs a request on a pooled connection.
+
+        This returns a tuple of (status, headers, body). The header names
+        are lowercase.
+        """
+        with self._semaphore:
+            conn, reused = self._acquire()
+
+            while True:
+                try:
+                    conn.request(method, path, headers=headers or {})
+                    response = conn.getresponse()
+                    body = response.read()
+                    break
+                except (httplib.HTTPException, socket.error):
+                    conn.close()
+
+                    if not reused:
+                        raise
+
+                    conn, reused = self._connect(), False
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+
+            return response.status, dict(response.getheaders()), body
+
+    def close_idle(self, max_idle_time=0):
+        """Closes connections that have been idle for too long."""
+        cutoff = time.time() - max_idle_time
+
+        with self._lock:
+            expired = [
+                (conn, last_used)
+                for conn, last_used in self._idle
+                if last_used <= cutoff
+            ]
+            self._idle = [
+                (conn, last_used)
+                for conn, last_used in self._idle
+                if last_used > cutoff
+            ]
+
+        for conn, last_used in expired:
+            conn.close()
+
+    def _acquire(self):
+        """Returns a connection, and whether it was reused."""
+        self.close_idle(self.IDLE_TIMEOUT)
+
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()[0], True
+
+        return self._connect(), False
+
+    def _release(self, conn):
+        with self._lock:
+            self._idle.append((conn, time.time()))
+
+    def _connect(self):
+        if self.scheme == 'https':
+            conn_cls = httplib.HTTPSConnection
+        else:
+            conn_cls = httplib.HTTPConnection
+
+        return conn_cls(self.host, self.port, timeout=self.TIMEOUT)
+
+
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(scheme, host, port=None):
+    """Returns the shared pool of connections for a host.
+
+    This will also close any idle connections in other pools.
+    """
+    key = (scheme, host, port)
+
+    with _connection_pools_lock:
+        pools = _connection_pools.values()
+
+        try:
+            pool = _connection_pools[key]
+        except KeyError:
+            pool = HTTPConnectionPool(scheme, host, port)
+            _connection_pools[key] = pool
+
+    for other_pool in pools:
+        if other_pool is not pool:
+            other_pool.close_idle(HTTPConnectionPool.IDLE_TIMEOUT)
+
+    return pool
+
+
+def http_request(url, method='GET', headers=None):
+    """Performs an HTTP request, reusing connections where possible.
+
+    Redirects are followed. This returns a tuple of (status, headers,
+    body), with lowercase header names. Errors from the server are
+    returned as a status, rather than raised.
+
+    If a proxy is configured for the URL's scheme, or the scheme isn't
+    HTTP or HTTPS, the request goes through urllib2 instead, which
+    handles those cases.
+    """
+    for i in xrange(MAX_REDIRECTS + 1):
+        parts = urlparse.urlsplit(url)
+
+        if (parts.scheme not in ('http', 'https') or
+                (parts.scheme in urllib.getproxies() and
+                 not urllib.proxy_bypass(parts.hostname))):
+            return _urllib2_request(url, method, headers)
+
+        path = parts.path or '/'
+
+        if parts.query:
+            path += '?' + parts.query
+
+        pool = get_connection_pool(parts.scheme, parts.hostname, parts.port)
+        status, response_headers, body = pool.request(method, path, headers)
+
+        if status not in REDIRECT_CODES or 'location' not in response_headers:
+            break
+
+        url = urlparse.urljoin(url, response_headers['location'])
+
+        if status == 303:
+            method = 'GET'
+
+    return status, response_headers, body
+
+
+class _Request(urllib2.Request):
+    def __init__(self, url, method, headers):
+        urllib2.Request.__init__(self, url, headers=headers or {})
+        self.method = method
+
+    def get_method(self):
+        return self.method
+
+
+def _urllib2_request(url, method, headers):
+    try:
+        response = urllib2.urlopen(_Request(url, method, headers))
+        status = response.getcode()
+    except urllib2.HTTPError, response:
+        status = response.code
+
+    return (status,
+            dict([(key.lower(), value)
+                  for key, value in response.info().items()]),
+            response.read())
@@ -0,0 +1,51 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from reviewboard.scmtools.git import GitTool
+from reviewboard.scmtools.models import Repository
+
+
+class Command(BaseCommand):
+    args = '[repository-name ...]'
+    help = ('Creates or updates the local mirrors of remote Git '
+            'repositories in GIT_MIRROR_DIR.\n\n'
+            'This should be run periodically (for instance, from cron) to '
+            'keep the mirrors current. Files that aren\'t in a mirror yet '
+            'are fetched from the repository as usual. If no repository '
+            'names are given, all visible remote Git repositories are '
+            'mirrored.')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'GIT_MIRROR_DIR', None):
+            raise CommandError('GIT_MIRROR_DIR must be set in '
+                               'settings_local.py to mirror repositories.')
+
+        repositories = Repository.objects.filter(
+            visible=True,
+            tool__class_name='%s.%s' % (GitTool.__module__, GitTool.__name__))
+
+        if args:
+            repositories = repositories.filter(name__in=args)
+
+        failed = False
+
+        for repository in repositories:
+            tool = repository.get_scmtool()
+
+            if tool.client.git_dir:
+                # Local repositories are already read directly.
+                continue
+
+            self.stdout.write('Syncing %s...\n' % repository.name)
+
+            try:
+                tool.sync_mirror()
+            except Exception, e:
+                sys.stderr.write('Unable to sync the mirror of %s: %s\n'
+                                 % (repository.name, e))
+                failed = True
+
+        if failed:
+            sys.exit(1)
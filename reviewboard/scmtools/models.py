@@ -1,7 +1,20 @@
+from __future__ import with_statement
+
+import json
+import logging
+import pickle
+import threading
+import time
+import uuid
+import zlib
+
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils.datastructures import SortedDict
 from django.utils.http import urlquote
 from django.utils.translation import ugettext_lazy as _
 from djblets.log import log_timed
@@ -9,10 +22,18 @@ from djblets.util.fields import JSONField
 from djblets.util.misc import cache_memoize, make_cache_key
 
 from reviewboard.hostingsvcs.models import HostingServiceAccount
+from reviewboard.scmtools.core import (Commit, SCMTool,
+                                       get_files_concurrently)
+from reviewboard.scmtools.filecache import get_file_cache
 from reviewboard.scmtools.managers import RepositoryManager, ToolManager
-from reviewboard.scmtools.signals import (checked_file_exists,
+from reviewboard.scmtools.health import (are_calls_tracked, check_circuit,
+                                         record_batch_call, untracked_calls)
+from reviewboard.scmtools.signals import (check_file_exists_failed,
+                                          checked_file_exists,
                                           checking_file_exists,
+                                          fetch_file_failed,
                                           fetched_file, fetching_file)
+from reviewboard.scmtools.singleflight import cache_lock
 from reviewboard.site.models import LocalSite
 
 
@@ -143,9 +164,64 @@ class Repository(models.Model):
     BRANCHES_CACHE_PERIOD = 60 * 5  # 5 minutes
     COMMITS_CACHE_PERIOD = 60 * 60 * 24  # 1 day
 
+    # How long branches are cached for repositories with hooks that notify
+    # us of pushes (see notify_pushed). Their cached branches and lists of
+    # commits are cleared on each push, so they don't need to expire
+    # quickly. If no pushes are heard of for this long, the repository goes
+    # back to using BRANCHES_CACHE_PERIOD.
+    PUSH_NOTIFIED_CACHE_PERIOD = 60 * 60 * 24 * 7  # 1 week
+
+    # How long get_file_exists remembers that a file doesn't exist. This is
+    # kept short, since the file may be pushed soon after, but lets other
+    # processes waiting on the same check use its result.
+    MISSING_FILE_CACHE_PERIOD = 10
+
+    # The maximum number of threads used to fetch files from a hosting
+    # service in get_files.
+    HOSTING_SERVICE_MAX_THREADS = 4
+
+    # Fetched files are stored in the cache in chunks of up to this size,
+    # since memcached can't store values over 1MB. The number of chunks is
+    # stored under the file's key, along with FILE_CACHE_FORMAT, which is
+    # changed whenever the format of the stored data changes.
+    FILE_CACHE_CHUNK_SIZE = 2 ** 20 - 1024
+    FILE_CACHE_FORMAT = 'file-chunks:1'
+
     def get_scmtool(self):
+        """Returns an SCMTool instance for this repository.
+
+        Creating an SCMTool can be expensive, as many of them set up a
+        client or open the repository. Instances are therefore kept and
+        reused for later calls, as long as the repository's configuration
+        hasn't changed.
+
+        SCM clients generally aren't safe to share between threads, so the
+        instances are kept per-thread. Each thread keeps up to
+        MAX_CACHED_SCMTOOLS instances, discarding the least recently used.
+        A reused instance is given this Repository, so that it doesn't use
+        state from the one it was created with.
+        """
         cls = self.tool.get_scmtool_class()
-        return cls(self)
+
+        if self.pk is None:
+            return cls(self)
+
+        fingerprint = self._get_scmtool_fingerprint(cls)
+        scmtools = _get_scmtool_registry()
+        entry = scmtools.pop(self.pk, None)
+
+        if entry and entry[0] == fingerprint:
+            tool = entry[1]
+            tool.repository = self
+        else:
+            tool = cls(self)
+
+        scmtools[self.pk] = (fingerprint, tool)
+
+        while len(scmtools) > MAX_CACHED_SCMTOOLS:
+            del scmtools[iter(scmtools).next()]
+
+        return tool
 
     @property
     def hosting_service(self):
@@ -176,19 +252,82 @@ class Repository(models.Model):
         repository is backed by a hosting service, it will go through that.
         Otherwise, it will attempt to directly access the repository.
         """
-        # We wrap the result of get_file in a list and then return the first
-        # element after getting the result from the cache. This prevents the
-        # cache backend from converting to unicode, since we're no longer
-        # passing in a string and the cache backend doesn't recursively look
-        # through the list in order to convert the elements inside.
-        #
-        # Basically, this fixes the massive regressions introduced by the
-        # Django unicode changes.
-        return cache_memoize(
-            self._make_file_cache_key(path, revision, base_commit_id),
-            lambda: [self._get_file_uncached(path, revision, base_commit_id,
-                                             request)],
-            large_data=True)[0]
+        key = self._make_file_cache_key(path, revision, base_commit_id)
+        cached = self._get_cached_files([key])
+
+        if key not in cached:
+            # If several processes ask for the same uncached file at once,
+            # only one will fetch it. The rest will wait and read it from
+            # the cache.
+            with cache_lock(key):
+                cached = self._get_cached_files([key])
+
+                if key not in cached:
+                    cached[key] = self._get_file_uncached(
+                        path, revision, base_commit_id, request)
+                    self._store_cached_file(key, cached[key])
+
+        return cached[key]
+
+    def get_files(self, files, base_commit_id=None, request=None):
+        """Returns several files from the repository.
+
+        files is a list of (path, revision) tuples. The contents of the
+        files are returned in a list, in the same order.
+
+        All the files are looked up in the cache at once. Any that aren't
+        in the cache are fetched together from the hosting service or
+        SCMTool, which may be able to fetch them more efficiently than
+        through individual calls to get_file. If any file can't be fetched,
+        the error for it will be raised.
+        """
+        cache_keys = [
+            self._make_file_cache_key(path, revision, base_commit_id)
+            for path, revision in files
+        ]
+        cached = self._get_cached_files(cache_keys)
+
+        missing = [
+            i
+            for i, key in enumerate(cache_keys)
+            if key not in cached
+        ]
+
+        file_cache = get_file_cache()
+
+        if missing and file_cache:
+            for i in list(missing):
+                data = file_cache.get(cache_keys[i])
+
+                if data is not None:
+                    missing.remove(i)
+                    self._store_cached_file(cache_keys[i], data)
+                    cached[cache_keys[i]] = data
+
+        if missing:
+            mirrored = self._get_mirrored_files([files[i] for i in missing])
+
+            for i, data in zip(list(missing), mirrored):
+                if data is not None:
+                    missing.remove(i)
+                    self._store_cached_file(cache_keys[i], data)
+                    cached[cache_keys[i]] = data
+
+        if missing:
+            fetched = self._get_files_uncached([files[i] for i in missing],
+                                               base_commit_id, request)
+
+            for i, data in zip(missing, fetched):
+                if file_cache:
+                    file_cache.set(cache_keys[i], data)
+
+                self._store_cached_file(cache_keys[i], data)
+                cached[cache_keys[i]] = data
+
+        return [
+            cached[key]
+            for key in cache_keys
+        ]
 
     def get_file_exists(self, path, revision, base_commit_id=None,
                         request=None):
@@ -199,33 +338,84 @@ class Repository(models.Model):
         repository.
 
         The result of this call will be cached, making future lookups
-        of this path and revision on this repository faster.
+        of this path and revision on this repository faster. Files that
+        don't exist are only remembered for MISSING_FILE_CACHE_PERIOD.
         """
         key = self._make_file_exists_cache_key(path, revision, base_commit_id)
+        full_key = make_cache_key(key)
+        cached = cache.get(full_key)
 
-        if cache.get(make_cache_key(key)) == '1':
-            return True
+        if cached is not None:
+            return cached == '1'
 
-        exists = self._get_file_exists_uncached(path, revision,
-                                                base_commit_id, request)
+        # Only one process checks a given file at a time. Others wait and
+        # then use the cached result.
+        with cache_lock(key):
+            cached = cache.get(full_key)
 
-        if exists:
-            cache_memoize(key, lambda: '1')
+            if cached is not None:
+                return cached == '1'
+
+            exists = self._get_file_exists_uncached(path, revision,
+                                                    base_commit_id, request)
+
+            if exists:
+                cache_memoize(key, lambda: '1')
+            else:
+                cache.set(full_key, '0', self.MISSING_FILE_CACHE_PERIOD)
 
         return exists
 
     def get_branches(self):
-        """Returns a list of branches."""
+        """Returns a list of branches.
+
+        The branches are cached for BRANCHES_CACHE_PERIOD, or, if the
+        repository notifies us of pushes, until the next push or until
+        PUSH_NOTIFIED_CACHE_PERIOD after the last push.
+        """
         hosting_service = self.hosting_service
+        last_push = self._get_last_push_time()
 
-        cache_key = make_cache_key('repository-branches:%s' % self.pk)
+        cache_key = make_cache_key('repository-branches:%s:%s'
+                                   % (self.pk, self._get_push_cache_token()))
         if hosting_service:
             branches_callable = lambda: hosting_service.get_branches(self)
         else:
             branches_callable = self.get_scmtool().get_branches
 
-        return cache_memoize(cache_key, branches_callable,
-                             self.BRANCHES_CACHE_PERIOD)
+        if last_push is not None:
+            since_push = time.time() - last_push
+        else:
+            since_push = None
+
+        if (since_push is not None and
+                since_push < self.PUSH_NOTIFIED_CACHE_PERIOD):
+            # The last push time is only remembered for
+            # PUSH_NOTIFIED_CACHE_PERIOD, so the branches shouldn't outlive
+            # it. An expiration of 0 would mean they never expire.
+            expiration = max(
+                int(self.PUSH_NOTIFIED_CACHE_PERIOD - since_push), 1)
+        else:
+            expiration = self.BRANCHES_CACHE_PERIOD
+
+        return cache_memoize(cache_key, branches_callable, expiration)
+
+    def notify_pushed(self):
+        """Notes that changes have been pushed to the repository.
+
+        This is called (through the API) by hooks in the repository after
+        each push or commit. The cached branches and lists of commits are
+        cleared, so that the new changes are seen right away. Until pushes
+        stop being heard of, branches are then cached for
+        PUSH_NOTIFIED_CACHE_PERIOD, rather than being fetched again every
+        BRANCHES_CACHE_PERIOD.
+        """
+        # Rather than finding and deleting every cached list of commits,
+        # the cache keys include the time of the last push (see
+        # _get_push_cache_token), so the old entries are just no longer
+        # used. The time is remembered for PUSH_NOTIFIED_CACHE_PERIOD.
+        cache.set(self._make_last_push_cache_key(), time.time(),
+                  self.PUSH_NOTIFIED_CACHE_PERIOD)
 
     def get_commit_cache_key(self, commit):
         return 'repository-commit:%s:%s' % (self.pk, commit)
@@ -235,14 +425,41 @@ class Repository(models.Model):
 
         This is paginated via the 'start' parameter. Any exceptions are
         expected to be handled by the caller.
+
+        If the hosting service or SCMTool sets commits_page_size, commits
+        are recorded in the repository's commit index as they're fetched.
+        If the index already holds a full page of commits starting at
+        'start', it's used instead of going to the repository.
         """
         hosting_service = self.hosting_service
 
-        cache_key = make_cache_key('repository-commits:%s:%s' % (self.pk, start))
         if hosting_service:
-            commits_callable = lambda: hosting_service.get_commits(self, start)
+            page_size = hosting_service.commits_page_size
         else:
-            commits_callable = lambda: self.get_scmtool().get_commits(start)
+            page_size = self.tool.get_scmtool_class().commits_page_size
+
+        use_index = page_size and self.pk is not None
+
+        cache_key = make_cache_key('repository-commits:%s:%s:%s'
+                                   % (self.pk, self._get_push_cache_token(),
+                                      start))
+
+        def commits_callable():
+            commits = None
+
+            if start and use_index:
+                commits = self._get_indexed_commits(start, page_size)
+
+            if commits is None:
+                if hosting_service:
+                    commits = hosting_service.get_commits(self, start)
+                else:
+                    commits = self.get_scmtool().get_commits(start)
+
+                if use_index:
+                    self._index_commits(commits)
+
+            return commits
 
         # We cache both the entire list for 'start', as well as each individual
         # commit. This allows us to reduce API load when people are looking at
@@ -264,6 +481,19 @@ class Repository(models.Model):
         """
         hosting_service = self.hosting_service
 
+        # The hosting services and SCMTools look up the commit's details in
+        # the cache before asking the repository for them. If the commit has
+        # fallen out of the cache, but is in the commit index, put it back.
+        commit_cache_key = self.get_commit_cache_key(revision)
+
+        if self.pk is not None and not cache.has_key(commit_cache_key):
+            try:
+                commit = self.indexed_commits.get(commit_id=revision)
+                cache.set(commit_cache_key, commit.get_commit(),
+                          self.COMMITS_CACHE_PERIOD)
+            except IndexedCommit.DoesNotExist:
+                pass
+
         if hosting_service:
             return hosting_service.get_change(self, revision)
         else:
@@ -297,6 +527,172 @@ class Repository(models.Model):
     def __unicode__(self):
         return self.name
 
+    def _get_indexed_commits(self, start, page_size):
+        """Returns a page of commits from the commit index.
+
+        This follows the commits in the order the repository listed them,
+        starting at 'start'. If the index doesn't have a full page of
+        page_size commits (or all commits back to the first one), None is
+        returned.
+        """
+        commits = []
+        commit_id = start
+
+        while len(commits) < page_size:
+            try:
+                indexed_commit = self.indexed_commits.get(commit_id=commit_id)
+            except IndexedCommit.DoesNotExist:
+                return None
+
+            commits.append(indexed_commit.get_commit())
+
+            if (indexed_commit.next_commit_id ==
+                    IndexedCommit.AMBIGUOUS_NEXT_COMMIT_ID):
+                return None
+            elif not indexed_commit.next_commit_id:
+                if indexed_commit.parent_id:
+                    # We don't know what comes after this commit yet.
+                    return None
+
+                break
+
+            commit_id = indexed_commit.next_commit_id
+
+        return commits
+
+    def _index_commits(self, commits):
+        """Records a page of commits fetched from the repository.
+
+        Commits are only ever added to the index. Existing entries are
+        updated only to link them to the commit listed after them, if
+        that wasn't known before.
+
+        Around merges, the order in which commits are listed can depend on
+        where the listing started. If this page lists a known commit with a
+        different commit after it than the index has, the commit is marked
+        as having no fixed next commit. Pages through it are then always
+        fetched from the repository.
+        """
+        commit_ids = [commit.id for commit in commits]
+        indexed = dict([
+            (indexed_commit.commit_id, indexed_commit.next_commit_id)
+            for indexed_commit in self.indexed_commits.filter(
+                commit_id__in=commit_ids)
+        ])
+        unlinked_ids = ('', IndexedCommit.AMBIGUOUS_NEXT_COMMIT_ID)
+        conflicting_ids = [
+            commit.id
+            for commit, next_commit in zip(commits, commits[1:])
+            if (commit.id in indexed and
+                indexed[commit.id] not in unlinked_ids and
+                indexed[commit.id] != next_commit.id)
+        ]
+
+        if conflicting_ids:
+            self.indexed_commits.filter(commit_id__in=conflicting_ids).update(
+                next_commit_id=IndexedCommit.AMBIGUOUS_NEXT_COMMIT_ID)
+
+            for commit_id in conflicting_ids:
+                indexed[commit_id] = IndexedCommit.AMBIGUOUS_NEXT_COMMIT_ID
+
+        new_commits = []
+
+        for i, commit in enumerate(commits):
+            if i + 1 < len(commits):
+                next_commit_id = commits[i + 1].id
+            else:
+                next_commit_id = ''
+
+            if commit.id not in indexed:
+                new_commits.append(IndexedCommit(
+                    repository=self,
+                    commit_id=commit.id,
+                    parent_id=commit.parent or '',
+                    next_commit_id=next_commit_id,
+                    author_name=commit.author_name[:256],
+                    date=commit.date,
+                    message=commit.message))
+            elif next_commit_id and not indexed[commit.id]:
+                self.indexed_commits.filter(commit_id=commit.id).update(
+                    next_commit_id=next_commit_id)
+
+        if new_commits:
+            # Another process may be indexing the same commits.
+            sid = transaction.savepoint()
+
+            try:
+                IndexedCommit.objects.bulk_create(new_commits)
+                transaction.savepoint_commit(sid)
+            except IntegrityError:
+                transaction.savepoint_rollback(sid)
+
+        if commits:
+            # The next page of commits is listed by starting at the parent
+            # of the last commit on a page, so link that last commit to
+            # this page.
+            self.indexed_commits.filter(
+                parent_id=commits[0].id,
+                next_commit_id='').update(next_commit_id=commits[0].id)
+
+    def _get_scmtool_fingerprint(self, scmtool_cls):
+        """Returns the configuration that SCMTool instances depend on.
+
+        A cached SCMTool instance is only reused if this matches the
+        fingerprint it was created with.
+        """
+        return (
+            '%s.%s' % (scmtool_cls.__module__, scmtool_cls.__name__),
+            self.path,
+            self.mirror_path,
+            self.raw_file_url,
+            self.username,
+            self.password,
+            self.encoding,
+            self.hosting_account_id,
+            self.local_site_id,
+            json.dumps(self.extra_data, sort_keys=True),
+        )
+
+    def _get_last_push_time(self):
+        """Internal function for getting the time of the last push.
+
+        This returns None if no push has been heard of recently.
+        """
+        if self.pk is None:
+            return None
+
+        last_push = cache.get(self._make_last_push_cache_key())
+
+        if isinstance(last_push, float):
+            return last_push
+        else:
+            return None
+
+    def _get_push_cache_token(self):
+        """Internal function for getting the pushes part of cache keys.
+
+        This is the time of the last push, if one has been heard of
+        recently. Otherwise, a new random token is stored in its place, so
+        that branches and commits cached before an earlier push (or before
+        the last push time was evicted) are never used again.
+        """
+        if self.pk is None:
+            return None
+
+        key = self._make_last_push_cache_key()
+        token = cache.get(key)
+
+        if token is None:
+            cache.add(key, 'no-push:%s' % uuid.uuid4().hex,
+                      settings.CACHE_EXPIRATION_TIME)
+            token = cache.get(key)
+
+        return repr(token)
+
+    def _make_last_push_cache_key(self):
+        """Internal function for generating the last push's cache key."""
+        return make_cache_key('repository-last-push:%s' % self.pk)
+
     def _make_file_cache_key(self, path, revision, base_commit_id):
         """Makes a cache key for fetched files."""
         return "file:%s:%s:%s:%s" % (self.pk, urlquote(path),
@@ -313,7 +709,39 @@ class Repository(models.Model):
         """Internal function for fetching an uncached file.
 
         This is called by get_file if the file isn't already in the cache.
+        The on-disk file cache, if enabled, and then the repository's local
+        mirror, if any, are checked before going to the repository. The
+        on-disk file cache will be given the file once fetched.
         """
+        file_cache = get_file_cache()
+
+        if file_cache:
+            key = self._make_file_cache_key(path, revision, base_commit_id)
+            data = file_cache.get(key)
+
+            if data is not None:
+                return data
+
+        data = self._get_mirrored_files([(path, revision)])[0]
+
+        if data is not None:
+            return data
+
+        data = self._fetch_file(path, revision, base_commit_id, request)
+
+        if file_cache:
+            file_cache.set(key, data)
+
+        return data
+
+    def _fetch_file(self, path, revision, base_commit_id, request):
+        """Internal function for fetching a file from the repository.
+
+        This goes through the hosting service or SCMTool, bypassing any
+        caches.
+        """
+        check_circuit(self)
+
         fetching_file.send(sender=self,
                            path=path,
                            revision=revision,
@@ -331,14 +759,23 @@ class Repository(models.Model):
 
         hosting_service = self.hosting_service
 
-        if hosting_service:
-            data = hosting_service.get_file(
-                self,
-                path,
-                revision,
-                base_commit_id=base_commit_id)
-        else:
-            data = self.get_scmtool().get_file(path, revision)
+        try:
+            if hosting_service:
+                data = hosting_service.get_file(
+                    self,
+                    path,
+                    revision,
+                    base_commit_id=base_commit_id)
+            else:
+                data = self.get_scmtool().get_file(path, revision)
+        except Exception, e:
+            fetch_file_failed.send(sender=self,
+                                   path=path,
+                                   revision=revision,
+                                   base_commit_id=base_commit_id,
+                                   request=request,
+                                   error=e)
+            raise
 
         log_timer.done()
 
@@ -351,6 +788,184 @@ class Repository(models.Model):
 
         return data
 
+    def _get_files_uncached(self, files, base_commit_id, request):
+        """Internal function for fetching several uncached files.
+
+        This is called by get_files for the files that aren't already in
+        the cache. Hosting services fetch files individually, using a pool
+        of threads. Otherwise, the files are fetched through the SCMTool's
+        get_files.
+        """
+        if self.hosting_service:
+            untracked = not are_calls_tracked()
+
+            def fetch_file(path, revision):
+                # The pool's threads don't know whether this thread's calls
+                # are being recorded.
+                with untracked_calls(untracked):
+                    return self._fetch_file(path, revision, base_commit_id,
+                                            request)
+
+            return get_files_concurrently(fetch_file, files,
+                                          self.HOSTING_SERVICE_MAX_THREADS)
+
+        check_circuit(self)
+
+        # The files are fetched with one call, which is recorded as one call
+        # in the repository's health.
+        with record_batch_call(self):
+            for path, revision in files:
+                fetching_file.send(sender=self,
+                                   path=path,
+                                   revision=revision,
+                                   base_commit_id=base_commit_id,
+                                   request=request)
+
+            log_timer = log_timed("Fetching %d files from %s"
+                                  % (len(files), self),
+                                  request=request)
+
+            try:
+                results = self.get_scmtool().get_files(files)
+            except Exception, e:
+                for path, revision in files:
+                    fetch_file_failed.send(sender=self,
+                                           path=path,
+                                           revision=revision,
+                                           base_commit_id=base_commit_id,
+                                           request=request,
+                                           error=e)
+
+                raise
+
+            log_timer.done()
+
+            for (path, revision), data in zip(files, results):
+                fetched_file.send(sender=self,
+                                  path=path,
+                                  revision=revision,
+                                  base_commit_id=base_commit_id,
+                                  request=request,
+                                  data=data)
+
+        return results
+
+    def _get_mirrored_files(self, files):
+        """Internal function for reading files from a local mirror.
+
+        Files that aren't in the repository's mirror (or all of them, if
+        there's no mirror) are returned as None. Errors reading from the
+        mirror are logged, and the files will be fetched from the
+        repository instead.
+        """
+        scmtool_cls = self.tool.get_scmtool_class()
+
+        if (not getattr(settings, 'GIT_MIRROR_DIR', None) or
+                scmtool_cls.get_mirrored_files.im_func is
+                SCMTool.get_mirrored_files.im_func):
+            # No mirrors are set up, so there's no need to create the
+            # SCMTool.
+            return [None] * len(files)
+
+        try:
+            return self.get_scmtool().get_mirrored_files(files)
+        except Exception, e:
+            logging.warning('Unable to read %d files from the mirror of '
+                            'repository %s: %s', len(files), self, e)
+
+            return [None] * len(files)
+
+    def _cache_mirrored_file(self, key, path, revision):
+        """Internal function for caching a file from a local mirror.
+
+        This returns whether the file was in the repository's mirror. If
+        it was, it's stored in get_file's cache.
+        """
+        data = self._get_mirrored_files([(path, revision)])[0]
+
+        if data is None:
+            return False
+
+        self._store_cached_file(key, data)
+
+        return True
+
+    def _store_cached_file(self, key, data):
+        """Internal function for storing a fetched file in the cache.
+
+        The file is pickled, compressed and split into chunks of up to
+        FILE_CACHE_CHUNK_SIZE, so that large files fit in memcached. The
+        chunks are stored before the number of chunks, so that a file is
+        never seen in the cache before all of it is stored. They're read
+        back by _get_cached_files.
+        """
+        full_key = make_cache_key(key)
+        data = zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        chunk_size = self.FILE_CACHE_CHUNK_SIZE
+        chunks = {}
+
+        # Each chunk is stored in a list, which prevents the cache backend
+        # from converting it to unicode.
+        for i, offset in enumerate(xrange(0, len(data), chunk_size)):
+            chunks['%s-%d' % (full_key, i)] = \
+                [data[offset:offset + chunk_size]]
+
+        cache.set_many(chunks, settings.CACHE_EXPIRATION_TIME)
+        cache.set(full_key, (self.FILE_CACHE_FORMAT, len(chunks)),
+                  settings.CACHE_EXPIRATION_TIME)
+
+    def _get_cached_files(self, cache_keys):
+        """Internal function for fetching several files from the cache.
+
+        This reads the files stored by _store_cached_file for each key,
+        using only two cache requests: one for the numbers of chunks, and
+        one for all the chunks.
+
+        The data for each file found in the cache is returned in a
+        dictionary mapping the cache keys to the data. Files that were
+        stored in another format, or are missing chunks, are left out.
+        """
+        full_keys = dict(
+            (make_cache_key(key), key)
+            for key in cache_keys
+        )
+        chunk_counts = {}
+
+        for full_key, header in cache.get_many(full_keys.keys()).iteritems():
+            if (isinstance(header, tuple) and len(header) == 2 and
+                    header[0] == self.FILE_CACHE_FORMAT):
+                chunk_counts[full_key] = header[1]
+
+        chunk_keys = [
+            '%s-%d' % (full_key, i)
+            for full_key, chunk_count in chunk_counts.iteritems()
+            for i in xrange(chunk_count)
+        ]
+
+        if chunk_keys:
+            chunks = cache.get_many(chunk_keys)
+        else:
+            chunks = {}
+
+        results = {}
+
+        for full_key, chunk_count in chunk_counts.iteritems():
+            try:
+                data = ''.join([
+                    chunks['%s-%d' % (full_key, i)][0]
+                    for i in xrange(chunk_count)
+                ])
+                results[full_keys[full_key]] = \
+                    pickle.loads(zlib.decompress(data))
+            except KeyError:
+                logging.debug('Cache miss for some chunks of key %s.',
+                              full_key)
+            except Exception, e:
+                logging.warning('Failed to read file from cache for key '
+                                '%s: %s.', full_key, e)
+
+        return results
+
     def _get_file_exists_uncached(self, path, revision, base_commit_id,
                                   request):
         """Internal function for checking that a file exists.
@@ -360,16 +975,24 @@ class Repository(models.Model):
 
         This function is smart enough to check if the file exists in cache,
         and will use that for the result instead of making a separate call.
+        If the SCMTool has to download the file to check for it, the file
+        is stored in get_file's cache.
         """
         # First we check to see if we've fetched the file before. If so,
         # it's in there and we can just return that we have it.
-        file_cache_key = make_cache_key(
-            self._make_file_cache_key(path, revision, base_commit_id))
+        key = self._make_file_cache_key(path, revision, base_commit_id)
+        file_cache = get_file_cache()
 
-        if cache.has_key(file_cache_key):
+        if cache.has_key(make_cache_key(key)):
+            exists = True
+        elif file_cache and file_cache.has_key(key):
+            exists = True
+        elif self._cache_mirrored_file(key, path, revision):
             exists = True
         else:
             # We didn't have that in the cache, so check from the repository.
+            check_circuit(self)
+
             checking_file_exists.send(sender=self,
                                       path=path,
                                       revision=revision,
@@ -378,14 +1001,33 @@ class Repository(models.Model):
 
             hosting_service = self.hosting_service
 
-            if hosting_service:
-                exists = hosting_service.get_file_exists(
-                    self,
-                    path,
-                    revision,
-                    base_commit_id=base_commit_id)
-            else:
-                exists = self.get_scmtool().file_exists(path, revision)
+            try:
+                if hosting_service:
+                    exists = hosting_service.get_file_exists(
+                        self,
+                        path,
+                        revision,
+                        base_commit_id=base_commit_id)
+                else:
+                    exists, data = self.get_scmtool().check_file_exists(
+                        path, revision)
+
+                    if data is not None:
+                        # The whole file was downloaded in order to check
+                        # for it, so cache it for get_file rather than
+                        # fetching it again later.
+                        self._store_cached_file(key, data)
+
+                        if file_cache:
+                            file_cache.set(key, data)
+            except Exception, e:
+                check_file_exists_failed.send(sender=self,
+                                              path=path,
+                                              revision=revision,
+                                              base_commit_id=base_commit_id,
+                                              request=request,
+                                              error=e)
+                raise
 
             checked_file_exists.send(sender=self,
                                      path=path,
@@ -403,3 +1045,71 @@ class Repository(models.Model):
         # the tables and enforce it in code whenever visible=True
         unique_together = (('name', 'local_site'),
                            ('path', 'local_site'))
+
+
+class IndexedCommit(models.Model):
+    """A commit recorded in a repository's commit index.
+
+    The commit index holds the commits that have been listed by
+    Repository.get_commits, so that pages of commits can be listed again
+    without going back to the repository. Commits don't change once
+    they've been made, so entries are kept indefinitely.
+
+    Each entry records the commit that the repository listed after it,
+    which is used to rebuild the pages in the same order.
+    """
+    # The next_commit_id of a commit that the repository lists different
+    # commits after, depending on where the listing starts.
+    AMBIGUOUS_NEXT_COMMIT_ID = '*'
+
+    repository = models.ForeignKey(Repository, related_name='indexed_commits')
+    commit_id = models.CharField(max_length=64)
+    parent_id = models.CharField(max_length=64, blank=True)
+    next_commit_id = models.CharField(max_length=64, blank=True)
+    author_name = models.CharField(max_length=256, blank=True)
+    date = models.CharField(max_length=64, blank=True)
+    message = models.TextField(blank=True)
+
+    def get_commit(self):
+        """Returns the Commit for this entry."""
+        return Commit(self.author_name, self.commit_id, self.date,
+                      self.message, self.parent_id)
+
+    def __unicode__(self):
+        return self.commit_id
+
+    class Meta:
+        unique_together = ('repository', 'commit_id')
+
+
+# The maximum number of SCMTool instances kept by each thread for
+# Repository.get_scmtool.
+MAX_CACHED_SCMTOOLS = 20
+
+_scmtool_registries = threading.local()
+
+
+def _get_scmtool_registry():
+    """Returns the SCMTool instances for the current thread.
+
+    This maps repository IDs to (fingerprint, SCMTool) tuples, from the
+    least to the most recently used.
+    """
+    try:
+        return _scmtool_registries.scmtools
+    except AttributeError:
+        _scmtool_registries.scmtools = SortedDict()
+        return _scmtool_registries.scmtools
+
+
+def _invalidate_scmtool(sender, instance, **kwargs):
+    """Discards the cached SCMTool for a repository that was changed.
+
+    Instances in other threads and processes are discarded the next time
+    they're requested, since their fingerprint won't match.
+    """
+    _get_scmtool_registry().pop(instance.pk, None)
+
+
+post_save.connect(_invalidate_scmtool, sender=Repository)
+post_delete.connect(_invalidate_scmtool, sender=Repository)
@@ -1,5 +1,4 @@
 import os
-import subprocess
 
 from djblets.util.filesystem import is_exe_in_path
 
@@ -85,10 +84,7 @@ class MonotoneClient:
     def get_file(self, fileid):
         args = ['mtn', '-d', self.path, 'automate', 'get_file', fileid]
 
-        p = subprocess.Popen(args,
-                             stderr=subprocess.PIPE,
-                             stdout=subprocess.PIPE,
-                             close_fds=(os.name != 'nt'))
+        p = SCMTool.popen(args)
 
         out = p.stdout.read()
         err = p.stderr.read()
@@ -1,3 +1,7 @@
+from __future__ import with_statement
+
+import atexit
+import logging
 import os
 import random
 import re
@@ -6,9 +10,12 @@ import signal
 import socket
 import subprocess
 import tempfile
+import threading
 import time
 
+from django.core.cache import cache
 from djblets.util.filesystem import is_exe_in_path
+from djblets.util.misc import make_cache_key
 try:
     from P4 import P4Exception
 except ImportError:
@@ -68,6 +75,17 @@ class STunnelProxy(object):
             os.kill(self.pid, signal.SIGTERM)
             self.pid = None
 
+    def is_alive(self):
+        """Returns whether the stunnel process is still running."""
+        if not self.pid:
+            return False
+
+        try:
+            os.kill(self.pid, 0)
+            return True
+        except OSError:
+            return False
+
     def _find_port(self):
         """Find an available port."""
         # This is slightly racy but shouldn't be too bad.
@@ -83,9 +101,60 @@ class STunnelProxy(object):
                 pass
 
 
-class PerforceClient(object):
-    def __init__(self, p4port, username, password, encoding, use_stunnel=False,
-                 use_ticket_auth=False):
+class PerforceConnection(object):
+    """A persistent connection to a Perforce server.
+
+    This wraps a P4 instance, along with the time it was last used, so
+    that idle connections can be checked and closed by the pool.
+    """
+    def __init__(self, p4):
+        self.p4 = p4
+        self.last_used = time.time()
+
+    def is_alive(self):
+        """Returns whether the connection is still open."""
+        try:
+            return self.p4.connected()
+        except AttributeError:
+            return False
+
+    def close(self):
+        """Disconnects from the server."""
+        try:
+            if self.p4.connected():
+                self.p4.disconnect()
+        except (AttributeError, P4Exception):
+            pass
+
+
+class PerforceConnectionPool(object):
+    """A pool of persistent connections to a Perforce server.
+
+    Connections are handed out one command at a time, so a connection is
+    never used by two threads at once. Connections that have been idle for
+    longer than KEEPALIVE_INTERVAL seconds are checked before being reused,
+    and ones idle for longer than IDLE_TIMEOUT seconds are closed.
+
+    When connecting through stunnel, a single stunnel proxy is shared by
+    all connections in the pool. It stays up until the process exits. If
+    it dies, a new one is started for new connections, and connections
+    through the old one are closed as they fail.
+    """
+    KEEPALIVE_INTERVAL = 30
+    IDLE_TIMEOUT = 300
+    MAX_IDLE_CONNECTIONS = 4
+
+    # Errors from the server meaning that the connection's login is no
+    # longer valid, such as when a ticket has expired.
+    LOGIN_ERRORS = (
+        'Perforce password',
+        'Password must be set',
+        'Your session has expired',
+        'Your session was logged out',
+    )
+
+    def __init__(self, p4port, username, password, encoding,
+                 use_stunnel=False, use_ticket_auth=False):
         self.p4port = p4port
         self.username = username
         self.password = password
@@ -93,56 +162,260 @@ class PerforceClient(object):
         self.use_stunnel = use_stunnel
         self.use_ticket_auth = use_ticket_auth
         self.proxy = None
+        self._idle = []
+        self._lock = threading.Lock()
 
-        import P4
-        self.p4 = P4.P4()
+    def run(self, worker):
+        """Runs a worker function with a connection from the pool.
 
-        if use_stunnel and not is_exe_in_path('stunnel'):
-            raise AttributeError('stunnel proxy was requested, but stunnel '
-                                 'binary is not in the exec path.')
+        The worker is passed the P4 instance to use. If the worker fails
+        because a reused connection was dropped by the server, or because
+        its login has expired, it will be retried once on a new connection,
+        which logs in again. Any P4Exception is converted to the appropriate
+        SCMError.
+        """
+        conn, reused = self._acquire()
+        logged_in_again = False
+
+        while True:
+            try:
+                result = worker(conn.p4)
+                break
+            except P4Exception, e:
+                if not logged_in_again and self._is_login_error(e):
+                    conn.close()
+                    logging.warning('Perforce login for %s is no longer '
+                                    'valid. Logging in again: %s',
+                                    self.p4port, e)
+                    logged_in_again = True
+                    conn, reused = self._acquire(reuse=False)
+                    continue
+
+                if conn.is_alive():
+                    # The command failed, but the connection is fine.
+                    self._release(conn)
+                    PerforceClient._convert_p4exception_to_scmexception(e)
+
+                conn.close()
+
+                if not reused:
+                    PerforceClient._convert_p4exception_to_scmexception(e)
+
+                logging.warning('Perforce connection to %s was dropped. '
+                                'Reconnecting: %s', self.p4port, e)
+                conn, reused = self._acquire(reuse=False)
+            except:
+                conn.close()
+                raise
+
+        self._release(conn)
+
+        return result
+
+    def close_idle(self, max_idle_time=0):
+        """Closes connections that have been idle for too long."""
+        cutoff = time.time() - max_idle_time
+
+        with self._lock:
+            expired = [
+                conn
+                for conn in self._idle
+                if conn.last_used <= cutoff or not conn.is_alive()
+            ]
+            self._idle = [
+                conn
+                for conn in self._idle
+                if conn not in expired
+            ]
+
+        for conn in expired:
+            conn.close()
+
+    def shutdown(self):
+        """Closes all idle connections and shuts down the stunnel proxy."""
+        self.close_idle()
+
+        with self._lock:
+            proxy = self.proxy
+            self.proxy = None
+
+        if proxy:
+            try:
+                proxy.shutdown()
+            except:
+                pass
+
+    def _is_login_error(self, e):
+        """Returns whether an error means the connection must log in again."""
+        error = str(e)
+
+        for login_error in self.LOGIN_ERRORS:
+            if login_error in error:
+                return True
+
+        return False
+
+    def _acquire(self, reuse=True):
+        """Returns an open connection, and whether it was reused."""
+        self.close_idle(self.IDLE_TIMEOUT)
+
+        while reuse:
+            with self._lock:
+                if not self._idle:
+                    break
+
+                conn = self._idle.pop()
+
+            if time.time() - conn.last_used < self.KEEPALIVE_INTERVAL:
+                return conn, True
+
+            try:
+                conn.p4.run_info()
+                return conn, True
+            except P4Exception, e:
+                logging.debug('Idle Perforce connection to %s failed its '
+                              'keepalive check: %s', self.p4port, e)
+                conn.close()
+
+        try:
+            return self._connect(), False
+        except P4Exception, e:
+            PerforceClient._convert_p4exception_to_scmexception(e)
+
+    def _release(self, conn):
+        conn.last_used = time.time()
+
+        with self._lock:
+            if len(self._idle) < self.MAX_IDLE_CONNECTIONS:
+                self._idle.append(conn)
+                conn = None
+
+        if conn:
+            conn.close()
 
     def _connect(self):
         """
         Connect to the perforce server.
 
-        This connects p4python to the remote server, optionally using a stunnel
-        proxy.
+        This connects p4python to the remote server, optionally using the
+        pool's stunnel proxy.
         """
-        self.p4.user = self.username
-        self.p4.password = self.password
+        import P4
+        p4 = P4.P4()
+        p4.user = self.username
+        p4.password = self.password
         if self.encoding:
-            self.p4.charset = self.encoding
-        self.p4.exception_level = 1
+            p4.charset = self.encoding
+        p4.exception_level = 1
 
         if self.use_stunnel:
-            # Spin up an stunnel client and then redirect through that
-            self.proxy = STunnelProxy(STUNNEL_CLIENT, self.p4port)
-            self.proxy.start_client()
-            self.p4.port = '127.0.0.1:%d' % self.proxy.port
+            proxy = self._get_proxy()
+            p4.port = '127.0.0.1:%d' % proxy.port
         else:
-            self.p4.port = self.p4port
-        self.p4.connect()
+            proxy = None
+            p4.port = self.p4port
+
+        try:
+            p4.connect()
 
-        if self.use_ticket_auth:
-            self.p4.run_login()
+            if self.use_ticket_auth:
+                p4.run_login()
+        except P4Exception, e:
+            conn = PerforceConnection(p4)
+            conn.close()
 
-    def _disconnect(self):
-        """
-        Disconnect from the perforce server, and also shut down the stunnel
-        proxy (if it exists).
+            if proxy and not self._is_login_error(e):
+                self._replace_dead_proxy(proxy)
+
+            raise
+
+        return PerforceConnection(p4)
+
+    def _replace_dead_proxy(self, proxy):
+        """Makes sure new connections don't use a stunnel proxy that died.
+
+        Other threads may still be using connections through the proxy,
+        so it's only replaced if its process has exited.
         """
+        with self._lock:
+            if self.proxy is proxy and not proxy.is_alive():
+                logging.warning('The stunnel proxy for %s has exited. '
+                                'Starting a new one.', self.p4port)
+                self.proxy = None
+
+    def _get_proxy(self):
+        with self._lock:
+            if not self.proxy:
+                # Spin up an stunnel client to redirect through.
+                proxy = STunnelProxy(STUNNEL_CLIENT, self.p4port)
+                proxy.start_client()
+                self.proxy = proxy
+
+            return self.proxy
+
+
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(p4port, username, password, encoding,
+                        use_stunnel=False, use_ticket_auth=False):
+    """Returns the shared pool of connections for a Perforce server and user.
+
+    This will also close any idle connections in other pools.
+    """
+    key = (p4port, username, password, encoding, use_stunnel,
+           use_ticket_auth)
+
+    with _connection_pools_lock:
+        pools = _connection_pools.values()
+
         try:
-            if self.p4.connected():
-                self.p4.disconnect()
-        except AttributeError:
-            pass
+            pool = _connection_pools[key]
+        except KeyError:
+            pool = PerforceConnectionPool(*key)
+            _connection_pools[key] = pool
 
-        if self.proxy:
-            try:
-                self.proxy.shutdown()
-            except:
-                pass
-            self.proxy = None
+    for other_pool in pools:
+        if other_pool is not pool:
+            other_pool.close_idle(PerforceConnectionPool.IDLE_TIMEOUT)
+
+    return pool
+
+
+def _shutdown_connection_pools():
+    with _connection_pools_lock:
+        pools = _connection_pools.values()
+
+    for pool in pools:
+        pool.shutdown()
+
+
+atexit.register(_shutdown_connection_pools)
+
+
+class PerforceClient(object):
+    # The maximum number of changes to describe in a single 'p4 describe'.
+    DESCRIBE_BATCH_SIZE = 50
+
+    def __init__(self, p4port, username, password, encoding, use_stunnel=False,
+                 use_ticket_auth=False):
+        self.p4port = p4port
+        self.username = username
+        self.password = password
+        self.encoding = encoding
+        self.use_stunnel = use_stunnel
+        self.use_ticket_auth = use_ticket_auth
+
+        # Make sure p4python is available before going any further.
+        import P4
+
+        if use_stunnel and not is_exe_in_path('stunnel'):
+            raise AttributeError('stunnel proxy was requested, but stunnel '
+                                 'binary is not in the exec path.')
+
+        self.pool = get_connection_pool(p4port, username, password, encoding,
+                                        use_stunnel, use_ticket_auth)
 
     @staticmethod
     def _convert_p4exception_to_scmexception(e):
@@ -165,55 +438,91 @@ class PerforceClient(object):
             raise SCMError(error)
 
     def _run_worker(self, worker):
-        result = None
-
-        # TODO: Move to using with: when we require a minimum of Python 2.5.
-        #       We should make it auto-disconnect.
-        try:
-            self._connect()
-            result = worker()
-            self._disconnect()
-        except P4Exception, e:
-            self._disconnect()
-            self._convert_p4exception_to_scmexception(e)
-        except:
-            self._disconnect()
-            raise
-
-        return result
+        return self.pool.run(worker)
 
-    def _get_changeset(self, changesetid):
-        return self.p4.run_describe('-s', str(changesetid))
+    def _get_changeset(self, p4, changesetid):
+        return p4.run_describe('-s', str(changesetid))
 
     def get_changeset(self, changesetid):
         """
         Get the contents of a changeset description.
         """
-        return self._run_worker(lambda: self._get_changeset(changesetid))
+        return self._run_worker(lambda p4: self._get_changeset(p4, changesetid))
 
     def get_info(self):
-        return self._run_worker(self.p4.run_info)
+        return self._run_worker(lambda p4: p4.run_info())
 
-    def _get_pending_changesets(self, userid):
-        changesets = self.p4.run_changes('-s', 'pending', '-u', userid)
-        return map(self._get_changeset, [x.split()[1] for x in changesets])
+    def _get_changesets(self, p4, changesetids):
+        changesetids = [str(changesetid) for changesetid in changesetids]
+        changesets = {}
+
+        for i in xrange(0, len(changesetids), self.DESCRIBE_BATCH_SIZE):
+            batch = changesetids[i:i + self.DESCRIBE_BATCH_SIZE]
+
+            for changeset in p4.run_describe('-s', *batch):
+                if isinstance(changeset, dict) and 'change' in changeset:
+                    changesets[changeset['change']] = changeset
+
+        return changesets
+
+    def get_changesets(self, changesetids):
+        """
+        Get the contents of several changeset descriptions, using as few
+        calls to 'p4 describe' as possible.
+
+        This returns a dictionary mapping change numbers (as strings) to
+        descriptions. Changes that don't exist are left out.
+        """
+        return self._run_worker(
+            lambda p4: self._get_changesets(p4, changesetids))
+
+    def _get_pending_changeset_ids(self, p4, userid):
+        changesetids = []
+
+        for change in p4.run_changes('-s', 'pending', '-u', userid):
+            if isinstance(change, dict):
+                changesetids.append(change['change'])
+            else:
+                changesetids.append(change.split()[1])
+
+        return changesetids
+
+    def get_pending_changeset_ids(self, userid):
+        """
+        Get the change numbers of all pending changesets for a given user.
+        """
+        return self._run_worker(
+            lambda p4: self._get_pending_changeset_ids(p4, userid))
+
+    def _get_pending_changesets(self, p4, userid):
+        changesetids = self._get_pending_changeset_ids(p4, userid)
+        changesets = self._get_changesets(p4, changesetids)
+
+        return [
+            changesets[changesetid]
+            for changesetid in changesetids
+            if changesetid in changesets
+        ]
 
     def get_pending_changesets(self, userid):
         """
         Get a list of changeset descriptions for all pending changesets for a
         given user.
         """
-        return self._run_worker(lambda: self._get_pending_changesets(userid))
+        return self._run_worker(
+            lambda p4: self._get_pending_changesets(p4, userid))
 
-    def _get_file(self, path, revision):
+    def _get_depot_path(self, path, revision):
+        if revision == HEAD:
+            return path
+        else:
+            return '%s#%s' % (path, revision)
+
+    def _get_file(self, p4, path, revision):
         if revision == PRE_CREATION:
             return ''
-        elif revision == HEAD:
-            depot_path = path
-        else:
-            depot_path = '%s#%s' % (path, revision)
 
-        res = self.p4.run_print('-q', depot_path)
+        res = p4.run_print('-q', self._get_depot_path(path, revision))
         if res:
             return res[-1]
 
@@ -221,10 +530,53 @@ class PerforceClient(object):
         """
         Get the contents of a file, at a specific revision.
         """
-        return self._run_worker(lambda: self._get_file(path, revision))
+        return self._run_worker(lambda p4: self._get_file(p4, path, revision))
+
+    def _get_files(self, p4, files):
+        depot_paths = [
+            self._get_depot_path(path, revision)
+            for path, revision in files
+            if revision != PRE_CREATION
+        ]
+
+        contents = []
+
+        if depot_paths:
+            # Each file is returned as a dictionary of information on the
+            # file, followed by one or more strings of content.
+            for item in p4.run_print(*depot_paths):
+                if isinstance(item, dict):
+                    contents.append([])
+                elif contents:
+                    contents[-1].append(item)
+
+        if len(contents) != len(depot_paths):
+            # We couldn't match up the output with the files we asked for,
+            # so fall back on fetching them one at a time.
+            return [
+                self._get_file(p4, path, revision)
+                for path, revision in files
+            ]
+
+        contents.reverse()
+        results = []
+
+        for path, revision in files:
+            if revision == PRE_CREATION:
+                results.append('')
+            else:
+                results.append(''.join(contents.pop()))
+
+        return results
+
+    def get_files(self, files):
+        """
+        Get the contents of several files with a single 'p4 print'.
+        """
+        return self._run_worker(lambda p4: self._get_files(p4, files))
 
-    def _get_files_at_revision(self, revision_str):
-        return self.p4.run_files(revision_str)
+    def _get_files_at_revision(self, p4, revision_str):
+        return p4.run_files(revision_str)
 
     def get_files_at_revision(self, revision_str):
         """
@@ -232,7 +584,7 @@ class PerforceClient(object):
         to 'p4 files'
         """
         return self._run_worker(
-            lambda: self._get_files_at_revision(revision_str))
+            lambda p4: self._get_files_at_revision(p4, revision_str))
 
 
 class PerforceTool(SCMTool):
@@ -251,6 +603,13 @@ class PerforceTool(SCMTool):
         'modules': ['P4'],
     }
 
+    # How long parsed pending changesets are cached, in seconds.
+    CHANGESET_CACHE_PERIOD = 60
+
+    # Each request to Perforce uses its own connection from the pool, so
+    # files can be fetched from several threads at once.
+    get_files_max_threads = 4
+
     def __init__(self, repository):
         SCMTool.__init__(self, repository)
 
@@ -305,21 +664,94 @@ class PerforceTool(SCMTool):
         client.get_info()
 
     def get_pending_changesets(self, userid):
-        return self.client.get_pending_changesets(userid)
+        """Returns ChangeSets for all pending changes owned by a user.
+
+        Recently parsed changes are taken from the cache. The rest are
+        described in batches, rather than one server call per change.
+        """
+        changenums = self.client.get_pending_changeset_ids(userid)
+        changesets = self._get_cached_changesets(changenums)
+        missing = [
+            changenum
+            for changenum in changenums
+            if changenum not in changesets
+        ]
+
+        if missing:
+            descs = self.client.get_changesets(missing)
+            new_changesets = {}
+
+            for changenum in missing:
+                if changenum in descs:
+                    new_changesets[changenum] = self.parse_change_desc(
+                        descs[changenum], int(changenum), allow_empty=True)
+
+            self._cache_changesets(new_changesets)
+            changesets.update(new_changesets)
+
+        return [
+            changesets[changenum]
+            for changenum in changenums
+            if changesets.get(changenum)
+        ]
 
     def get_changeset(self, changesetid, allow_empty=False):
         changeset = self.client.get_changeset(changesetid)
         if changeset:
-            return self.parse_change_desc(changeset[0], changesetid, allow_empty)
+            changeset = self.parse_change_desc(changeset[0], changesetid,
+                                               allow_empty)
+
+            if changeset:
+                self._cache_changesets({
+                    str(changesetid): changeset,
+                })
+
+            return changeset
         else:
             return None
 
+    def _make_changeset_cache_key(self, changenum):
+        return make_cache_key('p4-changeset:%s:%s' % (self.repository.pk,
+                                                      changenum))
+
+    def _get_cached_changesets(self, changenums):
+        """Returns any parsed ChangeSets in the cache, by change number."""
+        if self.repository.pk is None:
+            return {}
+
+        keys = dict([
+            (self._make_changeset_cache_key(changenum), changenum)
+            for changenum in changenums
+        ])
+
+        return dict([
+            (keys[key], changeset)
+            for key, changeset in cache.get_many(keys.keys()).iteritems()
+        ])
+
+    def _cache_changesets(self, changesets):
+        """Caches parsed ChangeSets, keyed by change number.
+
+        Pending changes can be edited at any time, so these are only kept
+        for CHANGESET_CACHE_PERIOD seconds.
+        """
+        if self.repository.pk is not None and changesets:
+            cache.set_many(
+                dict([
+                    (self._make_changeset_cache_key(changenum), changeset)
+                    for changenum, changeset in changesets.iteritems()
+                ]),
+                self.CHANGESET_CACHE_PERIOD)
+
     def get_diffs_use_absolute_paths(self):
         return True
 
     def get_file(self, path, revision=HEAD):
         return self.client.get_file(path, revision)
 
+    def get_files(self, files):
+        return self.client.get_files(files)
+
     def parse_diff_revision(self, file_str, revision_str, *args, **kwargs):
         # Perforce has this lovely idiosyncracy that diffs show revision #1 both
         # for pre-creation and when there's an actual revision.
@@ -3,6 +3,10 @@ from django.dispatch import Signal
 
 checking_file_exists = Signal(providing_args=['path', 'revision', 'request'])
 checked_file_exists = Signal(providing_args=['path', 'revision', 'request'])
+check_file_exists_failed = Signal(providing_args=['path', 'revision',
+                                                  'request', 'error'])
 
 fetching_file = Signal(providing_args=['path', 'revision', 'request'])
 fetched_file = Signal(providing_args=['path', 'revision', 'request'])
+fetch_file_failed = Signal(providing_args=['path', 'revision', 'request',
+                                           'error'])
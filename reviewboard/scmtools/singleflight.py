@@ -0,0 +1,92 @@
+from __future__ import with_statement
+
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from djblets.util.misc import cache_memoize, make_cache_key
+
+
+# How long a lock may be held before it expires on its own. This protects
+# against a process dying while holding a lock.
+LOCK_TIMEOUT = 60
+
+# How long to wait for another process to finish computing a result before
+# giving up and computing it ourselves.
+WAIT_TIMEOUT = 30
+
+# How often to check whether the lock has been released, in seconds.
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 0.5
+
+
+@contextmanager
+def cache_lock(key, lock_timeout=LOCK_TIMEOUT, wait_timeout=WAIT_TIMEOUT):
+    """Serializes work on a cache key across processes.
+
+    This is used to prevent several processes from computing the same
+    expensive result at the same time. Only one process at a time can hold
+    the lock for a key. Others will wait until the lock is released, or
+    until a value has been stored in the cache for the key, whichever comes
+    first.
+
+    If the lock can't be acquired within wait_timeout seconds, the caller
+    proceeds anyway without it, so that a slow or stuck process can't hold
+    up everyone else for long.
+
+    The context manager yields whether the lock was acquired. Either way,
+    the caller should check the cache again before doing any work, since
+    another process may have just stored the result.
+    """
+    full_key = make_cache_key(key)
+    lock_key = make_cache_key('lock:%s' % key)
+    token = uuid.uuid4().hex
+    deadline = time.time() + wait_timeout
+    interval = POLL_INTERVAL
+
+    while True:
+        if cache.add(lock_key, token, lock_timeout):
+            acquired = True
+            break
+        elif cache.has_key(full_key):
+            acquired = False
+            break
+        elif time.time() >= deadline:
+            logging.warning('Timed out after %ss waiting on the cache lock '
+                            'for %s', wait_timeout, key)
+            acquired = False
+            break
+
+        time.sleep(interval)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    try:
+        yield acquired
+    finally:
+        # Only release the lock if it's still ours. If it expired while
+        # we were working, another process may now own it.
+        if acquired and cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+def cache_memoize_single_flight(key, lookup_callable,
+                                lock_timeout=LOCK_TIMEOUT,
+                                wait_timeout=WAIT_TIMEOUT,
+                                **kwargs):
+    """Memoizes the result of a callable, computing it only once at a time.
+
+    This works like cache_memoize, but if the result isn't in the cache,
+    only one process will call lookup_callable. Other processes asking for
+    the same key in the meantime will wait for that result and read it from
+    the cache. See cache_lock for how waiting works.
+
+    Any extra keyword arguments are passed to cache_memoize.
+    """
+    if (not kwargs.get('force_overwrite', False) and
+            cache.has_key(make_cache_key(key))):
+        return cache_memoize(key, lookup_callable, **kwargs)
+
+    with cache_lock(key, lock_timeout, wait_timeout):
+        return cache_memoize(key, lookup_callable, **kwargs)
@@ -16,7 +16,9 @@ except ImportError:
     pass
 
 from django.core.cache import cache
+from django.utils.http import urlquote
 from django.utils.translation import ugettext as _
+from djblets.util.misc import make_cache_key
 
 from reviewboard.diffviewer.parser import DiffParser
 from reviewboard.scmtools.certs import Certificate
@@ -81,6 +83,18 @@ class SVNTool(SCMTool):
         'URL':                 URL_KEYWORDS,
     }
 
+    # pysvn clients can't be shared between threads, so files are fetched
+    # one after another over the same client session.
+    get_files_max_threads = 1
+
+    # get_commits fetches 31 log entries, in order to find the parent of
+    # the 30th.
+    commits_page_size = 30
+
+    # How long the svn:keywords property of a file at a given revision is
+    # cached. The property can't change for a committed revision.
+    KEYWORDS_CACHE_PERIOD = 60 * 60 * 24 * 30  # 1 month
+
     def __init__(self, repository):
         self.repopath = repository.path
         if self.repopath[-1] == '/':
@@ -179,28 +193,86 @@ class SVNTool(SCMTool):
                 raise SCMError(e)
 
     def get_file(self, path, revision=HEAD):
-        def get_file_data(normpath, normrev):
-            data = self.client.cat(normpath, normrev)
+        return self.get_files([(path, revision)])[0]
+
+    def get_files(self, files):
+        """Returns the contents of several files.
+
+        The files are fetched one after another using this tool's client,
+        along with their svn:keywords properties. Keywords that were
+        fetched before for the same path and revision are taken from the
+        cache, saving a round trip to the server for each of those files.
+        """
+        cache_keys = [
+            self._make_keywords_cache_key(path, revision)
+            for path, revision in files
+        ]
+        cached_keywords = cache.get_many([key for key in cache_keys if key])
+        new_keywords = {}
+        results = []
+
+        for (path, revision), cache_key in zip(files, cache_keys):
+            def get_file_data(normpath, normrev):
+                data = self.client.cat(normpath, normrev)
+
+                if cache_key in cached_keywords:
+                    keywords = cached_keywords[cache_key]
+                else:
+                    keywords = self._fetch_keywords(normpath, normrev)
+
+                    if cache_key:
+                        new_keywords[cache_key] = keywords or ''
+
+                # If this file has any keyword expansion set, collapse these
+                # keywords. This is because SVN will return the file expanded
+                # to us, which would break patching.
+                if keywords:
+                    data = self.collapse_keywords(data, keywords)
 
-            # Find out if this file has any keyword expansion set.
-            # If it does, collapse these keywords. This is because SVN
-            # will return the file expanded to us, which would break patching.
-            keywords = self.client.propget("svn:keywords", normpath, normrev,
-                                           recurse=True)
-            if normpath in keywords:
-                data = self.collapse_keywords(data, keywords[normpath])
+                return data
 
-            return data
+            results.append(self._do_on_path(get_file_data, path, revision))
 
-        return self._do_on_path(get_file_data, path, revision)
+        if new_keywords:
+            cache.set_many(new_keywords, self.KEYWORDS_CACHE_PERIOD)
+
+        return results
 
     def get_keywords(self, path, revision=HEAD):
-        def get_file_keywords(normpath, normrev):
-            keywords = self.client.propget("svn:keywords", normpath, normrev,
-                                           recurse=True)
-            return keywords.get(normpath)
+        cache_key = self._make_keywords_cache_key(path, revision)
+
+        if cache_key:
+            keywords = cache.get(cache_key)
+
+            if keywords is not None:
+                return keywords or None
+
+        keywords = self._do_on_path(self._fetch_keywords, path, revision)
+
+        if cache_key:
+            cache.set(cache_key, keywords or '', self.KEYWORDS_CACHE_PERIOD)
+
+        return keywords
+
+    def _fetch_keywords(self, normpath, normrev):
+        """Returns the svn:keywords property of a file, or None."""
+        keywords = self.client.propget("svn:keywords", normpath, normrev,
+                                       recurse=True)
+        return keywords.get(normpath)
+
+    def _make_keywords_cache_key(self, path, revision):
+        """Makes a cache key for a file's svn:keywords property.
+
+        The keywords for HEAD can change at any time, and unsaved
+        repositories have no ID to key on, so neither of these are cached.
+        None is returned in those cases.
+        """
+        if (revision in (HEAD, PRE_CREATION) or
+                self.repository.pk is None):
+            return None
 
-        return self._do_on_path(get_file_keywords, path, revision)
+        return make_cache_key('svn-keywords:%s:%s:%s' % (
+            self.repository.pk, urlquote(path), urlquote(revision)))
 
     def get_branches(self):
         """Returns a list of branches.
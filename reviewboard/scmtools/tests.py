@@ -1,5 +1,12 @@
 # -*- coding: utf-8 -*-
 import os
+import shlex
+import shutil
+import sys
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
 from errno import ECONNREFUSED
 from hashlib import md5
 from socket import error as SocketError
@@ -10,6 +17,7 @@ from django.contrib.auth.models import AnonymousUser, User
 from django.core.cache import cache
 from django.test import TestCase as DjangoTestCase
 from djblets.util.filesystem import is_exe_in_path
+from djblets.util.misc import cache_memoize, make_cache_key
 import nose
 
 from reviewboard.diffviewer.diffutils import patch
@@ -20,19 +28,36 @@ from reviewboard.hostingsvcs.service import (HostingService,
                                              register_hosting_service,
                                              unregister_hosting_service)
 from reviewboard.reviews.models import Group
+from reviewboard.scmtools import bzr, clearcase, health, models
+from reviewboard.scmtools.clearcase import (ClearCaseTool,
+                                            ClearToolProcess,
+                                            ClearToolSession)
+from reviewboard.scmtools.coprocess import CoProcess, CoProcessPool
 from reviewboard.scmtools.core import (Branch, ChangeSet, Commit, Revision,
-                                       HEAD, PRE_CREATION)
+                                       SCMClient, SCMTool, HEAD,
+                                       PRE_CREATION, clear_popen_envs)
+from reviewboard.scmtools.filecache import DiskFileCache
 from reviewboard.scmtools.errors import (SCMError, FileNotFoundError,
                                          RepositoryNotFoundError,
+                                         RepositoryUnavailableError,
                                          AuthenticationError)
 from reviewboard.scmtools.forms import RepositoryForm
-from reviewboard.scmtools.git import ShortSHA1Error
+from reviewboard.scmtools.hg import HgWebClient
+from reviewboard.scmtools.httppool import get_connection_pool
+from reviewboard.scmtools.git import (GitCatFilePool, GitClient,
+                                      ShortSHA1Error, get_cat_file_pool)
+from reviewboard.scmtools.health import MIN_CALLS, get_repository_health
 from reviewboard.scmtools.models import Repository, Tool
-from reviewboard.scmtools.perforce import STunnelProxy, STUNNEL_SERVER
+from reviewboard.scmtools.perforce import (PerforceConnection,
+                                           PerforceConnectionPool,
+                                           STunnelProxy, STUNNEL_SERVER)
+from reviewboard.scmtools.singleflight import (cache_lock,
+                                               cache_memoize_single_flight)
 from reviewboard.scmtools.signals import (checked_file_exists,
                                           checking_file_exists,
                                           fetched_file, fetching_file)
 from reviewboard.site.models import LocalSite
+from reviewboard.ssh import utils as sshutils
 from reviewboard.ssh.client import SSHClient
 from reviewboard.ssh.tests import SSHTestCase
 from reviewboard.testing import online_only
@@ -148,6 +173,516 @@ class CoreTests(DjangoTestCase):
         self.assertTrue(len(cs.bugs_closed) == 0)
         self.assertTrue(len(cs.files) == 0)
 
+    def test_get_files(self):
+        """Testing SCMTool.get_files fetches files concurrently"""
+        class DummyTool(SCMTool):
+            def get_file(self, path, revision):
+                if path == 'missing':
+                    raise FileNotFoundError(path, revision)
+
+                return '%s@%s' % (path, revision)
+
+        tool = DummyTool(None)
+        files = [('file%d' % i, str(i)) for i in range(10)]
+
+        self.assertEqual(tool.get_files(files),
+                         ['file%d@%d' % (i, i) for i in range(10)])
+        self.assertRaises(FileNotFoundError,
+                          lambda: tool.get_files(files + [('missing', '1')]))
+
+    def test_popen_env_reused(self):
+        """Testing SCMTool.popen reuses environments until they're cleared"""
+        env = SCMTool._get_popen_env('local-site-1')
+        self.assertEqual(env['RB_LOCAL_SITE'], 'local-site-1')
+        self.assertEqual(env['PYTHONPATH'], ':'.join(sys.path))
+        self.assertTrue(SCMTool._get_popen_env('local-site-1') is env)
+        self.assertFalse('RB_LOCAL_SITE' in SCMTool._get_popen_env(None))
+
+        os.environ['RB_TEST_POPEN_ENV'] = '1'
+        clear_popen_envs()
+
+        try:
+            new_env = SCMTool._get_popen_env('local-site-1')
+            self.assertFalse(new_env is env)
+            self.assertEqual(new_env['RB_TEST_POPEN_ENV'], '1')
+
+            p = SCMTool.popen(['sh', '-c', 'echo $RB_TEST_POPEN_ENV'])
+            self.assertEqual(p.communicate()[0], '1\n')
+        finally:
+            del os.environ['RB_TEST_POPEN_ENV']
+            clear_popen_envs()
+
+    def test_register_rbssh_clears_popen_envs(self):
+        """Testing sshutils.register_rbssh clears SCMTool.popen environments
+        """
+        SCMTool._get_popen_env(None)
+        sshutils.register_rbssh('RB_TEST_SSH')
+
+        try:
+            self.assertEqual(SCMTool._get_popen_env(None)['RB_TEST_SSH'],
+                             'rbssh')
+        finally:
+            del os.environ['RB_TEST_SSH']
+            clear_popen_envs()
+
+
+class DiskFileCacheTests(DjangoTestCase):
+    """Unit tests for DiskFileCache."""
+    def setUp(self):
+        self.cache_dir = mkdtemp(prefix='rb-tests-')
+        self.file_cache = DiskFileCache(self.cache_dir, 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_get_and_set(self):
+        """Testing DiskFileCache.get and set"""
+        self.assertEqual(self.file_cache.get('key1'), None)
+        self.assertFalse(self.file_cache.has_key('key1'))
+
+        self.file_cache.set('key1', 'file data')
+        self.file_cache.set('key2', '')
+
+        self.assertEqual(self.file_cache.get('key1'), 'file data')
+        self.assertEqual(self.file_cache.get('key2'), '')
+        self.assertTrue(self.file_cache.has_key('key1'))
+
+    def test_set_shares_content(self):
+        """Testing DiskFileCache.set stores identical content once"""
+        self.file_cache.set('key1', 'file data')
+        self.file_cache.set('key2', 'file data')
+
+        self.assertEqual(self.file_cache.get('key2'), 'file data')
+        self.assertEqual(
+            len(os.listdir(os.path.join(self.cache_dir, 'blobs'))), 1)
+
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                self.assertFalse(filename.startswith('.tmp-'))
+
+    def test_eviction(self):
+        """Testing DiskFileCache evicts least recently used files"""
+        self.file_cache.set('key1', 'a' * 400)
+        self.file_cache._size_thread.join()
+        self.file_cache.set('key2', 'b' * 400)
+
+        # Make sure key1 is the most recently used.
+        for i, key in enumerate(('key2', 'key1')):
+            ref_path = self.file_cache._get_ref_path(key)
+            blob_path = self.file_cache._get_blob_path(
+                open(ref_path, 'r').read())
+            os.utime(ref_path, (i, i))
+            os.utime(blob_path, (i, i))
+
+        self.file_cache.set('key3', 'c' * 400)
+
+        self.assertEqual(self.file_cache.get('key1'), 'a' * 400)
+        self.assertEqual(self.file_cache.get('key2'), None)
+        self.assertEqual(self.file_cache.get('key3'), 'c' * 400)
+
+    def test_set_too_large(self):
+        """Testing DiskFileCache.set with data larger than the cache"""
+        self.file_cache.set('key1', 'a' * 2000)
+        self.assertEqual(self.file_cache.get('key1'), None)
+
+    def test_set_unicode(self):
+        """Testing DiskFileCache.set with unicode data"""
+        self.file_cache.set(u'key1\u2022', u'file data \u2022')
+        self.assertEqual(self.file_cache.get(u'key1\u2022'),
+                         'file data \xe2\x80\xa2')
+
+    def test_size_computed_in_background(self):
+        """Testing DiskFileCache works out its size in the background"""
+        other_cache = DiskFileCache(self.cache_dir, 1000)
+        other_cache.set('key1', 'a' * 400)
+        other_cache._size_thread.join()
+
+        self.file_cache.set('key2', 'b' * 400)
+        self.assertNotEqual(self.file_cache._size_thread, None)
+        self.file_cache._size_thread.join()
+
+        # Both files, and their refs, are counted.
+        self.assertEqual(self.file_cache._size, 2 * (400 + 40))
+
+
+class SingleFlightTests(DjangoTestCase):
+    """Unit tests for single-flight cache lookups."""
+    def setUp(self):
+        cache.clear()
+
+    def test_cache_memoize(self):
+        """Testing cache_memoize_single_flight"""
+        self.assertEqual(cache_memoize_single_flight('key', lambda: 'value'),
+                         'value')
+        self.assertEqual(cache_memoize_single_flight('key', lambda: 'other'),
+                         'value')
+
+    def test_cache_memoize_waits_for_other_process(self):
+        """Testing cache_memoize_single_flight waits for another process"""
+        def lookup():
+            self.fail('lookup_callable should not have been called')
+
+        def finish_other_process():
+            cache.set(make_cache_key('key'), 'value')
+            cache.delete(make_cache_key('lock:key'))
+
+        # Pretend another process is computing the value.
+        cache.add(make_cache_key('lock:key'), 'other-process')
+        timer = threading.Timer(0.1, finish_other_process)
+        timer.start()
+
+        try:
+            self.assertEqual(
+                cache_memoize_single_flight('key', lookup, wait_timeout=5),
+                'value')
+        finally:
+            timer.join()
+
+    def test_cache_lock_timeout(self):
+        """Testing cache_lock with a lock that is never released"""
+        with cache_lock('key') as acquired:
+            self.assertTrue(acquired)
+
+            with cache_lock('key', wait_timeout=0.1) as acquired:
+                self.assertFalse(acquired)
+
+            self.assertEqual(
+                cache_memoize_single_flight('key', lambda: 'value',
+                                            wait_timeout=0.1),
+                'value')
+
+        # The lock should have been released.
+        with cache_lock('key', wait_timeout=0) as acquired:
+            self.assertTrue(acquired)
+
+    def test_cache_lock_with_cached_value(self):
+        """Testing cache_lock stops waiting once the value is cached"""
+        def store_value():
+            cache.set(make_cache_key('key'), 'value')
+
+        with cache_lock('key'):
+            timer = threading.Timer(0.1, store_value)
+            timer.start()
+
+            with cache_lock('key', wait_timeout=5) as acquired:
+                self.assertFalse(acquired)
+                self.assertEqual(cache.get(make_cache_key('key')), 'value')
+
+            timer.join()
+
+
+class HTTPTestRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.num_connections += 1
+
+    def do_GET(self):
+        self.server.requests.append((self.command, self.path))
+
+        if self.path in self.server.files:
+            data = self.server.files[self.path]
+
+            if self.server.supports_range and 'Range' in self.headers:
+                self._respond(206, data[:1])
+            else:
+                self._respond(200, data)
+        elif self.path == '/redirect':
+            self._respond(302, '', {'Location': '/file'})
+        else:
+            self._respond(404, 'Not found')
+
+    def do_HEAD(self):
+        self.server.requests.append((self.command, self.path))
+
+        if not self.server.supports_head:
+            self._respond(501, '')
+        elif self.path in self.server.files:
+            self._respond(200, self.server.files[self.path], send_body=False)
+        else:
+            self._respond(404, 'Not found', send_body=False)
+
+    def _respond(self, status, body, headers={}, send_body=True):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+
+        for key, value in headers.iteritems():
+            self.send_header(key, value)
+
+        self.end_headers()
+
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class HTTPConnectionPoolTests(DjangoTestCase):
+    """Unit tests for fetching files over pooled HTTP connections."""
+    def setUp(self):
+        cache.clear()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                          HTTPTestRequestHandler)
+        self.server.num_connections = 0
+        self.server.requests = []
+        self.server.supports_head = True
+        self.server.supports_range = True
+        self.server.files = {
+            '/file': 'file data',
+            '/repo/raw/tip/README': 'readme data',
+        }
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        # Close the client's side of any kept-alive connections first, so
+        # that the server isn't left waiting on them.
+        get_connection_pool('http', '127.0.0.1',
+                            self.server.server_port).close_idle()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_file_http(self):
+        """Testing SCMClient.get_file_http reuses connections"""
+        client = SCMClient(self.url)
+
+        self.assertEqual(client.get_file_http(self.url + '/file', 'file', '1'),
+                         'file data')
+        self.assertEqual(client.get_file_http(self.url + '/file', 'file', '1'),
+                         'file data')
+        self.assertEqual(self.server.num_connections, 1)
+
+    def test_get_file_http_not_found(self):
+        """Testing SCMClient.get_file_http with a missing file"""
+        client = SCMClient(self.url)
+
+        self.assertRaises(
+            FileNotFoundError,
+            lambda: client.get_file_http(self.url + '/missing', 'missing',
+                                         '1'))
+
+    def test_get_file_http_redirect(self):
+        """Testing SCMClient.get_file_http follows redirects"""
+        client = SCMClient(self.url)
+
+        self.assertEqual(
+            client.get_file_http(self.url + '/redirect', 'file', '1'),
+            'file data')
+
+    def test_check_file_exists_http(self):
+        """Testing SCMClient.check_file_exists_http uses HEAD requests"""
+        client = SCMClient(self.url)
+
+        self.assertEqual(
+            client.check_file_exists_http(self.url + '/file', 'file', '1'),
+            (True, None))
+        self.assertEqual(
+            client.check_file_exists_http(self.url + '/missing', 'missing',
+                                          '1'),
+            (False, None))
+        self.assertEqual(self.server.requests, [
+            ('HEAD', '/file'),
+            ('HEAD', '/missing'),
+        ])
+
+    def test_check_file_exists_http_without_head(self):
+        """Testing SCMClient.check_file_exists_http without HEAD support"""
+        self.server.supports_head = False
+        client = SCMClient(self.url)
+
+        self.assertEqual(
+            client.check_file_exists_http(self.url + '/file', 'file', '1'),
+            (True, None))
+        self.assertEqual(self.server.requests, [
+            ('HEAD', '/file'),
+            ('GET', '/file'),
+        ])
+
+        # Servers that ignore the Range header send the whole file.
+        self.server.supports_range = False
+
+        self.assertEqual(
+            client.check_file_exists_http(self.url + '/file', 'file', '1'),
+            (True, 'file data'))
+
+    def test_git_raw_file_url_file_exists(self):
+        """Testing GitClient.get_file_exists with a raw file URL"""
+        sha1 = 'a' * 40
+        self.server.files['/%s/readme' % sha1] = 'readme data'
+        client = GitClient(self.url, self.url + '/<revision>/<filename>')
+
+        self.assertTrue(client.get_file_exists('readme', sha1))
+        self.assertFalse(client.get_file_exists('missing', sha1))
+        self.assertEqual(self.server.requests, [
+            ('HEAD', '/%s/readme' % sha1),
+            ('HEAD', '/%s/missing' % sha1),
+        ])
+
+    def test_hgweb_raw_path(self):
+        """Testing HgWebClient remembers which URL layout works"""
+        client = HgWebClient(self.url + '/repo', None, None)
+
+        self.assertEqual(client.cat_file('README', HEAD), 'readme data')
+        self.assertEqual(self.server.requests, [
+            ('GET', '/repo/raw-file/tip/README'),
+            ('GET', '/repo/raw/tip/README'),
+        ])
+
+        self.server.requests = []
+        self.assertEqual(client.cat_file('README', HEAD), 'readme data')
+        self.assertRaises(FileNotFoundError,
+                          lambda: client.cat_file('missing', HEAD))
+        self.assertEqual(self.server.requests, [
+            ('GET', '/repo/raw/tip/README'),
+            ('GET', '/repo/raw/tip/missing'),
+        ])
+
+
+class RepositoryHealthTests(DjangoTestCase):
+    """Unit tests for tracking repository health."""
+    fixtures = ['test_users', 'test_scmtools']
+
+    def setUp(self):
+        cache.clear()
+
+        self.repository = Repository.objects.create(
+            name='Git test repo',
+            path=os.path.join(os.path.dirname(__file__), 'testdata',
+                              'git_repo'),
+            tool=Tool.objects.get(name='Git'))
+        self.scmtool_cls = self.repository.get_scmtool().__class__
+        self.old_get_file = self.scmtool_cls.get_file
+        self.old_get_files = self.scmtool_cls.get_files
+
+    def tearDown(self):
+        cache.clear()
+
+        self.scmtool_cls.get_file = self.old_get_file
+        self.scmtool_cls.get_files = self.old_get_files
+
+    def test_records_calls(self):
+        """Testing repository health records calls and errors"""
+        def get_file(self, path, revision):
+            if path == 'broken':
+                raise SCMError('Connection failed')
+            elif path == 'missing':
+                raise FileNotFoundError(path, revision)
+
+            return 'data'
+
+        self.scmtool_cls.get_file = get_file
+
+        self.repository.get_file('readme', '1')
+
+        for path in ('broken', 'missing'):
+            self.assertRaises(SCMError,
+                              lambda: self.repository.get_file(path, '1'))
+
+        health = get_repository_health(self.repository)
+        self.assertEqual(health['calls'], 3)
+        self.assertEqual(health['errors'], 1)
+        self.assertEqual(health['slow'], 0)
+        self.assertEqual(health['median_latency'], 0.1)
+        self.assertFalse(health['circuit_open'])
+
+    def test_circuit_breaker(self):
+        """Testing repository circuit breaker fails fast after errors"""
+        def get_file(self, path, revision):
+            num_calls['get_file'] += 1
+            raise SCMError('Connection failed')
+
+        num_calls = {
+            'get_file': 0,
+        }
+
+        self.scmtool_cls.get_file = get_file
+
+        for i in xrange(MIN_CALLS):
+            self.assertRaises(
+                SCMError,
+                lambda: self.repository.get_file('readme', str(i)))
+
+        self.assertEqual(num_calls['get_file'], MIN_CALLS)
+        self.assertTrue(get_repository_health(self.repository)
+                        ['circuit_open'])
+
+        self.assertRaises(
+            RepositoryUnavailableError,
+            lambda: self.repository.get_file('readme', 'abc'))
+        self.assertRaises(
+            RepositoryUnavailableError,
+            lambda: self.repository.get_file_exists('readme', 'abc'))
+        self.assertEqual(num_calls['get_file'], MIN_CALLS)
+
+    def test_get_files_recorded_once(self):
+        """Testing repository health records fetching several files at once
+        as a single call
+        """
+        def get_files(self, files):
+            if files[0][0] == 'broken':
+                raise SCMError('Connection failed')
+
+            return ['data'] * len(files)
+
+        self.scmtool_cls.get_files = get_files
+        old_slow_call_time = health.SLOW_CALL_TIME
+        health.SLOW_CALL_TIME = 0
+
+        try:
+            self.repository.get_files([
+                ('readme', str(i))
+                for i in xrange(MIN_CALLS)
+            ])
+
+            self.assertRaises(SCMError, lambda: self.repository.get_files([
+                ('broken', str(i))
+                for i in xrange(MIN_CALLS)
+            ]))
+        finally:
+            health.SLOW_CALL_TIME = old_slow_call_time
+
+        health_info = get_repository_health(self.repository)
+        self.assertEqual(health_info['calls'], 2)
+        self.assertEqual(health_info['errors'], 1)
+        self.assertEqual(health_info['slow'], 2)
+        self.assertFalse(health_info['circuit_open'])
+
+    def test_untracked_calls(self):
+        """Testing repository health doesn't record untracked calls"""
+        def get_file(self, path, revision):
+            raise SCMError('Connection failed')
+
+        self.scmtool_cls.get_file = get_file
+
+        with health.untracked_calls():
+            for i in xrange(MIN_CALLS):
+                self.assertRaises(
+                    SCMError,
+                    lambda: self.repository.get_file('readme', str(i)))
+
+        health_info = get_repository_health(self.repository)
+        self.assertEqual(health_info['calls'], 0)
+        self.assertFalse(health_info['circuit_open'])
+
+    def test_admin_view(self):
+        """Testing the repository health admin view"""
+        self.client.login(username='admin', password='admin')
+        response = self.client.get('/admin/scm-health/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['repositories'][0][0],
+                         self.repository)
+
 
 class RepositoryTests(DjangoTestCase):
     fixtures = ['test_scmtools']
@@ -161,13 +696,269 @@ class RepositoryTests(DjangoTestCase):
 
         self.scmtool_cls = self.repository.get_scmtool().__class__
         self.old_get_file = self.scmtool_cls.get_file
+        self.old_get_files = self.scmtool_cls.get_files
         self.old_file_exists = self.scmtool_cls.file_exists
+        self.old_check_file_exists = self.scmtool_cls.check_file_exists
 
     def tearDown(self):
         cache.clear()
 
         self.scmtool_cls.get_file = self.old_get_file
+        self.scmtool_cls.get_files = self.old_get_files
         self.scmtool_cls.file_exists = self.old_file_exists
+        self.scmtool_cls.check_file_exists = self.old_check_file_exists
+
+    def test_get_scmtool_reuses_instances(self):
+        """Testing Repository.get_scmtool reuses SCMTool instances"""
+        self.repository.save()
+        tool = self.repository.get_scmtool()
+
+        self.assertTrue(self.repository.get_scmtool() is tool)
+
+        # The instance is given the repository it's being used for.
+        repository = Repository.objects.get(pk=self.repository.pk)
+        self.assertTrue(repository.get_scmtool() is tool)
+        self.assertTrue(tool.repository is repository)
+
+    def test_get_scmtool_limits_instances(self):
+        """Testing Repository.get_scmtool limits the instances kept"""
+        self.repository.save()
+        tool = self.repository.get_scmtool()
+        old_max_cached_scmtools = models.MAX_CACHED_SCMTOOLS
+        models.MAX_CACHED_SCMTOOLS = 1
+
+        try:
+            repository = Repository.objects.create(
+                name='Other repo',
+                path=self.local_repo_path,
+                tool=self.repository.tool)
+            other_tool = repository.get_scmtool()
+
+            self.assertTrue(repository.get_scmtool() is other_tool)
+            self.assertFalse(self.repository.get_scmtool() is tool)
+        finally:
+            models.MAX_CACHED_SCMTOOLS = old_max_cached_scmtools
+
+    def test_get_scmtool_after_config_change(self):
+        """Testing Repository.get_scmtool after the configuration changes"""
+        self.repository.save()
+        tool = self.repository.get_scmtool()
+
+        # Simulate a change made in another process.
+        repository = Repository.objects.get(pk=self.repository.pk)
+        repository.username = 'newuser'
+        new_tool = repository.get_scmtool()
+
+        self.assertFalse(new_tool is tool)
+        self.assertTrue(new_tool.repository is repository)
+
+    def test_get_scmtool_after_save(self):
+        """Testing Repository.get_scmtool after the repository is saved"""
+        self.repository.save()
+        tool = self.repository.get_scmtool()
+        self.repository.save()
+
+        self.assertFalse(self.repository.get_scmtool() is tool)
+
+    def test_get_commits_uses_index(self):
+        """Testing Repository.get_commits uses the commit index"""
+        def get_commits(self, start):
+            num_calls['get_commits'] += 1
+
+            return [
+                Commit('user%d' % i, str(i), '2013-01-01T%02d:00:00' % i,
+                       'Commit %d' % i, str(i - 1) if i > 1 else '')
+                for i in xrange(int(start), max(int(start) - 30, 0), -1)
+            ]
+
+        num_calls = {
+            'get_commits': 0,
+        }
+
+        repository = Repository.objects.create(
+            name='Test repo',
+            path=self.local_repo_path,
+            tool=Tool.objects.get(name='Test'))
+        scmtool_cls = repository.tool.get_scmtool_class()
+        old_get_commits = scmtool_cls.get_commits
+        scmtool_cls.get_commits = get_commits
+
+        try:
+            commits = repository.get_commits('40')
+            self.assertEqual(len(commits), 30)
+            repository.get_commits('10')
+            self.assertEqual(num_calls['get_commits'], 2)
+
+            # Both pages, and the ones in between, can now be listed from
+            # the index.
+            cache.clear()
+            self.assertEqual(repository.get_commits('40'), commits)
+
+            commits = repository.get_commits('25')
+            self.assertEqual(len(commits), 25)
+            self.assertEqual(commits[0].id, '25')
+            self.assertEqual(commits[-1].id, '1')
+            self.assertEqual(num_calls['get_commits'], 2)
+
+            # Newer commits aren't in the index yet.
+            repository.get_commits('45')
+            self.assertEqual(num_calls['get_commits'], 3)
+        finally:
+            scmtool_cls.get_commits = old_get_commits
+
+    def test_get_commits_index_with_different_orders(self):
+        """Testing Repository.get_commits with commits listed in different
+        orders depending on the start
+        """
+        def get_commits(self, start):
+            num_calls['get_commits'] += 1
+            ids = range(int(start), int(start) - 30, -1)
+
+            if start == '41':
+                # A merge lists commit 39 before commit 40.
+                ids[1:3] = [39, 40]
+
+            return [
+                Commit('user%d' % i, str(i), '2013-01-01T%02d:00:00' % i,
+                       'Commit %d' % i, str(i - 1))
+                for i in ids
+            ]
+
+        num_calls = {
+            'get_commits': 0,
+        }
+
+        repository = Repository.objects.create(
+            name='Test repo',
+            path=self.local_repo_path,
+            tool=Tool.objects.get(name='Test'))
+        scmtool_cls = repository.tool.get_scmtool_class()
+        old_get_commits = scmtool_cls.get_commits
+        scmtool_cls.get_commits = get_commits
+
+        try:
+            repository.get_commits('40')
+            repository.get_commits('41')
+            self.assertEqual(num_calls['get_commits'], 2)
+
+            # Commits 40 and 39 are no longer listed from the index.
+            cache.clear()
+            commits = repository.get_commits('40')
+            self.assertEqual(num_calls['get_commits'], 3)
+            self.assertEqual(commits[1].id, '39')
+        finally:
+            scmtool_cls.get_commits = old_get_commits
+
+    def test_get_commits_without_page_size(self):
+        """Testing Repository.get_commits doesn't use the commit index
+        without a page size
+        """
+        repository = Repository.objects.create(
+            name='Test repo',
+            path=self.local_repo_path,
+            tool=Tool.objects.get(name='Test'))
+        scmtool_cls = repository.tool.get_scmtool_class()
+        old_page_size = scmtool_cls.commits_page_size
+        scmtool_cls.commits_page_size = None
+
+        try:
+            self.assertEqual(len(repository.get_commits('5')), 5)
+            self.assertEqual(repository.indexed_commits.count(), 0)
+        finally:
+            scmtool_cls.commits_page_size = old_page_size
+
+    def test_notify_pushed(self):
+        """Testing Repository.notify_pushed clears cached branches and commits"""
+        def get_branches(self):
+            num_calls['get_branches'] += 1
+
+            return []
+
+        def get_commits(self, start):
+            num_calls['get_commits'] += 1
+
+            return []
+
+        num_calls = {
+            'get_branches': 0,
+            'get_commits': 0,
+        }
+
+        repository = Repository.objects.create(
+            name='Test repo',
+            path=self.local_repo_path,
+            tool=Tool.objects.get(name='Test'))
+        scmtool_cls = repository.tool.get_scmtool_class()
+        old_get_branches = scmtool_cls.get_branches
+        old_get_commits = scmtool_cls.get_commits
+        scmtool_cls.get_branches = get_branches
+        scmtool_cls.get_commits = get_commits
+
+        try:
+            repository.get_branches()
+            repository.get_commits()
+            repository.get_branches()
+            repository.get_commits()
+            self.assertEqual(num_calls['get_branches'], 1)
+            self.assertEqual(num_calls['get_commits'], 1)
+
+            repository.notify_pushed()
+
+            repository.get_branches()
+            repository.get_commits()
+            self.assertEqual(num_calls['get_branches'], 2)
+            self.assertEqual(num_calls['get_commits'], 2)
+
+            # If the time of the push is lost, the results cached before
+            # the push aren't used again.
+            cache.delete(repository._make_last_push_cache_key())
+            self.assertEqual(repository._get_last_push_time(), None)
+
+            repository.get_branches()
+            repository.get_commits()
+            self.assertEqual(num_calls['get_branches'], 3)
+            self.assertEqual(num_calls['get_commits'], 3)
+        finally:
+            scmtool_cls.get_branches = old_get_branches
+            scmtool_cls.get_commits = old_get_commits
+
+    def test_get_branches_expiration(self):
+        """Testing Repository.get_branches expiration after pushes"""
+        def cache_memoize(key, lookup_callable, expiration):
+            expirations.append(expiration)
+
+            return []
+
+        expirations = []
+        period = Repository.PUSH_NOTIFIED_CACHE_PERIOD
+        repository = Repository.objects.create(
+            name='Test repo',
+            path=self.local_repo_path,
+            tool=Tool.objects.get(name='Test'))
+        old_cache_memoize = models.cache_memoize
+        models.cache_memoize = cache_memoize
+
+        try:
+            repository.get_branches()
+
+            repository.notify_pushed()
+            repository.get_branches()
+
+            # The branches expire when the push is no longer remembered.
+            repository._get_last_push_time = \
+                lambda: time.time() - period + 60
+            repository.get_branches()
+
+            repository._get_last_push_time = lambda: time.time() - period
+            repository.get_branches()
+        finally:
+            models.cache_memoize = old_cache_memoize
+
+        self.assertEqual(len(expirations), 4)
+        self.assertEqual(expirations[0], Repository.BRANCHES_CACHE_PERIOD)
+        self.assertTrue(period - 60 < expirations[1] <= period)
+        self.assertTrue(0 < expirations[2] <= 60)
+        self.assertEqual(expirations[3], Repository.BRANCHES_CACHE_PERIOD)
 
     def test_get_file_caching(self):
         """Testing Repository.get_file caches result"""
@@ -217,6 +1008,137 @@ class RepositoryTests(DjangoTestCase):
         self.assertEqual(found_signals[1],
                          ('fetched_file', path, revision, request))
 
+    def test_get_files(self):
+        """Testing Repository.get_files"""
+        self.assertEqual(
+            self.repository.get_files([('readme', 'e965047'),
+                                       ('readme', 'd6613f5')]),
+            ['Hello\n', 'Hello there\n'])
+
+    def test_get_files_caching(self):
+        """Testing Repository.get_files only fetches uncached files"""
+        def get_files(self, files):
+            fetched_files.append(files)
+            return ['data for %s' % revision for path, revision in files]
+
+        fetched_files = []
+        self.scmtool_cls.get_files = get_files
+
+        self.assertEqual(self.repository.get_file('readme', 'e965047'),
+                         'Hello\n')
+
+        files = [('readme', 'e965047'), ('readme', 'd6613f5')]
+        self.assertEqual(self.repository.get_files(files),
+                         ['Hello\n', 'data for d6613f5'])
+        self.assertEqual(fetched_files, [[('readme', 'd6613f5')]])
+
+        self.assertEqual(self.repository.get_files(files),
+                         ['Hello\n', 'data for d6613f5'])
+        self.assertEqual(len(fetched_files), 1)
+
+        self.assertEqual(self.repository.get_file('readme', 'd6613f5'),
+                         'data for d6613f5')
+
+    def test_get_cached_files(self):
+        """Testing Repository._get_cached_files reads the files stored by
+        _store_cached_file
+        """
+        small_data = 'Hello\n'
+        large_data = os.urandom(2 * 1024 * 1024)
+
+        self.repository._store_cached_file('small-key', small_data)
+        self.repository._store_cached_file('large-key', large_data)
+        self.repository._store_cached_file('empty-key', '')
+
+        # Data stored in any other format is treated as missing.
+        cache_memoize('old-key', lambda: [small_data], large_data=True)
+
+        cached = self.repository._get_cached_files([
+            'small-key',
+            'large-key',
+            'empty-key',
+            'old-key',
+            'missing-key',
+        ])
+
+        self.assertEqual(cached, {
+            'small-key': small_data,
+            'large-key': large_data,
+            'empty-key': '',
+        })
+
+        # Files missing any of their chunks are treated as missing.
+        cache.delete('%s-1' % make_cache_key('large-key'))
+        self.assertEqual(self.repository._get_cached_files(['large-key']),
+                         {})
+
+    def test_get_file_waits_for_other_process(self):
+        """Testing Repository.get_file waits for another process fetching
+        the same file
+        """
+        def get_file(self, path, revision):
+            num_calls['get_file'] += 1
+            return 'file data'
+
+        def finish_other_process():
+            self.repository._store_cached_file(key, 'file data')
+            cache.delete(make_cache_key('lock:%s' % key))
+
+        num_calls = {
+            'get_file': 0,
+        }
+
+        self.scmtool_cls.get_file = get_file
+
+        # Pretend another process is fetching the file.
+        key = self.repository._make_file_cache_key('readme', 'e965047', None)
+        cache.add(make_cache_key('lock:%s' % key), 'other-process')
+        timer = threading.Timer(0.1, finish_other_process)
+        timer.start()
+
+        try:
+            self.assertEqual(self.repository.get_file('readme', 'e965047'),
+                             'file data')
+        finally:
+            timer.join()
+
+        self.assertEqual(num_calls['get_file'], 0)
+
+    def test_get_file_with_disk_cache(self):
+        """Testing Repository.get_file with the on-disk file cache"""
+        def get_file(self, path, revision):
+            num_calls['get_file'] += 1
+            return 'file data'
+
+        num_calls = {
+            'get_file': 0,
+        }
+
+        self.scmtool_cls.get_file = get_file
+        cache_dir = mkdtemp(prefix='rb-tests-')
+
+        try:
+            with self.settings(REPOSITORY_FILE_CACHE_DIR=cache_dir):
+                self.assertEqual(
+                    self.repository.get_file('readme', 'e965047'),
+                    'file data')
+
+                # Simulate the file being evicted from memcached.
+                cache.clear()
+
+                self.assertEqual(
+                    self.repository.get_file('readme', 'e965047'),
+                    'file data')
+                self.assertEqual(
+                    self.repository.get_files([('readme', 'e965047')]),
+                    ['file data'])
+                self.assertTrue(
+                    self.repository.get_file_exists('readme', 'e965047'))
+        finally:
+            shutil.rmtree(cache_dir)
+
+        self.assertEqual(num_calls['get_file'], 1)
+
     def test_get_file_exists_caching_when_exists(self):
         """Testing Repository.get_file_exists caches result when exists"""
         def file_exists(self, path, revision):
@@ -243,7 +1165,9 @@ class RepositoryTests(DjangoTestCase):
         self.assertEqual(num_calls['get_file_exists'], 1)
 
     def test_get_file_exists_caching_when_not_exists(self):
-        """Testing Repository.get_file_exists doesn't cache result when not exists"""
+        """Testing Repository.get_file_exists caches result briefly when
+        not exists
+        """
         def file_exists(self, path, revision):
             num_calls['get_file_exists'] += 1
             return False
@@ -265,8 +1189,49 @@ class RepositoryTests(DjangoTestCase):
 
         self.assertFalse(exists1)
         self.assertFalse(exists2)
+        self.assertEqual(num_calls['get_file_exists'], 1)
+
+        # Once the result expires, the repository is checked again.
+        cache.delete(make_cache_key(
+            self.repository._make_file_exists_cache_key(path, revision,
+                                                        None)))
+        self.assertFalse(self.repository.get_file_exists(path, revision,
+                                                         request=request))
         self.assertEqual(num_calls['get_file_exists'], 2)
 
+    def test_get_file_exists_waits_for_other_process(self):
+        """Testing Repository.get_file_exists uses the result of another
+        process checking the same missing file
+        """
+        def file_exists(self, path, revision):
+            num_calls['get_file_exists'] += 1
+            return False
+
+        def finish_other_process():
+            cache.set(make_cache_key(key), '0')
+            cache.delete(make_cache_key('lock:%s' % key))
+
+        num_calls = {
+            'get_file_exists': 0,
+        }
+
+        self.scmtool_cls.file_exists = file_exists
+
+        # Pretend another process is checking for the file.
+        key = self.repository._make_file_exists_cache_key('readme', '12345',
+                                                          None)
+        cache.add(make_cache_key('lock:%s' % key), 'other-process')
+        timer = threading.Timer(0.1, finish_other_process)
+        timer.start()
+
+        try:
+            self.assertFalse(self.repository.get_file_exists('readme',
+                                                             '12345'))
+        finally:
+            timer.join()
+
+        self.assertEqual(num_calls['get_file_exists'], 0)
+
     def test_get_file_exists_caching_with_fetched_file(self):
         """Testing Repository.get_file_exists uses get_file's cached result"""
         def get_file(self, path, revision):
@@ -300,6 +1265,135 @@ class RepositoryTests(DjangoTestCase):
         self.assertEqual(num_calls['get_file'], 1)
         self.assertEqual(num_calls['get_file_exists'], 0)
 
+    def test_get_file_exists_caches_downloaded_file(self):
+        """Testing Repository.get_file_exists caches files downloaded to check for them"""
+        def get_file(self, path, revision):
+            num_calls['get_file'] += 1
+            return 'file data'
+
+        def check_file_exists(self, path, revision):
+            return True, 'file data'
+
+        num_calls = {
+            'get_file': 0,
+        }
+
+        path = 'readme'
+        revision = 'e965047'
+
+        self.scmtool_cls.get_file = get_file
+        self.scmtool_cls.check_file_exists = check_file_exists
+
+        self.assertTrue(self.repository.get_file_exists(path, revision))
+        self.assertEqual(self.repository.get_file(path, revision),
+                         'file data')
+        self.assertEqual(num_calls['get_file'], 0)
+
+    def test_get_file_from_mirror(self):
+        """Testing Repository.get_file reads from a remote repository's mirror"""
+        def get_file(self, path, revision):
+            raise SCMError('Fetched from the repository')
+
+        mirror_dir = mkdtemp()
+
+        try:
+            with self.settings(GIT_MIRROR_DIR=mirror_dir):
+                tool = self._create_mirror()
+
+                self.assertTrue(os.path.isdir(
+                    os.path.join(mirror_dir, '%s.git' % self.repository.pk)))
+
+                self.scmtool_cls.get_file = get_file
+
+                self.assertTrue(self.repository.get_file_exists('readme',
+                                                                'e965047'))
+                self.assertEqual(self.repository.get_file('readme',
+                                                          'e965047'),
+                                 'Hello\n')
+                self.assertRaises(SCMError, self.repository.get_file,
+                                  'readme', 'HEAD')
+
+                # Syncing again updates the existing mirror.
+                tool.sync_mirror()
+        finally:
+            shutil.rmtree(mirror_dir)
+
+    def test_get_file_not_in_mirror(self):
+        """Testing Repository.get_file with files that aren't blobs in a
+        remote repository's mirror
+        """
+        def get_file(self, path, revision):
+            return 'Fetched %s from the repository' % revision
+
+        mirror_dir = mkdtemp()
+
+        try:
+            with self.settings(GIT_MIRROR_DIR=mirror_dir):
+                self._create_mirror()
+                self.scmtool_cls.get_file = get_file
+
+                # This object isn't in the mirror.
+                sha1 = '0123456789abcdef0123456789abcdef01234567'
+                self.assertEqual(self.repository.get_file('readme', sha1),
+                                 'Fetched %s from the repository' % sha1)
+
+                # This is a commit, not a blob.
+                sha1 = '224589cf334e9baafeac1165be5e5c04991fd65e'
+                self.assertEqual(self.repository.get_file('readme', sha1),
+                                 'Fetched %s from the repository' % sha1)
+        finally:
+            shutil.rmtree(mirror_dir)
+
+    def test_sync_mirror_moves_new_mirror_into_place(self):
+        """Testing GitTool.sync_mirror creates new mirrors in a temporary
+        directory
+        """
+        def fetch_into(git_dir, init=False):
+            fetches.append((git_dir, init))
+            old_fetch_into(git_dir, init)
+
+            self.assertFalse(os.path.exists(
+                os.path.join(mirror_dir, '%s.git' % self.repository.pk)))
+
+        fetches = []
+        mirror_dir = mkdtemp()
+
+        try:
+            with self.settings(GIT_MIRROR_DIR=mirror_dir):
+                tool = self._get_remote_tool()
+                old_fetch_into = tool.client.fetch_into
+                tool.client.fetch_into = fetch_into
+                tool.sync_mirror()
+
+            self.assertEqual(len(fetches), 1)
+            temp_dir, init = fetches[0]
+            self.assertTrue(init)
+            self.assertEqual(os.path.dirname(temp_dir), mirror_dir)
+            self.assertTrue(os.path.basename(temp_dir).startswith('.tmp-'))
+            self.assertEqual(os.listdir(mirror_dir),
+                             ['%s.git' % self.repository.pk])
+        finally:
+            shutil.rmtree(mirror_dir)
+
+    def test_sync_mirror_failure(self):
+        """Testing GitTool.sync_mirror removes new mirrors that fail to sync"""
+        def fetch_into(git_dir, init=False):
+            self.assertTrue(os.path.isdir(git_dir))
+            raise SCMError('Unable to fetch')
+
+        mirror_dir = mkdtemp()
+
+        try:
+            with self.settings(GIT_MIRROR_DIR=mirror_dir):
+                tool = self._get_remote_tool()
+                tool.client.fetch_into = fetch_into
+
+                self.assertRaises(SCMError, tool.sync_mirror)
+
+            self.assertEqual(os.listdir(mirror_dir), [])
+        finally:
+            shutil.rmtree(mirror_dir)
+
     def test_get_file_exists_signals(self):
         """Testing Repository.get_file_exists emits signals"""
         def on_checking(sender, path, revision, request, **kwargs):
@@ -328,6 +1422,27 @@ class RepositoryTests(DjangoTestCase):
                          ('checked_file_exists', path, revision, request))
 
 
+    def _get_remote_tool(self):
+        """Returns the SCMTool for the repository as a remote repository.
+
+        The repository's client reads from the local test repository.
+        """
+        self.repository.path = 'git://example.com/repo.git'
+        self.repository.save()
+
+        tool = self.repository.get_scmtool()
+        tool.client.path = self.local_repo_path
+
+        return tool
+
+    def _create_mirror(self):
+        """Creates a mirror of the repository in GIT_MIRROR_DIR."""
+        tool = self._get_remote_tool()
+        tool.sync_mirror()
+
+        return tool
+
+
 class BZRTests(SCMTestCase):
     """Unit tests for bzr."""
     fixtures = ['test_scmtools']
@@ -350,6 +1465,52 @@ class BZRTests(SCMTestCase):
         except ImportError:
             raise nose.SkipTest('bzrlib is not installed')
 
+    def test_get_file_reuses_branch_and_revision_tree(self):
+        """Testing BZRTool.get_file reuses opened branches and revision trees"""
+        if not bzr.has_bzrlib:
+            raise nose.SkipTest('bzrlib is not installed')
+
+        bzr._branches.clear()
+        bzr._revision_trees.clear()
+        bzr._revision_ids.clear()
+
+        contents = self.tool.get_file('README', HEAD)
+        self.assertNotEqual(contents, None)
+        self.assertEqual(len(bzr._branches), 1)
+        self.assertEqual(len(bzr._revision_trees), 1)
+        revtree = bzr._revision_trees.values()[0]
+
+        self.assertEqual(self.tool.get_file('README', HEAD), contents)
+        self.assertEqual(self.tool.get_file('missing-file', HEAD), '')
+        self.assertEqual(len(bzr._branches), 1)
+        self.assertEqual(bzr._revision_trees.values(), [revtree])
+
+    def test_get_file_with_stale_branch(self):
+        """Testing BZRTool.get_file reopens cached branches that fail"""
+        if not bzr.has_bzrlib:
+            raise nose.SkipTest('bzrlib is not installed')
+
+        class StaleBranch(object):
+            def lock_read(self):
+                raise bzr.BzrError('Connection closed')
+
+        bzr._branches.clear()
+        bzr._revision_trees.clear()
+        bzr._revision_ids.clear()
+
+        contents = self.tool.get_file('README', HEAD)
+        key = bzr._branches.keys()[0]
+        self.assertEqual(key[0], self.repository.pk)
+
+        stale_branch = StaleBranch()
+        bzr._branches[key] = (stale_branch, threading.Lock())
+        bzr._revision_trees[(stale_branch, 'revision')] = None
+
+        self.assertEqual(self.tool.get_file('README', HEAD), contents)
+        self.assertEqual(len(bzr._branches), 1)
+        self.assertFalse(bzr._branches.values()[0][0] is stale_branch)
+        self.assertFalse((stale_branch, 'revision') in bzr._revision_trees)
+
     def test_ssh(self):
         """Testing a SSH-backed bzr repository"""
         self._test_ssh(self.bzr_ssh_path, 'README')
@@ -363,6 +1524,205 @@ class BZRTests(SCMTestCase):
         self._test_ssh(self.bzr_sftp_path, 'README')
 
 
+class FakeClearToolPopen(object):
+    """A fake "cleartool -status" process.
+
+    responses maps the arguments of each command to a tuple of its output,
+    error messages and exit status. Once alive is set to False, the process
+    stops responding, as if it had exited.
+    """
+    def __init__(self, responses, errors_path):
+        self.responses = responses
+        self.commands = []
+        self.alive = True
+        self.stdin = self
+        self.stdout = self
+        self._errors = open(errors_path, 'ab')
+        self._lines = []
+
+    def write(self, data):
+        args = tuple(shlex.split(data))
+
+        if args == ('quit',) or not self.alive:
+            return
+
+        self.commands.append(args)
+        output, errors, status = self.responses[args]
+
+        self._errors.write(errors)
+        self._errors.flush()
+
+        # Output without a trailing newline is followed by the status on
+        # the same line.
+        status_line = ('Command %d returned status %d\n'
+                       % (len(self.commands), status))
+        self._lines += (output + status_line).splitlines(True)
+
+    def flush(self):
+        pass
+
+    def readline(self):
+        if self._lines and self.alive:
+            return self._lines.pop(0)
+
+        return ''
+
+    def close(self):
+        self._errors.close()
+
+    def wait(self):
+        pass
+
+
+class FakeClearToolProcess(ClearToolProcess):
+    """A ClearToolProcess that runs a FakeClearToolPopen."""
+    responses = {}
+    instances = []
+
+    def _popen(self, cwd, stderr):
+        self.instances.append(self)
+
+        return FakeClearToolPopen(self.responses, stderr.name)
+
+
+class ClearCaseTests(DjangoTestCase):
+    """Unit tests for ClearCase."""
+    def setUp(self):
+        super(ClearCaseTests, self).setUp()
+
+        FakeClearToolProcess.responses = {
+            ('lsview', '-full', '-properties', '-cview'):
+                ('Properties: snapshot readwrite\n', '', 0),
+            ('describe', '-short', 'vob:.'):
+                ('/vobs/test\n', '', 0),
+            ('desc', '-fmt', '%m', 'a.c@@'):
+                ('file element', '', 0),
+            ('desc', '-fmt', '%m', 'b.c@@'):
+                ('file element', '', 0),
+            ('desc', '-fmt', '%m', 'c.c@@'):
+                ('file element', '', 0),
+            ('desc', '-fmt', '%m', 'private.c@@'):
+                ('view private object', '', 0),
+            ('desc', '-fmt', '%m', 'missing.c@@'):
+                ('', 'cleartool: Error: Unable to access "missing.c@@".\n',
+                 1),
+        }
+        FakeClearToolProcess.instances = []
+
+        self.session = ClearToolSession('/vobs/test')
+        self.session.process_class = FakeClearToolProcess
+        clearcase._object_kinds.clear()
+
+    def tearDown(self):
+        super(ClearCaseTests, self).tearDown()
+
+        self.session.close()
+        clearcase._sessions.pop('/vobs/test', None)
+        clearcase._object_kinds.clear()
+
+    def test_cleartool_process_run(self):
+        """Testing ClearToolProcess.run"""
+        process = FakeClearToolProcess('/vobs/test')
+
+        self.assertEqual(process.run(['describe', '-short', 'vob:.']),
+                         (0, '/vobs/test\n', ''))
+        self.assertEqual(process.run(['desc', '-fmt', '%m', 'a.c@@']),
+                         (0, 'file element', ''))
+        self.assertEqual(process.run(['desc', '-fmt', '%m', 'missing.c@@']),
+                         (1, '',
+                          'cleartool: Error: Unable to access '
+                          '"missing.c@@".\n'))
+        self.assertEqual(process.p.commands, [
+            ('describe', '-short', 'vob:.'),
+            ('desc', '-fmt', '%m', 'a.c@@'),
+            ('desc', '-fmt', '%m', 'missing.c@@'),
+        ])
+
+        # The error messages are removed from the file once read.
+        self.assertEqual(os.path.getsize(process._errors_path), 0)
+        self.assertEqual(process.run(['desc', '-fmt', '%m', 'missing.c@@']),
+                         (1, '',
+                          'cleartool: Error: Unable to access '
+                          '"missing.c@@".\n'))
+        self.assertEqual(os.path.getsize(process._errors_path), 0)
+
+        process.close()
+        self.assertFalse(os.path.exists(process._errors_path))
+
+    def test_cleartool_process_run_after_exit(self):
+        """Testing ClearToolProcess.run after cleartool exits"""
+        process = FakeClearToolProcess('/vobs/test')
+        process.p.alive = False
+
+        self.assertRaises(IOError,
+                          lambda: process.run(['describe', '-short',
+                                               'vob:.']))
+        process.close()
+
+    def test_cleartool_session_error(self):
+        """Testing ClearToolSession.run with a failed command"""
+        try:
+            self.session.run(['desc', '-fmt', '%m', 'missing.c@@'])
+            self.fail('SCMError was not raised')
+        except SCMError, e:
+            self.assertEqual(str(e),
+                             'cleartool: Error: Unable to access '
+                             '"missing.c@@".\n')
+
+        # The process is still usable after a failed command.
+        self.assertEqual(self.session.run(['describe', '-short', 'vob:.']),
+                         '/vobs/test\n')
+        self.assertEqual(len(FakeClearToolProcess.instances), 1)
+
+    def test_cleartool_session_restart(self):
+        """Testing ClearToolSession.run restarts cleartool after it exits"""
+        self.session.run(['describe', '-short', 'vob:.'])
+        self.session._process.p.alive = False
+
+        self.assertEqual(self.session.run(['describe', '-short', 'vob:.']),
+                         '/vobs/test\n')
+        self.assertEqual(len(FakeClearToolProcess.instances), 2)
+
+    def test_get_object_kind_caching(self):
+        """Testing ClearCaseTool caches the kinds of elements"""
+        clearcase._sessions['/vobs/test'] = self.session
+        tool = ClearCaseTool(Repository(name='ClearCase', path='/vobs/test'))
+        old_max_object_kinds = clearcase.MAX_OBJECT_KINDS
+        clearcase.MAX_OBJECT_KINDS = 2
+
+        def get_num_desc_calls(path):
+            return FakeClearToolProcess.instances[0].p.commands.count(
+                ('desc', '-fmt', '%m', path))
+
+        try:
+            self.assertEqual(tool._get_object_kind('a.c@@'), 'file element')
+            self.assertEqual(tool._get_object_kind('a.c@@'), 'file element')
+            self.assertEqual(get_num_desc_calls('a.c@@'), 1)
+
+            # Objects that aren't elements can become elements later, so
+            # they aren't cached.
+            tool._get_object_kind('private.c@@')
+            tool._get_object_kind('private.c@@')
+            self.assertEqual(get_num_desc_calls('private.c@@'), 2)
+
+            # Using b.c keeps it in the cache when c.c is added, and a.c
+            # is dropped instead.
+            tool._get_object_kind('b.c@@')
+            tool._get_object_kind('a.c@@')
+            tool._get_object_kind('b.c@@')
+            tool._get_object_kind('c.c@@')
+            self.assertEqual(clearcase._object_kinds.keys(), [
+                ('/vobs/test', 'b.c@@'),
+                ('/vobs/test', 'c.c@@'),
+            ])
+
+            tool._get_object_kind('a.c@@')
+            self.assertEqual(get_num_desc_calls('a.c@@'), 2)
+            self.assertEqual(get_num_desc_calls('b.c@@'), 1)
+        finally:
+            clearcase.MAX_OBJECT_KINDS = old_max_object_kinds
+
+
 class CVSTests(SCMTestCase):
     """Unit tests for CVS."""
     fixtures = ['test_scmtools']
@@ -434,6 +1794,65 @@ class CVSTests(SCMTestCase):
         self.assertRaises(FileNotFoundError,
                           lambda: self.tool.get_file('hello', PRE_CREATION))
 
+    def test_get_file_outside_repository(self):
+        """Testing CVSTool.get_file with paths outside of the repository"""
+        rev = Revision('1.1')
+
+        for path in ('/etc/hostname',
+                     '../../etc/hostname',
+                     'test/../../../etc/hostname',
+                     '..\\..\\boot.ini',
+                     'C:\\boot.ini',
+                     '-dtest'):
+            self.assertRaises(FileNotFoundError,
+                              lambda: self.tool.get_file(path, rev))
+
+    def test_read_checked_out_file_outside_checkout(self):
+        """Testing CVSClient._read_checked_out_file with files outside of
+        the checkout directory
+        """
+        parent_dir = mkdtemp()
+
+        try:
+            checkout_dir = os.path.join(parent_dir, 'checkout')
+            secret_path = os.path.join(parent_dir, 'secret')
+            os.mkdir(checkout_dir)
+            open(secret_path, 'w').write('secret')
+            open(os.path.join(checkout_dir, 'file'), 'w').write('data')
+            os.symlink(secret_path, os.path.join(checkout_dir, 'link'))
+
+            client = self.tool.client
+            self.assertEqual(
+                client._read_checked_out_file(checkout_dir, 'file'), 'data')
+
+            for path in (secret_path, '../secret', 'link'):
+                self.assertEqual(
+                    client._read_checked_out_file(checkout_dir, path), None)
+        finally:
+            shutil.rmtree(parent_dir)
+
+    def test_get_files(self):
+        """Testing CVSTool.get_files"""
+        rev = Revision('1.1')
+        cwd_contents = os.listdir(os.getcwd())
+
+        self.assertEqual(
+            self.tool.get_files([
+                ('test/testfile', rev),
+                ('CVSROOT/modules', HEAD),
+                (self.tool.repopath + '/test/testfile,v', rev),
+            ]),
+            [
+                'test content\n',
+                self.tool.get_file('CVSROOT/modules', HEAD),
+                'test content\n',
+            ])
+        self.assertRaises(
+            FileNotFoundError,
+            lambda: self.tool.get_files([('test/testfile', rev),
+                                         ('test/testfile2', rev)]))
+        self.assertEqual(os.listdir(os.getcwd()), cwd_contents)
+
     def test_revision_parsing(self):
         """Testing revision number parsing"""
         self.assertEqual(self.tool.parse_diff_revision('', 'PRE-CREATION')[1],
@@ -731,6 +2150,30 @@ class SubversionTests(SCMTestCase):
         file = self.tool.get_file(filename, rev)
         patch(diff, file, filename)
 
+    def test_get_files_caches_keywords(self):
+        """Testing SVNTool.get_files caches svn:keywords"""
+        self.repository.save()
+        self.tool = self.repository.get_scmtool()
+        cache.clear()
+
+        filename = 'trunk/doc/misc-docs/Makefile'
+        rev = Revision('4')
+        files = self.tool.get_files([
+            (filename, rev),
+            (filename, Revision('2')),
+        ])
+
+        self.assertEqual(len(files), 2)
+        self.assertEqual(files[0], self.tool.get_file(filename, rev))
+
+        keywords = cache.get(self.tool._make_keywords_cache_key(filename, rev))
+        self.assertTrue(keywords)
+        self.assertEqual(self.tool.get_keywords(filename, rev), keywords)
+
+        # HEAD can change, so it shouldn't be cached.
+        self.assertEqual(self.tool._make_keywords_cache_key(filename, HEAD),
+                         None)
+
     def test_unterminated_keyword_diff(self):
         """Testing parsing SVN diff with unterminated keywords"""
         diff = ("Index: Makefile\n"
@@ -900,6 +2343,130 @@ class PerforceTests(SCMTestCase):
         self.assertEqual(md5(desc.summary).hexdigest(),
                          '99a335676b0e5821ffb2f7469d4d7019')
 
+    @online_only
+    def test_get_changesets(self):
+        """Testing PerforceClient.get_changesets with several changes"""
+        changesets = self.tool.client.get_changesets([157, 158])
+        self.assertEqual(sorted(changesets.keys()), ['157', '158'])
+
+        changeset = self.tool.parse_change_desc(changesets['157'], 157)
+        self.assertEqual(md5(changeset.description).hexdigest(),
+                         'b7eff0ca252347cc9b09714d07397e64')
+
+    @online_only
+    def test_connection_reuse(self):
+        """Testing PerforceTool reuses connections between commands"""
+        pool = self.tool.client.pool
+        pool.shutdown()
+
+        self.tool.get_file('//public/perforce/api/python/P4Client/p4.py', 1)
+        self.assertEqual(len(pool._idle), 1)
+        conn = pool._idle[0]
+
+        self.tool.get_changeset(157)
+        self.assertEqual(len(pool._idle), 1)
+        self.assertTrue(pool._idle[0] is conn)
+        self.assertTrue(conn.is_alive())
+
+    @online_only
+    def test_dropped_connection(self):
+        """Testing PerforceTool reconnects after a dropped connection"""
+        pool = self.tool.client.pool
+        pool.shutdown()
+
+        self.tool.get_file('//public/perforce/api/python/P4Client/p4.py', 1)
+        conn = pool._idle[0]
+        conn.close()
+
+        # The connection should be noticed as dead and replaced.
+        self.tool.get_changeset(157)
+        self.assertEqual(len(pool._idle), 1)
+        self.assertFalse(pool._idle[0] is conn)
+
+    def test_expired_login(self):
+        """Testing PerforceTool logs in again after its login expires"""
+        from P4 import P4Exception
+
+        class FakeP4(object):
+            def __init__(self):
+                self.is_connected = True
+
+            def connected(self):
+                return self.is_connected
+
+            def disconnect(self):
+                self.is_connected = False
+
+        def _connect():
+            conn = PerforceConnection(FakeP4())
+            connections.append(conn)
+            return conn
+
+        def worker(p4):
+            if len(connections) == 1:
+                raise P4Exception('Your session has expired, please login '
+                                  'again.')
+
+            return 'result'
+
+        connections = []
+        pool = self.tool.client.pool
+        pool.shutdown()
+        pool._connect = _connect
+
+        self.assertEqual(pool.run(worker), 'result')
+        self.assertEqual(len(connections), 2)
+        self.assertFalse(connections[0].is_alive())
+        self.assertEqual(pool._idle, [connections[1]])
+
+    def test_connect_failure_with_stunnel(self):
+        """Testing PerforceConnectionPool only replaces its stunnel proxy
+        when it has died
+        """
+        import P4
+
+        class FakeProxy(object):
+            port = 1666
+
+            def __init__(self):
+                self.alive = True
+
+            def is_alive(self):
+                return self.alive
+
+        class FakeP4(object):
+            def connect(self):
+                raise P4.P4Exception(errors[0])
+
+            def connected(self):
+                return False
+
+        errors = []
+        pool = PerforceConnectionPool('example.com:1666', 'user', 'pass',
+                                      None, use_stunnel=True)
+        proxy = FakeProxy()
+        pool.proxy = proxy
+        old_p4 = P4.P4
+        P4.P4 = FakeP4
+
+        try:
+            errors[:] = ['[P4.connect()] TCP connect to 127.0.0.1:1666 '
+                         'failed.']
+            self.assertRaises(P4.P4Exception, pool._connect)
+            self.assertTrue(pool.proxy is proxy)
+
+            proxy.alive = False
+            errors[:] = ['Perforce password (P4PASSWD) invalid or unset.']
+            self.assertRaises(P4.P4Exception, pool._connect)
+            self.assertTrue(pool.proxy is proxy)
+
+            errors[:] = ['[P4.connect()] TCP connect to 127.0.0.1:1666 '
+                         'failed.']
+            self.assertRaises(P4.P4Exception, pool._connect)
+            self.assertEqual(pool.proxy, None)
+        finally:
+            P4.P4 = old_p4
+
     @online_only
     def test_encoding(self):
         """Testing PerforceTool.get_changeset with a specified encoding"""
@@ -1377,6 +2944,72 @@ class MercurialTests(SCMTestCase):
         self.assertRaises(FileNotFoundError,
                           lambda: self.tool.get_file('hello', PRE_CREATION))
 
+    def test_repository_handle_reuse(self):
+        """Testing HgClient shares repository handles and changectxs"""
+        rev = Revision('661e5dd3c493')
+        client = self.tool.client
+
+        self.assertEqual(client.cat_files([('doc/readme', str(rev))]),
+                         ['Hello\n\ngoodbye\n'])
+        self.assertTrue(str(rev) in client.handle._changectxs)
+
+        # A new tool for the same repository uses the same handle.
+        tool = self.repository.tool.get_scmtool_class()(self.repository)
+        self.assertTrue(tool.client.handle is client.handle)
+
+        # Names like 'tip' can move, and so aren't kept.
+        client.cat_file('doc/readme', 'tip')
+        self.assertFalse('tip' in client.handle._changectxs)
+
+    def test_repository_handle_reopen(self):
+        """Testing HgClient opens the repository again after a failed
+        lookup
+        """
+        class DeadRepository(object):
+            def changectx(self, rev):
+                raise IOError('Connection lost')
+
+        client = self.tool.client
+        client.handle.repo = DeadRepository()
+
+        client.handle._last_reopen = 0
+
+        self.assertEqual(client.cat_file('doc/readme', '661e5dd3c493'),
+                         'Hello\n\ngoodbye\n')
+        self.assertFalse(isinstance(client.repo, DeadRepository))
+
+    def test_repository_handle_reopen_limited(self):
+        """Testing HgClient doesn't keep opening the repository again for
+        missing revisions
+        """
+        from mercurial import error
+
+        class MissingRevRepository(object):
+            def changectx(self, rev):
+                raise error.RepoLookupError('unknown revision %r' % rev)
+
+        class BrokenRepository(object):
+            def changectx(self, rev):
+                raise ValueError(rev)
+
+        client = self.tool.client
+
+        # The repository was just opened again, so it won't be yet again.
+        client.handle._last_reopen = time.time()
+        client.handle.repo = MissingRevRepository()
+        self.assertRaises(FileNotFoundError, client.cat_file, 'doc/readme',
+                          '0123456789ab')
+        self.assertTrue(isinstance(client.repo, MissingRevRepository))
+
+        # Other errors never open the repository again.
+        client.handle._last_reopen = 0
+        client.handle.repo = BrokenRepository()
+        self.assertRaises(FileNotFoundError, client.cat_file, 'doc/readme',
+                          '0123456789ab')
+        self.assertTrue(isinstance(client.repo, BrokenRepository))
+
+        client.handle.reopen()
+
     def test_interface(self):
         """Testing basic HgTool API"""
         self.assertTrue(self.tool.get_diffs_use_absolute_paths())
@@ -1835,6 +3468,116 @@ class GitTests(SCMTestCase):
         self.assertRaises(FileNotFoundError,
                           lambda: self.tool.get_file("readme", "0000000"))
 
+    def test_get_files(self):
+        """Testing GitTool.get_files"""
+        self.assertEqual(
+            self.tool.get_files([("readme", "e965047"),
+                                 ("readme", PRE_CREATION),
+                                 ("readme", "d6613f5")]),
+            ['Hello\n', '', 'Hello there\n'])
+
+        self.assertRaises(
+            FileNotFoundError,
+            lambda: self.tool.get_files([("readme", "e965047"),
+                                         ("readme", "0000000")]))
+
+    def test_get_file_reuses_cat_file_process(self):
+        """Testing GitTool.get_file reuses git cat-file processes"""
+        pool = get_cat_file_pool(self.tool.client.git_dir, '--batch')
+        pool.close_idle()
+
+        self.assertEqual(self.tool.get_file("readme", "e965047"), 'Hello\n')
+        self.assertEqual(len(pool._idle), 1)
+        process = pool._idle[0]
+
+        self.assertEqual(self.tool.get_file("readme", "d6613f5"),
+                         'Hello there\n')
+        self.assertEqual(pool._idle, [process])
+
+        pool.close_idle()
+        self.assertEqual(pool._idle, [])
+
+    def test_get_file_restarts_dead_cat_file_process(self):
+        """Testing GitTool.get_file restarts dead git cat-file processes"""
+        pool = get_cat_file_pool(self.tool.client.git_dir, '--batch')
+        pool.close_idle()
+
+        self.assertEqual(self.tool.get_file("readme", "e965047"), 'Hello\n')
+        process = pool._idle[0]
+        process.p.kill()
+        process.p.wait()
+
+        self.assertEqual(self.tool.get_file("readme", "e965047"), 'Hello\n')
+        self.assertEqual(len(pool._idle), 1)
+        self.assertNotEqual(pool._idle[0], process)
+        pool.close_idle()
+
+    def test_cat_file_pool_failed_process(self):
+        """Testing GitCatFilePool replaces processes that fail mid-request"""
+        pool = GitCatFilePool(self.tool.client.git_dir, '--batch-check')
+        self.assertEqual(pool.lookup('e965047'), ('blob', None))
+
+        process = pool._idle[0]
+        process.p.stdin.close()
+
+        self.assertEqual(pool.lookup('e965047'), ('blob', None))
+        self.assertEqual(pool.lookup('fffffff'), (None, None))
+        self.assertNotEqual(pool._idle[0], process)
+        pool.close_idle()
+
+    def test_cat_file_pool_closes_process_on_error(self):
+        """Testing GitCatFilePool shuts down processes when requests raise
+        unexpected errors
+        """
+        def lookup(process, object_name):
+            processes.append(process)
+
+            raise KeyError(object_name)
+
+        processes = []
+        pool = GitCatFilePool(self.tool.client.git_dir, '--batch-check')
+
+        self.assertRaises(KeyError, pool.run_many, ['e965047'], lookup)
+        self.assertEqual(len(processes), 1)
+        self.assertFalse(processes[0].is_alive())
+        self.assertEqual(pool._idle, [])
+
+    def test_coprocess_pool_kills_hung_process(self):
+        """Testing CoProcessPool kills processes that don't respond"""
+        class HungProcess(CoProcess):
+            REQUEST_TIMEOUT = 0.1
+
+            def __init__(self):
+                super(HungProcess, self).__init__(['sleep', '30'])
+
+        def read_line(process, request):
+            line = process.p.stdout.readline()
+
+            if not line:
+                raise IOError('The process exited')
+
+            return line
+
+        class HungProcessPool(CoProcessPool):
+            process_class = HungProcess
+
+        pool = HungProcessPool()
+        self.assertRaises(SCMError, pool.run_many, ['request'], read_line)
+        self.assertEqual(pool._idle, [])
+
+    def test_get_file_not_found(self):
+        """Testing GitTool.get_file and get_files with missing files"""
+        sha1 = '0123456789abcdef0123456789abcdef01234567'
+
+        for func in (lambda: self.tool.get_file('readme', sha1),
+                     lambda: self.tool.get_files([('readme', sha1)])):
+            try:
+                func()
+                self.fail('FileNotFoundError was not raised')
+            except FileNotFoundError, e:
+                self.assertEqual(e.path, 'readme')
+                self.assertEqual(e.revision, sha1)
+
     def test_parse_diff_revision_with_remote_and_short_SHA1_error(self):
         """Testing GitTool.parse_diff_revision with remote files and short SHA1 error"""
         self.assertRaises(
@@ -224,6 +224,19 @@ LANGUAGE_COOKIE_NAME = "rblanguage"
 SESSION_COOKIE_NAME = "rbsessionid"
 SESSION_COOKIE_AGE = 365 * 24 * 60 * 60  # 1 year
 
+# An on-disk cache for files fetched from repositories, used when files
+# have been evicted from the main cache. Set REPOSITORY_FILE_CACHE_DIR
+# in settings_local.py to a directory writable by the web server to enable
+# it.
+REPOSITORY_FILE_CACHE_DIR = None
+REPOSITORY_FILE_CACHE_MAX_SIZE = 1024 * 1024 * 1024  # 1GB
+
+# Local bare mirrors of remote Git repositories, read from before going to
+# the repository. Set GIT_MIRROR_DIR in settings_local.py to a directory
+# writable by the web server, and run the sync_git_mirrors management
+# command periodically to create and update the mirrors.
+GIT_MIRROR_DIR = None
+
 # Default support settings
 DEFAULT_SUPPORT_URL = 'http://www.beanbaginc.com/support/reviewboard/' \
                       '?support-data=%(support_data)s'
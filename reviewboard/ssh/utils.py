@@ -86,5 +86,10 @@ def register_rbssh(envvar):
     specifically place it in the system environment using ``os.putenv``,
     while in others (Mercurial, Bazaar), we need to place it in ``os.environ``.
     """
+    # This is imported here, since reviewboard.scmtools.core imports this
+    # module.
+    from reviewboard.scmtools.core import clear_popen_envs
+
     os.putenv(envvar, 'rbssh')
     os.environ[envvar] = 'rbssh'
+    clear_popen_envs()
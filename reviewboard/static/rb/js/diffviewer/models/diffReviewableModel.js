@@ -35,11 +35,21 @@ RB.DiffReviewable = RB.AbstractReviewable.extend({
      *
      * The rendered file will be fetched from the server and eventually
      * returned as the argument to the success callback.
+     *
+     * If options.renderAnyway is set, the diff will be rendered even if
+     * the server would normally defer it (for generated, minified or
+     * vendored files).
      */
-    getRenderedDiff: function(callbacks, context) {
+    getRenderedDiff: function(callbacks, context, options) {
+        var url = this._buildRenderedDiffURL() +
+                  '?index=' + this.get('fileIndex') + '&' + AJAX_SERIAL;
+
+        if (options && options.renderAnyway) {
+            url += '&render-anyway=1';
+        }
+
         this._fetchFragment({
-            url: this._buildRenderedDiffURL() +
-                 '?index=' + this.get('fileIndex') + '&' + AJAX_SERIAL,
+            url: url,
             noActivityIndicator: true
         }, callbacks, context);
     },
@@ -412,6 +412,7 @@ RB.DiffReviewableView = RB.AbstractReviewableView.extend({
         'click .moved-to, .moved-from': '_onMovedLineClicked',
         'click .diff-collapse-btn': '_onCollapseChunkClicked',
         'click .diff-expand-btn': '_onExpandChunkClicked',
+        'click .render-anyway-btn': '_onRenderAnywayClicked',
         'mouseup': '_onMouseUp'
     },
 
@@ -844,6 +845,26 @@ RB.DiffReviewableView = RB.AbstractReviewableView.extend({
         }
     },
 
+    /*
+     * Handles clicks on the "Render anyway" button for deferred files.
+     *
+     * This fetches the fully rendered diff for the file and replaces the
+     * deferred placeholder with its contents.
+     */
+    _onRenderAnywayClicked: function(e) {
+        e.preventDefault();
+        e.stopPropagation();
+
+        this.model.getRenderedDiff({
+            success: function(html) {
+                this.$el.children('tbody.deferred')
+                    .replaceWith($(html).children('tbody'));
+            }
+        }, this, {
+            renderAnyway: true
+        });
+    },
+
     /*
      * Expands or collapses a chunk in a diff.
      *
@@ -8,6 +8,7 @@ class TestTool(GitTool):
     uses_atomic_revisions = True
     supports_authentication = True
     supports_post_commit = True
+    commits_page_size = 30
 
     def get_repository_info(self):
         return {
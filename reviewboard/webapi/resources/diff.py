@@ -72,6 +72,22 @@ class DiffResource(WebAPIResource):
                            'diffs or repository types, depending on how the '
                            'diff was uploaded.',
         },
+        'file_count': {
+            'type': int,
+            'description': 'The number of files modified in the diff.',
+        },
+        'binary_file_count': {
+            'type': int,
+            'description': 'The number of binary files modified in the diff.',
+        },
+        'insert_count': {
+            'type': int,
+            'description': 'The total number of lines inserted in the diff.',
+        },
+        'delete_count': {
+            'type': int,
+            'description': 'The total number of lines deleted in the diff.',
+        },
     }
     item_child_resources = [
         resources.filediff,
@@ -98,6 +114,18 @@ class DiffResource(WebAPIResource):
         return self.model.objects.filter(
             history__review_request=review_request)
 
+    def serialize_file_count_field(self, diffset, **kwargs):
+        return diffset.get_counts()['file_count']
+
+    def serialize_binary_file_count_field(self, diffset, **kwargs):
+        return diffset.get_counts()['binary_file_count']
+
+    def serialize_insert_count_field(self, diffset, **kwargs):
+        return diffset.get_counts()['insert_count']
+
+    def serialize_delete_count_field(self, diffset, **kwargs):
+        return diffset.get_counts()['delete_count']
+
     def get_parent_object(self, diffset):
         return diffset.history.review_request.get()
 
@@ -75,6 +75,7 @@ class RepositoryResource(WebAPIResource):
         resources.repository_info,
         resources.repository_branches,
         resources.repository_commits,
+        resources.repository_push,
     ]
     autogenerate_etags = True
 
@@ -0,0 +1,45 @@
+from django.core.exceptions import ObjectDoesNotExist
+from djblets.webapi.decorators import (webapi_login_required,
+                                       webapi_response_errors)
+from djblets.webapi.errors import DOES_NOT_EXIST, NOT_LOGGED_IN
+
+from reviewboard.webapi.base import WebAPIResource
+from reviewboard.webapi.decorators import webapi_check_local_site
+from reviewboard.webapi.resources import resources
+
+
+class RepositoryPushResource(WebAPIResource):
+    """Notifies the server of pushes to a repository.
+
+    Hooks in the repository (such as ``contrib/tools/repository-hook-push``)
+    should POST to this resource after each push or commit. The server's
+    cached branches and lists of commits for the repository are then
+    cleared, so that the new changes show up right away. This also lets the
+    server cache them for much longer between pushes, rather than going
+    back to the repository every few minutes.
+    """
+    name = 'push'
+    singleton = True
+    allowed_methods = ('POST',)
+    mimetype_item_resource_name = 'repository-push'
+
+    @webapi_check_local_site
+    @webapi_login_required
+    @webapi_response_errors(DOES_NOT_EXIST, NOT_LOGGED_IN)
+    def create(self, request, *args, **kwargs):
+        """Notifies the server that changes were pushed to the repository.
+
+        Any user with access to the repository can send notifications.
+        """
+        try:
+            repository = resources.repository.get_object(request, *args,
+                                                         **kwargs)
+        except ObjectDoesNotExist:
+            return DOES_NOT_EXIST
+
+        repository.notify_pushed()
+
+        return 200, {}
+
+
+repository_push_resource = RepositoryPushResource()
@@ -52,6 +52,9 @@ repository_commits_item_mimetype = _build_mimetype('repository-commits')
 repository_info_item_mimetype = _build_mimetype('repository-info')
 
 
+repository_push_item_mimetype = _build_mimetype('repository-push')
+
+
 review_list_mimetype = _build_mimetype('reviews')
 review_item_mimetype = _build_mimetype('review')
 
@@ -0,0 +1,54 @@
+from djblets.testing.decorators import add_fixtures
+
+from reviewboard.scmtools.models import Repository
+from reviewboard.webapi.tests.base import BaseWebAPITestCase
+from reviewboard.webapi.tests.mimetypes import repository_push_item_mimetype
+from reviewboard.webapi.tests.urls import get_repository_push_url
+
+
+class ResourceTests(BaseWebAPITestCase):
+    """Testing the RepositoryPushResource APIs."""
+    fixtures = ['test_users', 'test_scmtools']
+
+    #
+    # HTTP POST tests
+    #
+
+    def test_post(self):
+        """Testing the POST repositories/<id>/push/ API"""
+        repository = self.create_repository(tool_name='Test')
+        self.assertEqual(repository._get_last_push_time(), None)
+
+        rsp = self.apiPost(get_repository_push_url(repository),
+                           expected_status=200,
+                           expected_mimetype=repository_push_item_mimetype)
+        self.assertEqual(rsp['stat'], 'ok')
+
+        repository = Repository.objects.get(pk=repository.pk)
+        self.assertNotEqual(repository._get_last_push_time(), None)
+
+    @add_fixtures(['test_site'])
+    def test_post_with_site(self):
+        """Testing the POST repositories/<id>/push/ API with a local site"""
+        self._login_user(local_site=True)
+        repository = self.create_repository(with_local_site=True,
+                                            tool_name='Test')
+
+        rsp = self.apiPost(
+            get_repository_push_url(repository, self.local_site_name),
+            expected_status=200,
+            expected_mimetype=repository_push_item_mimetype)
+        self.assertEqual(rsp['stat'], 'ok')
+        self.assertNotEqual(repository._get_last_push_time(), None)
+
+    @add_fixtures(['test_site'])
+    def test_post_with_site_no_access(self):
+        """Testing the POST repositories/<id>/push/ API
+        with a local site and Permission Denied error
+        """
+        repository = self.create_repository(with_local_site=True)
+
+        self.apiPost(
+            get_repository_push_url(repository, self.local_site_name),
+            expected_status=403)
+        self.assertEqual(repository._get_last_push_time(), None)
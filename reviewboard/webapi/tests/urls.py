@@ -197,6 +197,15 @@ def get_repository_info_url(repository, local_site_name=None):
         repository_id=repository.pk)
 
 
+#
+# RepositoryPushResource
+#
+def get_repository_push_url(repository, local_site_name=None):
+    return resources.repository_push.get_list_url(
+        local_site_name=local_site_name,
+        repository_id=repository.pk)
+
+
 #
 # ReviewResource
 #